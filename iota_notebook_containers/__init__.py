@@ -1,8 +1,15 @@
+import threading
+
 from notebook.utils import url_path_join
 
+from iota_notebook_containers.build_artifacts import BuildArtifacts
+from iota_notebook_containers.containerization_metrics import ContainerizationMetricsHandler
 from iota_notebook_containers.export_to_ecr import CreateNewRepoHandler, ListRepoHandler, \
-    UploadToRepoHandler, IsContainerizationOngoingHandler, ExtensionLastModifiedHandler
+    UploadToRepoHandler, IsContainerizationOngoingHandler, ExtensionLastModifiedHandler, \
+    ContainerizationEstimateHandler
 from iota_notebook_containers.internal_log import create_logger
+from iota_notebook_containers.kernel_image_creator import KernelImageCreator
+from iota_notebook_containers.kernel_resource_usage import KernelResourceUsageHandler
 
 create_logger(__name__)
 
@@ -26,6 +33,13 @@ def load_jupyter_server_extension(nb_server_app):
         (url_path_join(web_app.settings['base_url'], r'/upload_to_repo'), UploadToRepoHandler), 
         (url_path_join(web_app.settings['base_url'], r'/upload_to_repo/is_ongoing'),
             IsContainerizationOngoingHandler),
+        (url_path_join(web_app.settings['base_url'], r'/upload_to_repo/estimate'), ContainerizationEstimateHandler),
+        (url_path_join(web_app.settings['base_url'], r'/upload_to_repo/metrics'), ContainerizationMetricsHandler),
         (url_path_join(web_app.settings['base_url'], r'/extension_version/is_latest'), ExtensionLastModifiedHandler),
-        (url_path_join(web_app.settings['base_url'], r'/list_repos'), ListRepoHandler)
-    ])
\ No newline at end of file
+        (url_path_join(web_app.settings['base_url'], r'/list_repos'), ListRepoHandler),
+        (url_path_join(web_app.settings['base_url'], r'/containerized_kernels/resource_usage'),
+            KernelResourceUsageHandler)
+    ])
+    # removes what containerizations interrupted by the previous server left behind, without delaying the startup
+    threading.Thread(target=BuildArtifacts.collect_safely, args=(KernelImageCreator.docker_client,),
+        daemon=True).start()
@@ -0,0 +1,110 @@
+"""
+Label and garbage collect the containers and images created while containerizing a notebook
+Every interim container and output image carries labels with its kind of artifact, the containerization's job id,
+the notebook and the kernel, so that they are found with server-side filters rather than by listing everything.
+The collection removes
+    1. interim containers of any job but the ongoing or a resumable one, e.g. left behind by a killed server
+    2. output images beyond the newest IOTA_BUILD_IMAGES_PER_NOTEBOOK of each notebook
+    3. the oldest output images, while all of them take up more than IOTA_BUILD_IMAGES_MAX_BYTES
+"""
+import logging
+import os
+
+from collections import Counter
+
+from iota_notebook_containers.build_journal import BuildJournal
+from iota_notebook_containers.constants import BUILD_ARTIFACT_LABEL, BUILD_JOB_ID_LABEL, BUILD_NOTEBOOK_LABEL, \
+    BUILD_KERNEL_LABEL, BUILD_IMAGES_PER_NOTEBOOK_ENV_VAR, BUILD_IMAGES_MAX_BYTES_ENV_VAR
+
+class BuildArtifacts(object):
+    INTERIM_CONTAINER = "interim_container"
+    OUTPUT_IMAGE = "output_image"
+    DEFAULT_IMAGES_PER_NOTEBOOK = 1
+
+    logger = logging.getLogger(__name__)
+
+    @classmethod
+    def get_labels(cls, artifact, job_id, notebook_path, kernel):
+        return {BUILD_ARTIFACT_LABEL: artifact, BUILD_JOB_ID_LABEL: job_id,
+            BUILD_NOTEBOOK_LABEL: notebook_path, BUILD_KERNEL_LABEL: kernel}
+
+    @classmethod
+    def list_containers(cls, docker_client, artifact):
+        return docker_client.containers.list(all=True, filters={"label": cls._get_label_filter(artifact)})
+
+    @classmethod
+    def list_images(cls, docker_client, artifact):
+        return docker_client.images.list(filters={"label": cls._get_label_filter(artifact)})
+
+    @classmethod
+    def collect(cls, docker_client, active_job_id=None, building_notebook_path=None):
+        """Removes the artifacts that the retention policy does not keep. The artifacts of the active job are
+        always kept, as is the interim container of a journaled build that a containerization may resume, and the
+        image being built for building_notebook_path counts towards that notebook's images."""
+        kept_job_ids = (active_job_id, BuildJournal.get_job_id())
+        for container in cls.list_containers(docker_client, cls.INTERIM_CONTAINER):
+            if container.labels.get(BUILD_JOB_ID_LABEL) not in kept_job_ids:
+                cls._remove(container.remove, force=True)
+
+        images_per_notebook = cls._get_images_per_notebook()
+        max_bytes = cls._get_max_bytes()
+        images = sorted(cls.list_images(docker_client, cls.OUTPUT_IMAGE),
+            key=lambda image: image.attrs["Created"], reverse=True)
+        image_counts = Counter()
+        if building_notebook_path:
+            image_counts[building_notebook_path] += 1
+        kept_images = []
+        for image in images:
+            notebook_path = image.labels.get(BUILD_NOTEBOOK_LABEL)
+            if image.labels.get(BUILD_JOB_ID_LABEL) == active_job_id or image_counts[notebook_path] < images_per_notebook:
+                image_counts[notebook_path] += 1
+                kept_images.append(image)
+            else:
+                cls._remove_image(docker_client, image)
+
+        if max_bytes is None:
+            return
+        total_bytes = sum(image.attrs["Size"] for image in kept_images)
+        for image in reversed(kept_images):
+            if total_bytes <= max_bytes:
+                break
+            if image.labels.get(BUILD_JOB_ID_LABEL) != active_job_id:
+                cls._remove_image(docker_client, image)
+                total_bytes -= image.attrs["Size"]
+
+    @classmethod
+    def collect_safely(cls, docker_client, active_job_id=None, building_notebook_path=None):
+        try:
+            cls.collect(docker_client, active_job_id, building_notebook_path)
+        except Exception:
+            cls.logger.exception("Caught unhandled exception while removing containerization artifacts.")
+
+    @classmethod
+    def _get_label_filter(cls, artifact):
+        return "{}={}".format(BUILD_ARTIFACT_LABEL, artifact)
+
+    @classmethod
+    def _get_images_per_notebook(cls):
+        return int(os.environ.get(BUILD_IMAGES_PER_NOTEBOOK_ENV_VAR, cls.DEFAULT_IMAGES_PER_NOTEBOOK))
+
+    @classmethod
+    def _get_max_bytes(cls):
+        max_bytes = os.environ.get(BUILD_IMAGES_MAX_BYTES_ENV_VAR)
+        return int(max_bytes) if max_bytes else None
+
+    @classmethod
+    def _remove_image(cls, docker_client, image):
+        cls.logger.info("Removing containerization output image {} of {}".format(
+            image.id, image.labels.get(BUILD_NOTEBOOK_LABEL)))
+        # containers started from the output image, e.g. to try it out, would keep it from being removed
+        for container in docker_client.containers.list(all=True, filters={"ancestor": image.id}):
+            cls._remove(container.remove, force=True)
+        cls._remove(docker_client.images.remove, image.id, force=True)
+
+    @classmethod
+    def _remove(cls, remove, *args, **kwargs):
+        # one artifact that cannot be removed, e.g. because it is already being removed, does not stop the others
+        try:
+            remove(*args, **kwargs)
+        except Exception:
+            cls.logger.exception("Failed to remove a containerization artifact.")
@@ -0,0 +1,164 @@
+"""
+Govern the resources a containerization uses, so that the interactive kernels on the instance stay responsive
+    1. reading the files copied onto the container is capped at IOTA_BUILD_READ_BYTES_PER_SECOND
+    2. the thread building the image uses at most IOTA_BUILD_CPU_BUDGET of a CPU
+    3. helper processes run with the idle I/O priority and the lowest CPU priority
+    4. the heartbeats of the running kernels are timed every PROBE_INTERVAL_SECONDS. While the slowest one takes longer
+       than IOTA_BUILD_KERNEL_LATENCY_MS, the build halves the share of the time it spends working, down to
+       MIN_WORK_SHARE, and once they answer quickly again it doubles the share back.
+The build thread calls pace between units of work, which sleeps for as long as the limits require.
+
+The heartbeat latency is only a proxy for how responsive the kernels are. ipykernel answers heartbeats from a
+separate thread, so a kernel busy running a cell, or waiting on a slow disk, still answers quickly. What the
+latency does reflect is how long a kernel process waits to be scheduled, i.e. how starved of CPU the instance is.
+Since the probe runs on the build thread, it only waits for as long as it takes to tell a slow kernel apart, i.e.
+IOTA_BUILD_KERNEL_LATENCY_MS, and connection files that never answered, e.g. because they outlived their kernel,
+are not probed again.
+"""
+import glob
+import json
+import logging
+import os
+import shutil
+import time
+import zmq
+
+from collections import Counter
+from iota_notebook_containers.constants import JUPYTER_RUNTIME_FOLDER, BUILD_READ_BYTES_PER_SECOND_ENV_VAR, \
+    BUILD_CPU_BUDGET_ENV_VAR, BUILD_KERNEL_LATENCY_MS_ENV_VAR
+
+class BuildGovernor(object):
+    DEFAULT_KERNEL_LATENCY_MS = 250
+    # idle pooled kernels keep their connection files in a subfolder, so they are not probed
+    KERNEL_CONNECTION_FILES = os.path.join(JUPYTER_RUNTIME_FOLDER, "kernel-*.json")
+    # a kernel that answered before and then misses this many probes in a row is taken to be gone
+    MAX_MISSED_PROBES = 3
+    MIN_SLEEP_SECONDS = 0.01
+    MIN_WORK_SHARE = 1 / 8
+    PROBE_INTERVAL_SECONDS = 5
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, read_bytes_per_second=None, cpu_budget=None, kernel_latency_ms=DEFAULT_KERNEL_LATENCY_MS):
+        self.read_bytes_per_second = read_bytes_per_second
+        self.cpu_budget = cpu_budget
+        self.kernel_latency_ms = kernel_latency_ms
+        self.work_share = 1.0
+        self._last_pace = self._last_probe = time.monotonic()
+        self._last_cpu_time = time.thread_time()
+        self._sleep_debt_seconds = 0
+        self._responsive_connection_files = set()
+        self._unresponsive_connection_files = set()
+        self._missed_probes = Counter()
+
+    @classmethod
+    def from_env(cls):
+        read_bytes_per_second = os.environ.get(BUILD_READ_BYTES_PER_SECOND_ENV_VAR)
+        cpu_budget = os.environ.get(BUILD_CPU_BUDGET_ENV_VAR)
+        return cls(read_bytes_per_second=int(read_bytes_per_second) if read_bytes_per_second else None,
+            cpu_budget=float(cpu_budget) if cpu_budget else None,
+            kernel_latency_ms=int(os.environ.get(BUILD_KERNEL_LATENCY_MS_ENV_VAR, cls.DEFAULT_KERNEL_LATENCY_MS)))
+
+    @classmethod
+    def get_helper_command_prefix(cls):
+        prefix = []
+        if shutil.which("ionice"):
+            prefix += ["ionice", "-c", "3"]
+        if shutil.which("nice"):
+            prefix += ["nice", "-n", "19"]
+        return prefix
+
+    def pace(self, bytes_read=0):
+        """Sleeps as long as the work done since the previous call requires to stay within the limits. Sleeps
+        shorter than MIN_SLEEP_SECONDS are saved up, while time spent below the limits is not saved up for later.
+        Returns the seconds spent sleeping and probing the kernels."""
+        now = time.monotonic()
+        cpu_time = time.thread_time()
+        worked_seconds = now - self._last_pace
+        required_seconds = [worked_seconds / self.work_share]
+        if self.read_bytes_per_second:
+            required_seconds.append(bytes_read / self.read_bytes_per_second)
+        if self.cpu_budget:
+            required_seconds.append((cpu_time - self._last_cpu_time) / self.cpu_budget)
+        self._sleep_debt_seconds = max(self._sleep_debt_seconds + max(required_seconds) - worked_seconds, 0)
+        if self._sleep_debt_seconds >= self.MIN_SLEEP_SECONDS:
+            time.sleep(self._sleep_debt_seconds)
+            self._sleep_debt_seconds = 0
+        # the probe itself does not count as work
+        if self.kernel_latency_ms and time.monotonic() - self._last_probe >= self.PROBE_INTERVAL_SECONDS:
+            self._adjust_work_share(self.probe_kernel_latency_ms())
+            self._last_probe = time.monotonic()
+        self._last_pace = time.monotonic()
+        self._last_cpu_time = time.thread_time()
+        return self._last_pace - now
+
+    def probe_kernel_latency_ms(self):
+        """Returns how long the slowest running kernel took to answer a heartbeat, or None if none answered.
+        All kernels are pinged at once and the probe waits at most kernel_latency_ms, since a kernel that answers
+        later is slow either way. A kernel that answered before and no longer answers counts as slow, until it missed
+        MAX_MISSED_PROBES in a row. From then on, as well as for connection files that never answered, e.g. because
+        they outlived their kernel, the connection file is not probed again."""
+        timeout_ms = self.kernel_latency_ms
+        context = zmq.Context.instance()
+        connection_files = {}
+        existing_connection_files = set(glob.glob(self.KERNEL_CONNECTION_FILES))
+        # forget the connection files removed since, so that the remembered ones do not pile up
+        self._responsive_connection_files &= existing_connection_files
+        self._unresponsive_connection_files &= existing_connection_files
+        self._missed_probes = Counter({connection_file: missed for connection_file, missed
+            in self._missed_probes.items() if connection_file in existing_connection_files})
+        try:
+            for connection_file in existing_connection_files - self._unresponsive_connection_files:
+                try:
+                    with open(connection_file) as f:
+                        connection_info = json.load(f)
+                    address = "{}://{}:{}".format(connection_info.get("transport", "tcp"), connection_info["ip"],
+                        connection_info["hb_port"])
+                except (OSError, ValueError, KeyError):
+                    continue
+                socket = context.socket(zmq.REQ)
+                socket.linger = 0
+                connection_files[socket] = connection_file
+                socket.connect(address)
+                socket.send(b"ping")
+
+            start = time.monotonic()
+            poller = zmq.Poller()
+            for socket in connection_files:
+                poller.register(socket, zmq.POLLIN)
+            latencies_ms = {}
+            while len(latencies_ms) < len(connection_files):
+                remaining_ms = timeout_ms - (time.monotonic() - start) * 1000
+                if remaining_ms <= 0:
+                    break
+                for socket, _ in poller.poll(remaining_ms):
+                    socket.recv()
+                    poller.unregister(socket)
+                    latencies_ms[connection_files[socket]] = (time.monotonic() - start) * 1000
+        finally:
+            for socket in connection_files:
+                socket.close()
+
+        timed_out_connection_files = set(connection_files.values()) - set(latencies_ms)
+        slow_connection_files = timed_out_connection_files & self._responsive_connection_files
+        for connection_file in slow_connection_files:
+            self._missed_probes[connection_file] += 1
+            if self._missed_probes[connection_file] >= self.MAX_MISSED_PROBES:
+                self.logger.info("The kernel of {} stopped answering heartbeats, no longer probing it."
+                    .format(connection_file))
+                self._responsive_connection_files.discard(connection_file)
+        for connection_file in latencies_ms:
+            self._missed_probes.pop(connection_file, None)
+        self._unresponsive_connection_files.update(timed_out_connection_files - self._responsive_connection_files)
+        self._responsive_connection_files.update(latencies_ms)
+        return max(list(latencies_ms.values()) + [timeout_ms] * len(slow_connection_files), default=None)
+
+    def _adjust_work_share(self, latency_ms):
+        if latency_ms is not None and latency_ms > self.kernel_latency_ms:
+            work_share = max(self.work_share / 2, self.MIN_WORK_SHARE)
+        else:
+            work_share = min(self.work_share * 2, 1.0)
+        if work_share != self.work_share:
+            self.logger.info("The slowest kernel heartbeat took {} ms, the containerization now works {:.0%} of the time"
+                .format("no" if latency_ms is None else int(latency_ms), work_share))
+            self.work_share = work_share
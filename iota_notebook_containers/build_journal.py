@@ -0,0 +1,109 @@
+"""
+Journal of the files copied onto the interim container while containerizing a notebook
+A containerization that failed part way through the copy keeps its interim container, so that the next
+containerization of the same notebook and kernel continues with the files that were not copied yet.
+The first line of the journal describes the build, i.e. its job id, its interim container and what the container
+was created from. Each further line lists the files of a batch once the batch was copied, with their size and
+modification time, so that files changed since are copied again. Lines are only ever appended to. A line cut
+short by a crash is dropped before the next batch is appended, and any line that cannot be read is ignored, so that
+its files are copied again. A journal whose first line cannot be read is cleared.
+"""
+import json
+import logging
+import os
+
+class BuildJournal(object):
+    FILEPATH = "/home/ec2-user/iota_build_journal.jsonl"
+
+    logger = logging.getLogger(__name__)
+
+    @classmethod
+    def start(cls, build):
+        partial_filepath = cls.FILEPATH + ".partial"
+        with open(partial_filepath, "w") as journal:
+            journal.write(json.dumps(build) + "\n")
+        os.replace(partial_filepath, cls.FILEPATH)
+
+    @classmethod
+    def record_batch(cls, filepaths):
+        batch = [[filepath] + cls.get_file_version(filepath) for filepath in filepaths]
+        with open(cls.FILEPATH, "rb+") as journal:
+            cls._truncate_partial_line(journal)
+            journal.write((json.dumps(batch) + "\n").encode())
+
+    @classmethod
+    def _truncate_partial_line(cls, journal):
+        """Drops a last line cut short by a crash and leaves the journal positioned at its end."""
+        end = journal.seek(0, os.SEEK_END)
+        if end == 0:
+            return
+        journal.seek(end - 1)
+        if journal.read(1) == b"\n":
+            return
+        journal.seek(0)
+        content = journal.read()
+        journal.seek(content.rfind(b"\n") + 1)
+        journal.truncate()
+        cls.logger.warning("Dropped a line of the build journal that was cut short.")
+
+    @classmethod
+    def load(cls):
+        """Returns the journaled build and the versions of the files copied so far by path, or None and no files
+        if there is no journal."""
+        try:
+            with open(cls.FILEPATH) as journal:
+                lines = journal.read().split("\n")
+        except FileNotFoundError:
+            return None, {}
+        try:
+            build = json.loads(lines[0])
+            if not isinstance(build, dict):
+                raise ValueError("the build is not an object")
+        except ValueError:
+            cls.logger.warning("Clearing the unreadable build journal " + cls.FILEPATH)
+            cls.clear()
+            return None, {}
+        copied_file_versions = {}
+        for line_number, line in enumerate(lines[1:], start=2):
+            if not line:
+                continue
+            try:
+                batch = cls._parse_batch(line)
+            except (ValueError, TypeError):
+                cls.logger.warning("Ignoring unreadable line {} of the build journal.".format(line_number))
+                continue
+            copied_file_versions.update(batch)
+        return build, copied_file_versions
+
+    @classmethod
+    def _parse_batch(cls, line):
+        batch = json.loads(line)
+        if not isinstance(batch, list):
+            raise ValueError("the batch is not a list")
+        copied_file_versions = {}
+        for entry in batch:
+            if not isinstance(entry, list) or len(entry) != 3 or not isinstance(entry[0], str):
+                raise ValueError("the batch entry is not a file version")
+            filepath, *version = entry
+            copied_file_versions[filepath] = version
+        return copied_file_versions
+
+    @classmethod
+    def get_job_id(cls):
+        try:
+            with open(cls.FILEPATH) as journal:
+                return json.loads(journal.readline())["job_id"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    @classmethod
+    def clear(cls):
+        try:
+            os.remove(cls.FILEPATH)
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def get_file_version(cls, filepath):
+        stat = os.stat(filepath)
+        return [stat.st_size, stat.st_mtime_ns]
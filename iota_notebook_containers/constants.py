@@ -2,4 +2,47 @@ CONTAINER_NAME = "containerized_kernels"
 CONTAINERIZED_PREFIX = "containerized_"
 SAGEMAKER_FOLDER = "/home/ec2-user/SageMaker"
 AWS_SETTINGS_FOLDER = "/home/ec2-user/.aws"
+JUPYTER_RUNTIME_FOLDER = "/home/ec2-user/.local/share/jupyter/runtime"
 MAX_LOG_BYTES = 1024 * 1024 * 10 # 10 MB
+
+# folders shared between the notebook instance and the kernel containers, mounted at the same paths
+KERNEL_CONTAINER_VOLUMES = {
+    folder: {"bind": folder, "mode": "rw"} for folder in [
+        "/home/ec2-user/anaconda3/",
+        JUPYTER_RUNTIME_FOLDER + "/",
+        SAGEMAKER_FOLDER + "/",
+        AWS_SETTINGS_FOLDER + "/"
+    ]
+}
+# labels identifying containers that each run a single kernel
+KERNEL_NAME_LABEL = "iota_notebook_containers.kernel_name"
+KERNEL_ID_LABEL = "iota_notebook_containers.kernel_id"
+KERNEL_DOCKERFILE_LABEL = "iota_notebook_containers.kernel_dockerfile"
+
+# environment variables read by the kernel installer
+KERNEL_BASE_IMAGE_ENV_VAR = "IOTA_KERNEL_BASE_IMAGE"
+KERNEL_IMAGE_CACHE_PATH_ENV_VAR = "IOTA_KERNEL_IMAGE_CACHE_PATH"
+
+# environment variables read by the containerized kernel runner
+KERNEL_POOL_SIZE_ENV_VAR = "IOTA_KERNEL_POOL_SIZE"
+KERNEL_POOL_PRELOAD_MODULES_ENV_VAR = "IOTA_KERNEL_POOL_PRELOAD_MODULES"
+KERNEL_CONTAINER_MODE_ENV_VAR = "IOTA_KERNEL_CONTAINER_MODE"
+KERNEL_CPU_SHARES_ENV_VAR = "IOTA_KERNEL_CPU_SHARES"
+KERNEL_MEMORY_LIMIT_ENV_VAR = "IOTA_KERNEL_MEMORY_LIMIT"
+SHARED_CONTAINER_MODE = "shared"
+PER_KERNEL_CONTAINER_MODE = "per_kernel"
+
+# labels identifying the containers and images created while containerizing a notebook
+BUILD_ARTIFACT_LABEL = "iota_notebook_containers.build.artifact"
+BUILD_JOB_ID_LABEL = "iota_notebook_containers.build.job_id"
+BUILD_NOTEBOOK_LABEL = "iota_notebook_containers.build.notebook"
+BUILD_KERNEL_LABEL = "iota_notebook_containers.build.kernel"
+
+# environment variables read by the containerization
+BUILD_IMAGES_PER_NOTEBOOK_ENV_VAR = "IOTA_BUILD_IMAGES_PER_NOTEBOOK"
+BUILD_IMAGES_MAX_BYTES_ENV_VAR = "IOTA_BUILD_IMAGES_MAX_BYTES"
+BUILD_COPY_RETRIES_ENV_VAR = "IOTA_BUILD_COPY_RETRIES"
+BUILD_COPY_RETRY_BACKOFF_ENV_VAR = "IOTA_BUILD_COPY_RETRY_BACKOFF_SECONDS"
+BUILD_READ_BYTES_PER_SECOND_ENV_VAR = "IOTA_BUILD_READ_BYTES_PER_SECOND"
+BUILD_CPU_BUDGET_ENV_VAR = "IOTA_BUILD_CPU_BUDGET"
+BUILD_KERNEL_LATENCY_MS_ENV_VAR = "IOTA_BUILD_KERNEL_LATENCY_MS"
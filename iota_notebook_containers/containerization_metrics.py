@@ -0,0 +1,100 @@
+"""
+Time the phases of containerizing a notebook and count the bytes and files each phase handles
+The copy is split into archiving the files, putting the archives onto the container, the time the governor holds
+it back and the waits before retrying a batch, so that throttling and retries do not show up as copy time.
+Each containerization records its phases in its own ContainerizationMetrics, which the status log entries include.
+Once it ends, its phases are added to the totals of the server, which the metrics endpoint reports in the
+Prometheus text format.
+"""
+import time
+
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from tornado.web import RequestHandler
+
+class ContainerizationMetrics(object):
+    CLEANUP_PHASE = "cleanup"
+    VARIABLE_INDEX_PHASE = "variable_index"
+    WALK_PHASE = "walk"
+    ARCHIVE_PHASE = "archive"
+    COPY_PHASE = "copy"
+    THROTTLE_PHASE = "throttle"
+    RETRY_WAIT_PHASE = "retry_wait"
+    COMMIT_PHASE = "commit"
+    PUSH_PHASE = "push"
+    ANNOTATE_PHASE = "annotate"
+    SUCCESS_OUTCOME = "success"
+    FAILURE_OUTCOME = "failure"
+    METRIC_PREFIX = "iota_containerization"
+    # counters of each phase, with the help text of their prometheus metrics
+    COUNTERS = OrderedDict([
+        ("seconds", "Wall time spent in the phase."),
+        ("bytes", "Bytes the phase handled, e.g. copied onto the container or pushed."),
+        ("files", "Files the phase handled."),
+        ("retries", "Operations of the phase that were retried.")])
+
+    totals_lock = Lock()
+    phase_totals = OrderedDict()
+    phase_runs = Counter()
+    outcome_totals = Counter()
+
+    def __init__(self):
+        self._lock = Lock()
+        self._phases = OrderedDict()
+
+    @contextmanager
+    def time_phase(self, phase):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(phase, seconds=time.monotonic() - start)
+
+    def add(self, phase, **counters):
+        with self._lock:
+            phase_counters = self._phases.setdefault(phase, Counter())
+            phase_counters.update(counters)
+
+    def as_dict(self):
+        with self._lock:
+            return {phase: dict(counters) for phase, counters in self._phases.items()}
+
+    def finish(self, outcome):
+        with ContainerizationMetrics.totals_lock:
+            for phase, counters in self.as_dict().items():
+                ContainerizationMetrics.phase_totals.setdefault(phase, Counter()).update(counters)
+                ContainerizationMetrics.phase_runs[phase] += 1
+            ContainerizationMetrics.outcome_totals[outcome] += 1
+
+    @classmethod
+    def to_prometheus_text(cls):
+        lines = []
+        with cls.totals_lock:
+            name = "{}s_total".format(cls.METRIC_PREFIX)
+            lines += ["# HELP {} Containerizations that ended, by outcome.".format(name),
+                "# TYPE {} counter".format(name)]
+            for outcome in (cls.SUCCESS_OUTCOME, cls.FAILURE_OUTCOME):
+                lines.append('{}{{outcome="{}"}} {}'.format(name, outcome, cls.outcome_totals[outcome]))
+
+            name = "{}_phase_runs_total".format(cls.METRIC_PREFIX)
+            lines += ["# HELP {} Containerizations that went through the phase.".format(name),
+                "# TYPE {} counter".format(name)]
+            for phase, runs in cls.phase_runs.items():
+                lines.append('{}{{phase="{}"}} {}'.format(name, phase, runs))
+
+            for counter, help_text in cls.COUNTERS.items():
+                name = "{}_phase_{}_total".format(cls.METRIC_PREFIX, counter)
+                lines += ["# HELP {} {}".format(name, help_text), "# TYPE {} counter".format(name)]
+                for phase, counters in cls.phase_totals.items():
+                    if counter in counters:
+                        lines.append('{}{{phase="{}"}} {}'.format(name, phase, counters[counter]))
+        return "\n".join(lines) + "\n"
+
+
+class ContainerizationMetricsHandler(RequestHandler):
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def get(self):
+        self.set_header("Content-Type", self.CONTENT_TYPE)
+        self.write(ContainerizationMetrics.to_prometheus_text())
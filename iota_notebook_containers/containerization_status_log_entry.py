@@ -7,8 +7,8 @@ from iota_notebook_containers.constants import SAGEMAKER_FOLDER
 class ContainerizationStatusLogEntry(object):
     IMAGE_CREATION_STEP = "image_creation"
     IMAGE_UPLOAD_STEP = "image_upload"
-    VERSION = "1.0.0"
-    def __init__(self, notebook_path, step=None, notebook_modification_time=None, progress=None, error_msg=None, error_trace=None, containerization_start=None):
+    VERSION = "1.1.0"
+    def __init__(self, notebook_path, step=None, notebook_modification_time=None, progress=None, error_msg=None, error_trace=None, containerization_start=None, metrics=None):
         if step not in [self.IMAGE_CREATION_STEP, self.IMAGE_UPLOAD_STEP]:
             raise RuntimeError("{} is not a valid step.".format(step))
 
@@ -20,6 +20,8 @@ class ContainerizationStatusLogEntry(object):
         self.error_msg = error_msg
         self.error_trace = error_trace
         self.containerization_start = containerization_start
+        # the seconds, bytes and files of each phase of the containerization so far
+        self.metrics = metrics
         self.version = ContainerizationStatusLogEntry.VERSION
 
     @classmethod
@@ -46,6 +48,7 @@ class ContainerizationStatusLogEntry(object):
         log_entry["error_msg"] = self.error_msg
         log_entry["error_trace"] = self.error_trace
         log_entry["containerization_start"] = self.containerization_start
+        log_entry["metrics"] = self.metrics
         log_entry["version"] = self.version
         return log_entry
 
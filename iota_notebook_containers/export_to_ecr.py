@@ -7,7 +7,9 @@ import os
 import time
 import traceback
 
+from iota_notebook_containers.build_artifacts import BuildArtifacts
 from iota_notebook_containers.constants import SAGEMAKER_FOLDER
+from iota_notebook_containers.containerization_metrics import ContainerizationMetrics
 from iota_notebook_containers.containerized_kernel_utils import remove_containerized_prefix
 from iota_notebook_containers.containerization_status_log_entry import ContainerizationStatusLogEntry
 from iota_notebook_containers.containerization_status_logger_builder import ContainerizationStatusLoggerBuilder
@@ -95,6 +97,13 @@ class ExtensionLastModifiedHandler(RequestHandler):
         return current_extension_last_modified and s3_extension_last_modified == current_extension_last_modified
 
 
+class ContainerizationEstimateHandler(RequestHandler):
+    async def get(self):
+        containerized_kernel_name = self.get_argument("kernel_name")
+        estimate = await IOLoop.current().run_in_executor(None, KernelImageCreator.estimate, containerized_kernel_name)
+        self.write(json.dumps(estimate))
+
+
 class UploadToRepoHandler(websocket.WebSocketHandler):
     containerization_lock = Lock()
     containerizing_client = None
@@ -135,6 +144,7 @@ class UploadToRepoHandler(websocket.WebSocketHandler):
         self.log_and_write_status(containerization_status_logger, initial_status)
 
         last_status = initial_status
+        metrics = ContainerizationMetrics()
         try:
             containerized_kernel_name = parsed_message["kernel_name"]
             annotations = self.get_manifest_annotations(
@@ -155,7 +165,8 @@ class UploadToRepoHandler(websocket.WebSocketHandler):
                 return
 
             statuses = self.containerize_and_upload(repository_name, repository_uri,
-                containerized_kernel_name, notebook_path, log_time_fields, annotations)
+                containerized_kernel_name, notebook_path, log_time_fields, annotations, parsed_message["variables"],
+                metrics)
             async for status in statuses:
                 last_status = status
                 self.log_and_write_status(containerization_status_logger, status)
@@ -169,6 +180,12 @@ class UploadToRepoHandler(websocket.WebSocketHandler):
             logger.exception("Caught unhandled exception while creating or uploading image.")
             raise
         finally:
+            metrics.finish(ContainerizationMetrics.SUCCESS_OUTCOME
+                if last_status.step == ContainerizationStatusLogEntry.IMAGE_UPLOAD_STEP and last_status.progress == 100
+                and not last_status.error_msg else ContainerizationMetrics.FAILURE_OUTCOME)
+            # collected while this containerization still holds the lock, so that no other one is ongoing
+            await IOLoop.current().run_in_executor(None, BuildArtifacts.collect_safely,
+                KernelImageCreator.docker_client)
             self.close(HTTPStatus.OK)
 
     @classmethod
@@ -199,11 +216,12 @@ class UploadToRepoHandler(websocket.WebSocketHandler):
         self.write_message(log_entry.as_dict())
 
     @classmethod
-    async def containerize_and_upload(cls, repository_name, repository_uri, containerized_kernel_name, notebook_path, log_time_fields, annotations):
-        creation_status_gen = cls.run_image_creation(containerized_kernel_name, notebook_path, log_time_fields)
+    async def containerize_and_upload(cls, repository_name, repository_uri, containerized_kernel_name, notebook_path, log_time_fields, annotations, variables, metrics=None):
+        metrics = metrics or ContainerizationMetrics()
+        creation_status_gen = cls.run_image_creation(containerized_kernel_name, notebook_path, log_time_fields, variables, metrics)
         async for image_creation_status, image in cls.iterate_in_executor(creation_status_gen):
             yield image_creation_status
-        upload_status_gen = cls.run_image_upload(repository_name, repository_uri, image, notebook_path, log_time_fields, annotations)
+        upload_status_gen = cls.run_image_upload(repository_name, repository_uri, image, notebook_path, log_time_fields, annotations, metrics)
         async for image_upload_status in cls.iterate_in_executor(upload_status_gen):
             yield image_upload_status
 
@@ -216,14 +234,14 @@ class UploadToRepoHandler(websocket.WebSocketHandler):
             yield next_item
 
     @classmethod
-    def run_image_creation(cls, containerized_kernel_name, notebook_path, log_time_fields):
-        for uncapped_image_creation_status in KernelImageCreator.create(containerized_kernel_name, notebook_path):
+    def run_image_creation(cls, containerized_kernel_name, notebook_path, log_time_fields, variables, metrics):
+        for uncapped_image_creation_status in KernelImageCreator.create(containerized_kernel_name, notebook_path, variables, metrics=metrics):
             image_creation_status = cls.cap_if_not_final_status(
                 uncapped_image_creation_status)
             status_to_log = cls.add_time_fields_and_remove_image(image_creation_status,
                 log_time_fields)
             yield ContainerizationStatusLogEntry.of_image_creation(
-                notebook_path, **status_to_log), image_creation_status.image
+                notebook_path, metrics=metrics.as_dict(), **status_to_log), image_creation_status.image
 
     @classmethod
     def add_time_fields_and_remove_image(cls, status, log_time_fields):
@@ -241,13 +259,13 @@ class UploadToRepoHandler(websocket.WebSocketHandler):
         return UploadToRepoHandler.cap_progress(uncapped_image_creation_status)
 
     @classmethod
-    def run_image_upload(cls, repository_name, repository_uri, image, notebook_path, log_time_fields, annotations):
+    def run_image_upload(cls, repository_name, repository_uri, image, notebook_path, log_time_fields, annotations, metrics):
         for image_upload_status in cls.upload_image_to_repo(
-            repository_name, repository_uri, image, annotations):
+            repository_name, repository_uri, image, annotations, metrics):
                 status_to_log = cls.add_time_fields_and_remove_image(
                     image_upload_status, log_time_fields)
                 yield ContainerizationStatusLogEntry.of_image_upload(
-                    notebook_path, **status_to_log)
+                    notebook_path, metrics=metrics.as_dict(), **status_to_log)
 
     @classmethod
     async def get_repository_uri(cls, repository_name):
@@ -259,7 +277,8 @@ class UploadToRepoHandler(websocket.WebSocketHandler):
             return None
 
     @classmethod
-    def upload_image_to_repo(cls, repository_name, repository_uri, image, annotations):
+    def upload_image_to_repo(cls, repository_name, repository_uri, image, annotations, metrics=None):
+        metrics = metrics or ContainerizationMetrics()
         ecr_client = boto3.client(ECR)
         token = ecr_client.get_authorization_token()["authorizationData"][0]["authorizationToken"]
         username, password = base64.b64decode(token).decode().split(":")
@@ -267,15 +286,23 @@ class UploadToRepoHandler(websocket.WebSocketHandler):
         docker_client = docker.from_env(timeout=600)
         docker_client.api.tag(image, repository=repository_uri + ":" + INTERIM_TAG)
         previous_progress = None
-        for push_status_bytes in docker_client.api.push(repository=repository_uri + ":" + INTERIM_TAG, stream=True, auth_config=auth_config):
-            parsed_status = cls.parse_upload_status(push_status_bytes.decode())
-            if parsed_status and cls.status_should_be_reported(parsed_status, previous_progress):
-                previous_progress = parsed_status.progress
-                yield UploadToRepoHandler.cap_progress(parsed_status)
-                if parsed_status.error_msg:
-                    return
+        pushed_layer_bytes = {}
+        try:
+            with metrics.time_phase(ContainerizationMetrics.PUSH_PHASE):
+                for push_status_bytes in docker_client.api.push(repository=repository_uri + ":" + INTERIM_TAG, stream=True, auth_config=auth_config):
+                    push_status = push_status_bytes.decode()
+                    cls.update_pushed_layer_bytes(pushed_layer_bytes, push_status)
+                    parsed_status = cls.parse_upload_status(push_status)
+                    if parsed_status and cls.status_should_be_reported(parsed_status, previous_progress):
+                        previous_progress = parsed_status.progress
+                        yield UploadToRepoHandler.cap_progress(parsed_status)
+                        if parsed_status.error_msg:
+                            return
+        finally:
+            metrics.add(ContainerizationMetrics.PUSH_PHASE, bytes=sum(pushed_layer_bytes.values()))
 
-        cls.add_annotations_to_manifest(repository_name, annotations)
+        with metrics.time_phase(ContainerizationMetrics.ANNOTATE_PHASE):
+            cls.add_annotations_to_manifest(repository_name, annotations)
         yield ImageUploadStatus(progress=100, error_msg=None, error_trace=None)
 
     @classmethod
@@ -293,6 +320,17 @@ class UploadToRepoHandler(websocket.WebSocketHandler):
         ecr_client.batch_delete_image(repositoryName=repository_name,
             imageIds=[{'imageTag':INTERIM_TAG}])
       
+    @classmethod
+    def update_pushed_layer_bytes(cls, pushed_layer_bytes, push_info):
+        # the progress of each layer is reported as the bytes pushed so far
+        try:
+            push_info = json.loads(push_info)
+            pushed_bytes = push_info["progressDetail"]["current"]
+            layer_id = push_info["id"]
+        except (json.decoder.JSONDecodeError, KeyError, TypeError):
+            return
+        pushed_layer_bytes[layer_id] = max(pushed_bytes, pushed_layer_bytes.get(layer_id, 0))
+
     @classmethod
     def parse_upload_status(cls, push_info):
         try:
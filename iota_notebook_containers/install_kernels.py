@@ -1,10 +1,15 @@
 import docker
+import hashlib
 import json
 import logging
 import os
+import requests
+import shutil
+import subprocess
 import sys
 
 from . import constants
+from concurrent.futures import ThreadPoolExecutor
 from environment_kernels import EnvironmentKernelSpecManager
 from io import BytesIO
 from IPython.utils.tempdir import TemporaryDirectory
@@ -12,43 +17,113 @@ from IPython.utils.tempdir import TemporaryDirectory
 logger = logging.getLogger(__name__)
 
 class KernelContainerCreator(object):
+    DEFAULT_BASE_IMAGE = "amazonlinux:2023"
+    DOCKERFILE_FMT = '''
+        FROM {}
+        RUN yum install -y procps
+        '''
+
     def __init__(self, name):
         self._docker_client = docker.from_env()
         self._name = name
+        # a digest (e.g. amazonlinux@sha256:...) pins the base image so that rebuilds cannot silently change it
+        self._base_image = os.environ.get(constants.KERNEL_BASE_IMAGE_ENV_VAR, self.DEFAULT_BASE_IMAGE)
+        self._dockerfile = self.DOCKERFILE_FMT.format(self._base_image)
+        self._image_cache_path = os.environ.get(constants.KERNEL_IMAGE_CACHE_PATH_ENV_VAR)
 
     def recreate(self):
         self._remove()
         self._create()
 
     def _create(self):
-        dockerfile = '''
-        FROM amazonlinux:latest
-        RUN yum install -y procps
-        '''
-        mounted_volumes = {
-            '/home/ec2-user/anaconda3/': {
-                'bind': '/home/ec2-user/anaconda3/',
-                'mode': 'rw'
-            },
-            '/home/ec2-user/.local/share/jupyter/runtime/': {
-                'bind': '/home/ec2-user/.local/share/jupyter/runtime/',
-                'mode': 'rw'
-            },
-            '/home/ec2-user/SageMaker/': {
-                'bind': '/home/ec2-user/SageMaker/',
-                'mode': 'rw'
-            },
-            '/home/ec2-user/.aws/': {
-                'bind': '/home/ec2-user/.aws/',
-                'mode': 'rw'
-            }
-        }
-        self._docker_client.images.build(fileobj=BytesIO(dockerfile.encode('utf-8')), tag=self._name)
-        logger.info('Built kernel container image: ' + self._name)
-        self._docker_client.containers.create(self._name, stdin_open=True, detach=True, name=self._name, volumes=mounted_volumes, network_mode='host')
+        base_image_id = self._resolve_base_image_id()
+        image_tag = self._get_image_tag(base_image_id)
+        if base_image_id is None:
+            image_tag = self._find_image_built_from_dockerfile() or image_tag
+        if not self._has_image(image_tag) and not self._load_cached_image(image_tag):
+            self._docker_client.images.build(fileobj=BytesIO(self._dockerfile.encode('utf-8')), tag=image_tag,
+                labels={constants.KERNEL_DOCKERFILE_LABEL: self._get_dockerfile_hash()})
+            logger.info('Built kernel container image: ' + image_tag)
+            self._save_cached_image(image_tag)
+        self._docker_client.containers.create(image_tag, stdin_open=True, detach=True, name=self._name, volumes=constants.KERNEL_CONTAINER_VOLUMES, network_mode='host')
         logger.info('Created kernel container: ' + self._name)
 
+    def _get_image_tag(self, base_image_id):
+        # the tag identifies the dockerfile and the base image it was built from, so an image with this tag
+        # never needs to be rebuilt, while a base image that changed, e.g. was pulled again, leads to a new one
+        return self._name + ':' + hashlib.sha256(
+            (self._dockerfile + (base_image_id or '')).encode('utf-8')).hexdigest()[:12]
+
+    def _get_dockerfile_hash(self):
+        return hashlib.sha256(self._dockerfile.encode('utf-8')).hexdigest()
+
+    def _resolve_base_image_id(self):
+        """Returns the id of the image the base image tag points to, preferring the local image so that the kernel
+        image is not rebuilt from whatever the tag moved to upstream, and pulling it only when it is missing.
+        Returns None if neither the local images nor the registry know it."""
+        if '@' in self._base_image:
+            # a digest pins the base image, so the dockerfile already identifies it
+            return self._base_image
+        try:
+            return self._docker_client.images.get(self._base_image).id
+        except docker.errors.ImageNotFound:
+            pass
+        repository, tag = docker.utils.parse_repository_tag(self._base_image)
+        try:
+            return self._docker_client.images.pull(repository, tag=tag or 'latest').id
+        except (docker.errors.APIError, requests.exceptions.RequestException):
+            logger.warning('Could not pull the base image ' + self._base_image, exc_info=True)
+            return None
+
+    def _find_image_built_from_dockerfile(self):
+        """Returns the tag of an image built from the dockerfile, from the local images or else the cache, for when
+        the base image cannot be resolved, e.g. without network access after the instance restarted."""
+        label_filter = {'label': constants.KERNEL_DOCKERFILE_LABEL + '=' + self._get_dockerfile_hash()}
+        for load_cache in (False, True):
+            if load_cache:
+                if not self._image_cache_path or not os.path.exists(self._image_cache_path):
+                    return None
+                with open(self._image_cache_path, 'rb') as f:
+                    self._docker_client.images.load(f)
+            for image in self._docker_client.images.list(name=self._name, filters=label_filter):
+                if image.tags:
+                    logger.warning('Could not resolve the base image, reusing ' + image.tags[0])
+                    return image.tags[0]
+        return None
+
+    def _has_image(self, image_tag):
+        try:
+            self._docker_client.images.get(image_tag)
+        except docker.errors.ImageNotFound:
+            return False
+        logger.info('Reusing kernel container image: ' + image_tag)
+        return True
+
+    def _load_cached_image(self, image_tag):
+        if not self._image_cache_path or not os.path.exists(self._image_cache_path):
+            return False
+        with open(self._image_cache_path, 'rb') as f:
+            self._docker_client.images.load(f)
+        logger.info('Loaded kernel container image from ' + self._image_cache_path)
+        return self._has_image(image_tag)
+
+    def _save_cached_image(self, image_tag):
+        if not self._image_cache_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self._image_cache_path)), exist_ok=True)
+        partial_path = self._image_cache_path + '.partial'
+        with open(partial_path, 'wb') as f:
+            # saving by tag rather than id keeps the tag in the tarball, so loading it restores the tag
+            for chunk in self._docker_client.api.get_image(image_tag):
+                f.write(chunk)
+        # the cache is only ever replaced by a complete image
+        os.replace(partial_path, self._image_cache_path)
+        logger.info('Saved kernel container image to ' + self._image_cache_path)
+
     def _remove(self):
+        # containers running a single kernel were left behind by runners from before this installation
+        for kernel_container in self._docker_client.containers.list(all=True, filters={"label": constants.KERNEL_ID_LABEL}):
+            kernel_container.remove(force=True)
         try:
             containerized_kernels = self._docker_client.containers.get(self._name)
         except docker.errors.NotFound:
@@ -56,24 +131,73 @@ class KernelContainerCreator(object):
         containerized_kernels.remove(force=True, v=True)
 
 class ContainerizedKernelInstaller(object):
+    INSTALLED = "installed"
+    UPDATED = "updated"
+    UNCHANGED = "unchanged"
+    REMOVED = "removed"
+    KERNELS_FOLDER = os.path.join(sys.prefix, 'share', 'jupyter', 'kernels')
+    MAX_WORKERS = 8
+    RUN_MODULE = 'iota_notebook_containers.run'
+    MIN_PYTHON_MAJOR_VERSION = 3
+    PYTHON_VERSION_TIMEOUT_SECONDS = 30
+
     def __init__(self):
         self._kernel_spec_manager = EnvironmentKernelSpecManager()
 
     def install(self):
+        kernel_names = [kernel_name for kernel_name in self._kernel_spec_manager.find_kernel_specs()
+            if self._should_containerize_kernel(kernel_name)]
+        report = {self.INSTALLED: [], self.UPDATED: [], self.UNCHANGED: [], self.REMOVED: []}
+        if kernel_names:
+            with ThreadPoolExecutor(max_workers=min(self.MAX_WORKERS, len(kernel_names))) as executor:
+                # iterating the results re-raises the first exception from any of the installations
+                for safe_name, outcome in executor.map(self._install_kernel, kernel_names):
+                    report[outcome].append(safe_name)
+        installed_names = set(name.lower() for outcome in (self.INSTALLED, self.UPDATED, self.UNCHANGED)
+            for name in report[outcome])
+        report[self.REMOVED] = self._remove_stale_kernels(installed_names)
+        logger.info('Containerized kernel installation report: ' + json.dumps(report, sort_keys=True))
+        return report
+
+    def _install_kernel(self, kernel_name):
+        kernel_display_name = 'Containerized ' + kernel_name
+        safe_name = kernel_display_name.replace(' ', '_')
+        kernel_json = self._get_kernel_json(kernel_name, kernel_display_name)
+        installed_kernel_json = self._get_installed_kernel_json(safe_name.lower())
+        if kernel_json == installed_kernel_json:
+            return safe_name, self.UNCHANGED
+
         with TemporaryDirectory() as td:
             allow_all_rx = 0o755
             os.chmod(td, allow_all_rx)
-            for kernel_name in self._kernel_spec_manager.find_kernel_specs():
-                if not self._should_containerize_kernel(kernel_name):
-                    continue
-                kernel_display_name = 'Containerized ' + kernel_name
-                with open(os.path.join(td, 'kernel.json'), 'w') as f:
-                    kernel_json = self._get_kernel_json(kernel_name, kernel_display_name)
-                    logger.debug("Installing kernel with definition: " + str(kernel_json))
-                    json.dump(kernel_json, f, sort_keys=True)
-                safe_name = kernel_display_name.replace(' ', '_')
-                self._kernel_spec_manager.install_kernel_spec(td, safe_name, prefix=sys.prefix, replace=True)
-                logger.info('Installed kernel: ' + safe_name)
+            with open(os.path.join(td, 'kernel.json'), 'w') as f:
+                logger.debug("Installing kernel with definition: " + str(kernel_json))
+                json.dump(kernel_json, f, sort_keys=True)
+            self._kernel_spec_manager.install_kernel_spec(td, safe_name, prefix=sys.prefix, replace=True)
+            logger.info('Installed kernel: ' + safe_name)
+        return safe_name, self.UPDATED if installed_kernel_json else self.INSTALLED
+
+    def _get_installed_kernel_json(self, installed_name):
+        try:
+            with open(os.path.join(self.KERNELS_FOLDER, installed_name, 'kernel.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _remove_stale_kernels(self, installed_names):
+        if not os.path.isdir(self.KERNELS_FOLDER):
+            return []
+        removed = []
+        for installed_name in sorted(os.listdir(self.KERNELS_FOLDER)):
+            if installed_name in installed_names or not installed_name.startswith(constants.CONTAINERIZED_PREFIX):
+                continue
+            installed_kernel_json = self._get_installed_kernel_json(installed_name)
+            # only remove kernels that this installer created, whose conda env no longer exists
+            if installed_kernel_json and self.RUN_MODULE in installed_kernel_json.get('argv', []):
+                shutil.rmtree(os.path.join(self.KERNELS_FOLDER, installed_name))
+                logger.info('Removed kernel: ' + installed_name)
+                removed.append(installed_name)
+        return removed
 
     def _get_kernel_json(self, original_kernel_name, kernel_display_name):
         env_var = self._kernel_spec_manager.get_kernel_spec(original_kernel_name).env
@@ -82,7 +206,7 @@ class ContainerizedKernelInstaller(object):
             'argv':[
                 sys.executable,
                 '-m',
-                'iota_notebook_containers.run',
+                self.RUN_MODULE,
                 original_kernel_name,
                 '{connection_file}'
             ],
@@ -92,12 +216,31 @@ class ContainerizedKernelInstaller(object):
         }
 
     def _should_containerize_kernel(self, kernel_name):
-        return kernel_name.startswith('conda_') and kernel_name not in ['conda_jupytersystemenv', 'conda_anaconda3']
+        return (kernel_name.startswith('conda_') and kernel_name not in ['conda_jupytersystemenv', 'conda_anaconda3']
+            and self._is_supported_python(kernel_name))
+
+    def _is_supported_python(self, kernel_name):
+        # the notebook runner executes inside the kernel's environment and requires python 3
+        python = self._kernel_spec_manager.get_kernel_spec(kernel_name).argv[0]
+        try:
+            major_version = int(subprocess.check_output([python, '-c', 'import sys; print(sys.version_info[0])'],
+                timeout=self.PYTHON_VERSION_TIMEOUT_SECONDS))
+        except (OSError, ValueError, subprocess.SubprocessError):
+            logger.warning('Could not determine the python version of kernel {}.'.format(kernel_name), exc_info=True)
+            return True
+        if major_version < self.MIN_PYTHON_MAJOR_VERSION:
+            logger.warning('Not containerizing kernel {} because it runs python {}.'.format(kernel_name, major_version))
+            return False
+        return True
 
 if __name__ == '__main__':
     try:
-        KernelContainerCreator(constants.CONTAINER_NAME).recreate()
-        ContainerizedKernelInstaller().install()
+        # the kernel specs do not depend on the container, so both are set up at the same time
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            container_creation = executor.submit(KernelContainerCreator(constants.CONTAINER_NAME).recreate)
+            kernel_installation = executor.submit(ContainerizedKernelInstaller().install)
+            container_creation.result()
+            kernel_installation.result()
     except:
         logger.exception("Caught unhandled exception while installing kernels.")
         raise
@@ -1,27 +1,79 @@
 import os
+import argparse
 import ast
-import asttokens
+import base64
+import bisect
+import contextlib
+import gzip
+import hashlib
 import io
 import json
-import boto3
+import logging
+import mimetypes
 import nbformat
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tokenize
 import uuid
-from jupyter_client.kernelspec import KernelSpecManager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from six.moves.urllib.parse import urlparse
-from nbconvert.preprocessors import ExecutePreprocessor
-from nbconvert import HTMLExporter
+
+# boto3, jupyter_client and nbconvert are imported where they are used, because importing
+# them takes a significant part of the time before the first cell runs
 
 IPYTHON_COMMAND_PREFIX_REPLACEMENT = 'pass#' + str(uuid.uuid4())
 IPYTHON_COMMAND_PREFIX = ['%','!']
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+VARIABLE_INDEX_FILEPATH = os.path.join(SCRIPT_FOLDER, 'iota_run_nb_index.json')
+VARIABLE_INDEX_VERSION = 1
+PARAMS_FILEPATH = '/opt/ml/input/data/iotanalytics/params'
+CHECKPOINT_INTERVAL_SECONDS_ENV_VAR = 'IOTA_CHECKPOINT_INTERVAL_SECONDS'
+CHECKPOINT_INTERVAL_CELLS_ENV_VAR = 'IOTA_CHECKPOINT_INTERVAL_CELLS'
+UPLOAD_MAX_CONCURRENCY_ENV_VAR = 'IOTA_UPLOAD_MAX_CONCURRENCY'
+UPLOAD_PART_SIZE_MB_ENV_VAR = 'IOTA_UPLOAD_PART_SIZE_MB'
+DEFAULT_UPLOAD_MAX_CONCURRENCY = 10
+DEFAULT_UPLOAD_PART_SIZE_MB = 8
+OUTPUT_OFFLOAD_THRESHOLD_KB_ENV_VAR = 'IOTA_OUTPUT_OFFLOAD_THRESHOLD_KB'
+OUTPUT_COMPRESSION_ENV_VAR = 'IOTA_OUTPUT_COMPRESSION'
+GZIP_COMPRESSION = 'gzip'
+OFFLOADED_OUTPUTS_METADATA_KEY = 'iota_offloaded_outputs'
+IPYNB_CONTENT_TYPE = 'application/x-ipynb+json'
+HTML_CONTENT_TYPE = 'text/html; charset=utf-8'
+METRICS_CONTENT_TYPE = 'application/json'
+CELL_METRICS_METADATA_KEY = 'iota_metrics'
+DATASET_VARIABLES_ENV_VAR = 'IOTA_DATASET_VARIABLES'
+DATASET_CACHE_FOLDER_ENV_VAR = 'IOTA_DATASET_CACHE_FOLDER'
+DATASET_MANIFEST_ENV_VAR = 'IOTA_DATASET_MANIFEST'
+DEFAULT_DATASET_CACHE_FOLDER = os.path.join(tempfile.gettempdir(), 'iota_datasets')
+MAX_DATASET_DOWNLOADS = 8
+MAX_DATASET_LOOKUPS = 4
+OUTPUT_SPOOL_FOLDER_ENV_VAR = 'IOTA_OUTPUT_SPOOL_FOLDER'
+EXECUTION_MODE_ENV_VAR = 'IOTA_EXECUTION_MODE'
+SUBPROCESS_EXECUTION_MODE = 'subprocess'
+IN_PROCESS_EXECUTION_MODE = 'in_process'
+RAISES_EXCEPTION_TAG = 'raises-exception'
+BATCH_CONCURRENCY_ENV_VAR = 'IOTA_BATCH_CONCURRENCY'
+KERNEL_TIMEOUT_SECONDS = 60
+DEFAULT_OUTPUT_SPOOL_FOLDER = os.path.join(tempfile.gettempdir(), 'iota_output_spool')
+
+logger = logging.getLogger(__name__)
 
 def _get_default_kernel_name():
+    from jupyter_client.kernelspec import KernelSpecManager
     return next(iter(KernelSpecManager().find_kernel_specs().keys()))
 
+def _read_params():
+    with open(PARAMS_FILEPATH) as params_file:
+        return json.load(params_file)
+
 class Context(object):
-    def __init__(self):
-        with open('/opt/ml/input/data/iotanalytics/params') as params_file:
-            params = json.load(params_file)
-        self.variables = params['Variables']
+    def __init__(self, params=None, run_position=None):
+        if params is None:
+            params = _read_params()
         context = params['Context']
         notebook_path = context.get('Analysis', os.environ.get('NOTEBOOK_PATH'))
         with io.open(notebook_path, encoding='utf-8') as f:
@@ -29,45 +81,177 @@ class Context(object):
         self.notebook_dir  = os.path.dirname(notebook_path)
         self.variables = params['Variables']
         output_uris = context['OutputUris']
+        if run_position is not None:
+            self.variables = self.variables[run_position]
+            output_uris = output_uris[run_position]
         self.output_ipynb_s3_uri = output_uris['ipynb']
         self.output_html_s3_uri = output_uris['html']
-        self.kernel_name = os.environ.get('KERNEL_NAME', _get_default_kernel_name())
-        self.s3 = boto3.resource('s3')
+        self.variable_index = _read_variable_index(VARIABLE_INDEX_FILEPATH)
+        self._kernel_name = None
+        self._s3 = None
+
+    @property
+    def kernel_name(self):
+        if self._kernel_name is None:
+            self._kernel_name = os.environ.get('KERNEL_NAME') or _get_default_kernel_name()
+        return self._kernel_name
+
+    @property
+    def s3(self):
+        if self._s3 is None:
+            import boto3
+            self._s3 = boto3.resource('s3')
+        return self._s3
+
+def _load_contexts():
+    """Returns a context per run. The params of a batch list several sets of variables under Variables, and
+    the output uris of each set at the same position under OutputUris."""
+    params = _read_params()
+    if not isinstance(params['Variables'], list):
+        return [Context(params)]
+    if len(params['Variables']) != len(params['Context']['OutputUris']):
+        raise ValueError("A batch needs as many OutputUris as sets of Variables.")
+    return [Context(params, run_position) for run_position in range(len(params['Variables']))]
 
 class _Assignment(object):
-    def __init__(self, ast_node):
-        self.var_name = ast_node.targets[0].id
-        self.val_startpos = ast_node.value.first_token.startpos
-        self.val_endpos = ast_node.value.last_token.endpos
+    def __init__(self, var_name, val_startpos, val_endpos):
+        self.var_name = var_name
+        self.val_startpos = val_startpos
+        self.val_endpos = val_endpos
 
 def _is_var_assigment(node):
     return (isinstance(node, ast.Assign)
             and len(node.targets) == 1
             and isinstance(node.targets[0], ast.Name))
 
+class _SourceTokens(object):
+    """Locates the source span of an assignment's value using only the standard library.
+    ast end positions are not used because they are unavailable before python 3.8."""
+    OPENING_BRACKETS = '([{'
+    CLOSING_BRACKETS = ')]}'
+    NON_CODING_TOKENS = (tokenize.NL, tokenize.COMMENT)
+
+    def __init__(self, source):
+        self.lines = io.StringIO(source).readlines()
+        self.line_offsets = [0]
+        for line in self.lines:
+            self.line_offsets.append(self.line_offsets[-1] + len(line))
+        self.tokens = list(tokenize.generate_tokens(io.StringIO(source).readline))
+        self.token_starts = [token.start for token in self.tokens]
+
+    def _offset(self, position):
+        row, col = position
+        return self.line_offsets[row - 1] + col
+
+    def _first_token_index(self, node):
+        # ast column offsets count utf-8 bytes whereas tokenize columns count characters
+        line = self.lines[node.lineno - 1]
+        col = len(line.encode('utf-8')[:node.col_offset].decode('utf-8'))
+        return bisect.bisect_left(self.token_starts, (node.lineno, col))
+
+    @classmethod
+    def _depth_change(cls, token):
+        if token.type == tokenize.OP:
+            if token.string in cls.OPENING_BRACKETS:
+                return 1
+            if token.string in cls.CLOSING_BRACKETS:
+                return -1
+        return 0
+
+    def _is_statement_end(self, token):
+        return (token.type in (tokenize.NEWLINE, tokenize.ENDMARKER)
+            or (token.type == tokenize.OP and token.string == ';'))
+
+    def value_span(self, assign_node):
+        depth = 0
+        index = self._first_token_index(assign_node)
+        while depth > 0 or self.tokens[index].string != '=':
+            depth += self._depth_change(self.tokens[index])
+            index += 1
+        first = last = index + 1
+        for index in range(first, len(self.tokens)):
+            token = self.tokens[index]
+            if depth == 0 and self._is_statement_end(token):
+                break
+            depth += self._depth_change(token)
+            if token.type not in self.NON_CODING_TOKENS:
+                last = index
+        return self._offset(self.tokens[first].start), self._offset(self.tokens[last].end)
+
 def _sorted_assignments(source):
-    tokens = asttokens.ASTTokens(source, parse=True)
-    assignments = (_Assignment(n) for n in ast.walk(tokens.tree) if _is_var_assigment(n))
+    nodes = [n for n in ast.walk(ast.parse(source)) if _is_var_assigment(n)]
+    if not nodes:
+        return []
+    source_tokens = _SourceTokens(source)
+    assignments = (_Assignment(n.targets[0].id, *source_tokens.value_span(n)) for n in nodes)
     return sorted(assignments, key = lambda a: a.val_startpos)
 
-def _source_fragments_after_replacements(source, variables):
+def _source_fragments_after_replacements(source, variables, assignments):
     last_val_endpos = 0;
-    for a in _sorted_assignments(source):
-        yield source[last_val_endpos:a.val_startpos]
-        last_val_endpos = a.val_endpos
-        original_val = source[a.val_startpos:a.val_endpos]
-        yield repr(variables.pop(a.var_name)) if a.var_name in variables else original_val
+    for var_name, val_startpos, val_endpos in assignments:
+        yield source[last_val_endpos:val_startpos]
+        last_val_endpos = val_endpos
+        original_val = source[val_startpos:val_endpos]
+        yield repr(variables.pop(var_name)) if var_name in variables else original_val
     yield source[last_val_endpos:len(source)]
 
-def _replace_variables(source, variables):
-    return ''.join(_source_fragments_after_replacements(source, variables))
+def _indexed_assignments(source, var_names=None):
+    return [(a.var_name, a.val_startpos, a.val_endpos) for a in _sorted_assignments(source)
+        if var_names is None or a.var_name in var_names]
+
+def _replace_variables(source, variables, assignments=None):
+    if assignments is None:
+        assignments = _indexed_assignments(source)
+    return ''.join(_source_fragments_after_replacements(source, variables, assignments))
+
+def _source_hash(source):
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+def build_variable_index(nb, var_names):
+    """Records where the given variables are assigned in each code cell, so that they can be replaced without parsing.
+    The offsets refer to the source after _pre_handle_ipython_commands, whose replacement prefix has a fixed length."""
+    var_names = set(var_names)
+    cells = []
+    for cell in nb.cells:
+        if cell.cell_type != 'code':
+            cells.append(None)
+            continue
+        try:
+            assignments = _indexed_assignments(_pre_handle_ipython_commands(cell.source), var_names)
+        except (SyntaxError, ValueError):
+            assignments = [] # such cells are skipped when replacing variables as well
+        cells.append({'sha256': _source_hash(cell.source), 'assignments': assignments})
+    return {'version': VARIABLE_INDEX_VERSION, 'variables': sorted(var_names), 'cells': cells}
+
+def _read_variable_index(index_filepath):
+    try:
+        with open(index_filepath) as index_file:
+            variable_index = json.load(index_file)
+    except (OSError, ValueError):
+        return None
+    return variable_index if variable_index.get('version') == VARIABLE_INDEX_VERSION else None
+
+def _get_indexed_assignments(variable_index, variables, cell_position, cell):
+    # the index can only be trusted for the variables it was built for and for cells that have not changed since
+    if not variable_index or not set(variables).issubset(variable_index['variables']):
+        return None
+    indexed_cells = variable_index['cells']
+    if cell_position >= len(indexed_cells) or not indexed_cells[cell_position]:
+        return None
+    indexed_cell = indexed_cells[cell_position]
+    if indexed_cell['sha256'] != _source_hash(cell.source):
+        return None
+    return indexed_cell['assignments']
 
 def _replace_variables_in_notebook(context):
-    for cell in context.nb.cells:
+    for cell_position, cell in enumerate(context.nb.cells):
         if cell.cell_type == 'code':
             try:
+                assignments = _get_indexed_assignments(context.variable_index, context.variables, cell_position, cell)
+                if assignments == [] or not context.variables:
+                    continue
                 source = _pre_handle_ipython_commands(cell.source)
-                source = _replace_variables(source, context.variables)
+                source = _replace_variables(source, context.variables, assignments)
                 cell.source = _post_handle_ipython_commands(source)
             except (SyntaxError, ValueError) as e:
                 pass # Continue to replace variables in other cells
@@ -91,26 +275,825 @@ def _pre_handle_ipython_commands(source):
 def _post_handle_ipython_commands(source):
     return source.replace(IPYTHON_COMMAND_PREFIX_REPLACEMENT,'')
 
-def _write_to_s3(s3_uri, text, s3):
+def _get_upload_max_concurrency():
+    return int(os.environ.get(UPLOAD_MAX_CONCURRENCY_ENV_VAR) or DEFAULT_UPLOAD_MAX_CONCURRENCY)
+
+def _get_transfer_config():
+    from boto3.s3.transfer import TransferConfig
+    part_size = int(float(os.environ.get(UPLOAD_PART_SIZE_MB_ENV_VAR) or DEFAULT_UPLOAD_PART_SIZE_MB) * 1024 * 1024)
+    return TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size,
+        max_concurrency=_get_upload_max_concurrency())
+
+def _split_s3_uri(s3_uri):
     url = urlparse(s3_uri)
-    bucket = url.netloc
-    key = url.path[1:]
-    s3.Object(bucket, key).put(Body=text.encode('utf-8'), ACL='bucket-owner-full-control')
+    return url.netloc, url.path[1:]
 
-def _write_output_to_s3(context):
-    ipynb_json = nbformat.writes(context.nb)
-    _write_to_s3(context.output_ipynb_s3_uri, ipynb_json, context.s3)
-    basic_html, _ = HTMLExporter(template_file='basic').from_notebook_node(context.nb)
-    _write_to_s3(context.output_html_s3_uri, basic_html, context.s3)
+def _upload_to_s3(s3_uri, data, s3, **extra_args):
+    bucket, key = _split_s3_uri(s3_uri)
+    extra_args['ACL'] = 'bucket-owner-full-control'
+    # large outputs are uploaded as multiple parts in parallel. the client is used rather than the resource
+    # because, unlike resources, clients can be shared between threads
+    s3.meta.client.upload_fileobj(io.BytesIO(data), bucket, key, ExtraArgs=extra_args, Config=_get_transfer_config())
 
-def run_notebook(context=Context()):
-    _replace_variables_in_notebook(context)
+def _upload_file_to_s3(filepath, s3_uri, s3):
+    bucket, key = _split_s3_uri(s3_uri)
+    s3.meta.client.upload_file(filepath, bucket, key, ExtraArgs={'ACL': 'bucket-owner-full-control'},
+        Config=_get_transfer_config())
+
+def _write_to_s3(s3_uri, text, s3, content_type=None):
+    data = text.encode('utf-8')
+    extra_args = {'ContentType': content_type} if content_type else {}
+    if os.environ.get(OUTPUT_COMPRESSION_ENV_VAR) == GZIP_COMPRESSION:
+        data = gzip.compress(data, compresslevel=6)
+        extra_args['ContentEncoding'] = GZIP_COMPRESSION
+    _upload_to_s3(s3_uri, data, s3, **extra_args)
+
+def _is_json_mimetype(mimetype):
+    return mimetype == 'application/json' or mimetype.endswith('+json')
+
+def _is_text_mimetype(mimetype):
+    return mimetype.startswith('text/') or mimetype in ('application/javascript', 'image/svg+xml')
+
+def _encode_output_data(mimetype, value):
+    """Returns the bytes to store for an output's data and how they were derived from it.
+    nbformat stores json mimetypes as objects, text mimetypes as strings and all other mimetypes base64 encoded."""
+    if _is_json_mimetype(mimetype):
+        return json.dumps(value).encode('utf-8'), 'json'
+    if isinstance(value, list):
+        value = ''.join(value)
+    if _is_text_mimetype(mimetype):
+        return value.encode('utf-8'), 'utf-8'
+    return base64.b64decode(value), 'base64'
+
+def _get_offloaded_output_uri(ipynb_s3_uri, cell_position, output_position, mimetype):
+    extension = mimetypes.guess_extension(mimetype) or ''
+    return '{}_outputs/cell{}_output{}{}'.format(os.path.splitext(ipynb_s3_uri)[0],
+        cell_position, output_position, extension)
+
+def _compact_outputs(nb, ipynb_s3_uri, s3, threshold_bytes):
+    """Returns a copy of the notebook in which the output data larger than the threshold is moved into separate
+    s3 objects next to the ipynb output. The output's metadata references the object of each moved mimetype."""
+    # from_dict copies the notebook's structure, but shares its strings
+    compacted = nbformat.from_dict(nb)
+    uploads = []
+    for cell_position, cell in enumerate(compacted.cells):
+        for output_position, output in enumerate(cell.get('outputs', [])):
+            data = output.get('data', {})
+            for mimetype in list(data):
+                value = data[mimetype]
+                if len(value if isinstance(value, str) else json.dumps(value)) < threshold_bytes:
+                    continue
+                body, encoding = _encode_output_data(mimetype, value)
+                uri = _get_offloaded_output_uri(ipynb_s3_uri, cell_position, output_position, mimetype)
+                uploads.append((uri, body, mimetype))
+                offloaded = output.setdefault('metadata', {}).setdefault(OFFLOADED_OUTPUTS_METADATA_KEY, {})
+                offloaded[mimetype] = {'uri': uri, 'encoding': encoding}
+                del data[mimetype]
+    if uploads:
+        with ThreadPoolExecutor(max_workers=min(len(uploads), _get_upload_max_concurrency())) as executor:
+            list(executor.map(lambda upload: _upload_to_s3(upload[0], upload[1], s3, ContentType=upload[2]), uploads))
+    return compacted
+
+def _write_ipynb_to_s3(context, s3):
+    nb = context.nb
+    threshold_kb = float(os.environ.get(OUTPUT_OFFLOAD_THRESHOLD_KB_ENV_VAR) or 0)
+    if threshold_kb > 0:
+        nb = _compact_outputs(nb, context.output_ipynb_s3_uri, s3, threshold_kb * 1024)
+    _write_to_s3(context.output_ipynb_s3_uri, nbformat.writes(nb), s3, IPYNB_CONTENT_TYPE)
+
+def _render_html(nb):
+    from nbconvert import HTMLExporter
+    basic_html, _ = HTMLExporter(template_file='basic').from_notebook_node(nb)
+    return basic_html
+
+def _get_metrics_s3_uri(ipynb_s3_uri):
+    return os.path.splitext(ipynb_s3_uri)[0] + '_metrics.json'
 
+def _write_metrics_to_s3(context, metrics, s3):
+    # the metrics go to a key next to the ipynb output that the caller did not ask for, which the role may not be
+    # allowed to write, so failing to upload them must not fail the run
+    metrics_s3_uri = _get_metrics_s3_uri(context.output_ipynb_s3_uri)
     try:
-        ExecutePreprocessor(timeout=None, kernel_name=context.kernel_name).preprocess(
+        _write_to_s3(metrics_s3_uri, json.dumps(metrics), s3, METRICS_CONTENT_TYPE)
+    except Exception:
+        logger.warning("Failed to upload the metrics to {}.".format(metrics_s3_uri), exc_info=True)
+
+def _write_output_to_s3(context, metrics=None):
+    s3 = context.s3
+    # the html is rendered from the complete notebook while the ipynb is being compacted and uploaded
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        ipynb_upload = executor.submit(_write_ipynb_to_s3, context, s3)
+        _write_to_s3(context.output_html_s3_uri, _render_html(context.nb), s3, HTML_CONTENT_TYPE)
+        if metrics is not None:
+            _write_metrics_to_s3(context, metrics, s3)
+        ipynb_upload.result()
+
+class _Checkpointer(object):
+    """Uploads the partially executed notebook at cell boundaries, once the configured number of cells
+    have run or the configured number of seconds have passed since the last checkpoint.
+    Uploads happen on a background thread and only the latest pending checkpoint is kept, so that a slow
+    upload delays the next checkpoint rather than the execution."""
+    def __init__(self, upload, interval_seconds=None, interval_cells=None, clock=time.monotonic):
+        self.upload = upload
+        self.interval_seconds = interval_seconds
+        self.interval_cells = interval_cells
+        self.clock = clock
+        self._last_checkpoint_time = clock()
+        self._cells_since_checkpoint = 0
+        self._pending = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._upload_checkpoints, name='checkpointer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @classmethod
+    def from_environment(cls, upload):
+        interval_seconds = float(os.environ.get(CHECKPOINT_INTERVAL_SECONDS_ENV_VAR) or 0)
+        interval_cells = int(os.environ.get(CHECKPOINT_INTERVAL_CELLS_ENV_VAR) or 0)
+        if interval_seconds <= 0 and interval_cells <= 0:
+            return None
+        return cls(upload, interval_seconds or None, interval_cells or None)
+
+    def _is_due(self):
+        return ((self.interval_cells and self._cells_since_checkpoint >= self.interval_cells)
+            or (self.interval_seconds and self.clock() - self._last_checkpoint_time >= self.interval_seconds))
+
+    def cell_executed(self, nb):
+        self._cells_since_checkpoint += 1
+        if not self._is_due():
+            return
+        self._cells_since_checkpoint = 0
+        self._last_checkpoint_time = self.clock()
+        # the notebook is serialized here because the executor modifies it once the next cell starts
+        ipynb_json = nbformat.writes(nb)
+        with self._condition:
+            self._pending = ipynb_json
+            self._condition.notify()
+
+    def _upload_checkpoints(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._pending is None:
+                    return
+                ipynb_json, self._pending = self._pending, None
+            try:
+                self.upload(ipynb_json)
+            except Exception:
+                logger.warning("Failed to upload a checkpoint of the notebook.", exc_info=True)
+
+    def close(self):
+        """Drops any pending checkpoint and waits for an ongoing upload, so that it cannot overwrite the final output."""
+        with self._condition:
+            self._closed = True
+            self._pending = None
+            self._condition.notify()
+        self._thread.join()
+
+def _download(uri, filepath):
+    from six.moves.urllib.request import urlopen
+    with contextlib.closing(urlopen(uri)) as response, open(filepath, 'wb') as output_file:
+        shutil.copyfileobj(response, output_file, 1024 * 1024)
+
+class _DatasetPrefetcher(object):
+    """Downloads the content of dataset versions concurrently into a local cache folder.
+    The client only needs the list_datasets and get_dataset_content operations of the iotanalytics client,
+    so that a local stand-in can replace the service."""
+    NOT_FOUND_ERROR_CODE = 'ResourceNotFoundException'
+
+    def __init__(self, client, cache_folder, download=_download, max_workers=MAX_DATASET_DOWNLOADS,
+            max_lookups=MAX_DATASET_LOOKUPS):
+        self.client = client
+        self.cache_folder = cache_folder
+        self.download = download
+        self.max_workers = max_workers
+        self.max_lookups = max_lookups
+
+    def _list_dataset_names(self):
+        dataset_names = []
+        kwargs = {}
+        while True:
+            response = self.client.list_datasets(**kwargs)
+            dataset_names.extend(summary['datasetName'] for summary in response.get('datasetSummaries', []))
+            if not response.get('nextToken'):
+                return dataset_names
+            kwargs = {'nextToken': response['nextToken']}
+
+    def _get_dataset_content(self, dataset_name, version_id):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.get_dataset_content(datasetName=dataset_name, versionId=version_id)
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') != self.NOT_FOUND_ERROR_CODE:
+                # e.g. throttling that outlasted the client's retries, which only loses this dataset's content
+                logger.warning("Failed to get the content version {} of dataset {}.".format(version_id, dataset_name),
+                    exc_info=True)
+            return None
+
+    def _find_dataset_contents(self, executor, version_ids):
+        # only the version id is passed to the container, so the datasets are asked for it until one has it,
+        # with at most max_lookups requests in flight so as not to be throttled
+        dataset_names = self._list_dataset_names()
+        pending_lookups = [(version_id, dataset_name) for version_id in version_ids for dataset_name in dataset_names]
+        pending_lookups.reverse()
+        lookups = {}
+        contents = {}
+        while pending_lookups or lookups:
+            while pending_lookups and len(lookups) < self.max_lookups:
+                version_id, dataset_name = pending_lookups.pop()
+                if version_id not in contents:
+                    lookups[executor.submit(self._get_dataset_content, dataset_name, version_id)] = \
+                        (version_id, dataset_name)
+            if not lookups:
+                break
+            done, _ = wait(lookups, return_when=FIRST_COMPLETED)
+            for lookup in done:
+                version_id, dataset_name = lookups.pop(lookup)
+                content = lookup.result()
+                if content is not None and version_id not in contents:
+                    contents[version_id] = (dataset_name, content.get('entries', []))
+        return contents
+
+    def _download_entry(self, uri, filepath):
+        if os.path.exists(filepath):
+            return
+        partial_filepath = filepath + '.partial'
+        self.download(uri, partial_filepath)
+        os.replace(partial_filepath, filepath)
+
+    def prefetch(self, dataset_versions):
+        """Downloads the content of the dataset versions, given by variable name, and returns the local paths of
+        each variable's content."""
+        paths = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            contents = self._find_dataset_contents(executor, sorted(set(dataset_versions.values())))
+            downloads = {}
+            for variable_name, version_id in dataset_versions.items():
+                if version_id not in contents:
+                    logger.warning("No dataset has a content version {} for variable {}.".format(version_id, variable_name))
+                    continue
+                dataset_name, entries = contents[version_id]
+                folder = os.path.join(self.cache_folder, dataset_name, version_id)
+                if not os.path.isdir(folder):
+                    os.makedirs(folder)
+                paths[variable_name] = []
+                for entry_position, entry in enumerate(entries):
+                    filename = os.path.basename(entry.get('entryName') or '') or 'entry{}'.format(entry_position)
+                    filepath = os.path.join(folder, filename)
+                    paths[variable_name].append(filepath)
+                    if filepath not in downloads:
+                        downloads[filepath] = executor.submit(self._download_entry, entry['dataURI'], filepath)
+            for download in downloads.values():
+                download.result()
+        return paths
+
+def _get_dataset_versions(variables):
+    dataset_variable_names = [name for name in os.environ.get(DATASET_VARIABLES_ENV_VAR, '').split(',') if name]
+    return {name: variables[name] for name in dataset_variable_names if name in variables}
+
+def _expose_helpers_to_kernel():
+    """Lets the notebook import this script's helpers, e.g. `from iota_run_nb import upload_file`."""
+    python_paths = [path for path in os.environ.get('PYTHONPATH', '').split(os.pathsep) if path]
+    if SCRIPT_FOLDER not in python_paths:
+        os.environ['PYTHONPATH'] = os.pathsep.join([SCRIPT_FOLDER] + python_paths)
+
+def _prefetch_datasets(dataset_versions, client=None, manifest_filename='manifest.json'):
+    """Returns the path of the manifest that get_dataset_paths reads, or None if nothing was downloaded."""
+    if not dataset_versions:
+        return None
+    cache_folder = os.environ.get(DATASET_CACHE_FOLDER_ENV_VAR) or DEFAULT_DATASET_CACHE_FOLDER
+    try:
+        if client is None:
+            import boto3
+            from botocore.config import Config
+            # the lookups back off together once the service throttles them
+            client = boto3.client('iotanalytics', config=Config(retries={'mode': 'adaptive'}))
+        paths = _DatasetPrefetcher(client, cache_folder).prefetch(dataset_versions)
+    except Exception:
+        # the notebook can still download the datasets itself
+        logger.warning("Failed to prefetch the datasets.", exc_info=True)
+        return None
+    manifest_filepath = os.path.join(cache_folder, manifest_filename)
+    with open(manifest_filepath, 'w') as manifest_file:
+        json.dump(paths, manifest_file)
+    os.environ[DATASET_MANIFEST_ENV_VAR] = manifest_filepath
+    _expose_helpers_to_kernel()
+    return manifest_filepath
+
+def get_dataset_paths(variable_name):
+    """Returns the local paths of the dataset content that the datasetContentVersionId variable refers to.
+    The content is downloaded before the notebook runs."""
+    manifest_filepath = os.environ.get(DATASET_MANIFEST_ENV_VAR)
+    if not manifest_filepath:
+        raise KeyError("No dataset content was downloaded for " + variable_name)
+    with open(manifest_filepath) as manifest_file:
+        return json.load(manifest_file)[variable_name]
+
+def upload_file(filepath, s3_uri):
+    """Uploads a local file, e.g. to an outputFileUri variable's uri, in the background while the notebook keeps running.
+    The notebook's outputs are only written once all such uploads are complete. The file can be modified or deleted
+    as soon as this returns. Outside of the image the file is uploaded right away."""
+    spool_folder = os.environ.get(OUTPUT_SPOOL_FOLDER_ENV_VAR)
+    if not spool_folder:
+        import boto3
+        _upload_file_to_s3(filepath, s3_uri, boto3.resource('s3'))
+        return
+    upload_id = str(uuid.uuid4())
+    spooled_filepath = os.path.join(spool_folder, upload_id + _OutputFileUploader.DATA_EXT)
+    # a copy rather than a hard link, which would share the notebook's later writes to the file
+    shutil.copyfile(filepath, spooled_filepath)
+    # the upload is only visible to the uploader once its description is complete
+    upload_filepath = os.path.join(spool_folder, upload_id + _OutputFileUploader.UPLOAD_EXT)
+    with open(upload_filepath + '.partial', 'w') as upload_file:
+        json.dump({'filepath': spooled_filepath, 's3_uri': s3_uri}, upload_file)
+    os.replace(upload_filepath + '.partial', upload_filepath)
+
+class _OutputFileUploader(object):
+    """Uploads the files that the kernel spools through upload_file, in parallel, retrying failed uploads."""
+    DATA_EXT = '.data'
+    UPLOAD_EXT = '.upload'
+    MAX_ATTEMPTS = 3
+    RETRY_DELAY_SECONDS = 1
+    POLL_INTERVAL_SECONDS = 0.2
+
+    def __init__(self, spool_folder, upload, max_workers=DEFAULT_UPLOAD_MAX_CONCURRENCY, sleep=time.sleep):
+        self.spool_folder = spool_folder
+        self.upload = upload
+        self.sleep = sleep
+        self.failed_s3_uris = []
+        if not os.path.isdir(spool_folder):
+            os.makedirs(spool_folder)
+        self._submitted = set()
+        self._uploads = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._poll, name='output_file_uploader')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _poll(self):
+        while not self._closed.wait(self.POLL_INTERVAL_SECONDS):
+            self._submit_spooled_uploads()
+
+    def _submit_spooled_uploads(self):
+        for filename in sorted(os.listdir(self.spool_folder)):
+            if filename.endswith(self.UPLOAD_EXT) and filename not in self._submitted:
+                self._submitted.add(filename)
+                self._uploads.append(self._executor.submit(self._upload, os.path.join(self.spool_folder, filename)))
+
+    def _upload(self, upload_filepath):
+        with open(upload_filepath) as upload_file:
+            upload = json.load(upload_file)
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            try:
+                self.upload(upload['filepath'], upload['s3_uri'])
+                break
+            except Exception:
+                logger.warning("Attempt {} to upload {} failed.".format(attempt, upload['s3_uri']), exc_info=True)
+                if attempt == self.MAX_ATTEMPTS:
+                    self.failed_s3_uris.append(upload['s3_uri'])
+                    return
+                self.sleep(self.RETRY_DELAY_SECONDS * 2 ** (attempt - 1))
+        os.remove(upload['filepath'])
+        os.remove(upload_filepath)
+
+    def close(self):
+        """Uploads the files spooled so far and waits for all uploads to finish."""
+        self._closed.set()
+        self._thread.join()
+        self._submit_spooled_uploads()
+        for upload in self._uploads:
+            upload.result()
+        self._executor.shutdown()
+        if self.failed_s3_uris:
+            logger.error("Failed to upload output files to: " + ", ".join(self.failed_s3_uris))
+
+def _get_kernel_pid(km):
+    # jupyter_client 7 moved the kernel process behind a provisioner
+    process = getattr(getattr(km, 'provisioner', None), 'process', None) or getattr(km, 'kernel', None)
+    return getattr(process, 'pid', None)
+
+def _read_cpu_seconds(pid):
+    try:
+        with open('/proc/{}/stat'.format(pid)) as stat_file:
+            # the command name in the second field may contain spaces, so the fields are counted from its end
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    # utime, stime, cutime and cstime are fields 14 to 17 of /proc/[pid]/stat
+    return sum(int(field) for field in fields[11:15]) / float(os.sysconf('SC_CLK_TCK'))
+
+def _read_peak_rss_bytes(pid):
+    try:
+        with open('/proc/{}/status'.format(pid)) as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _reset_peak_rss(pid):
+    try:
+        with open('/proc/{}/clear_refs'.format(pid), 'w') as clear_refs_file:
+            clear_refs_file.write('5')
+        return True
+    except OSError:
+        return False
+
+class _CellProfiler(object):
+    """Measures the wall time, cpu time and peak resident memory of the kernel while each code cell runs.
+    The peak memory is the kernel's peak so far if it cannot be reset between cells."""
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.cells = []
+        self._pid = None
+        self._start = None
+
+    def start_cell(self, kernel_pid):
+        self._pid = kernel_pid
+        peak_rss_reset = _reset_peak_rss(kernel_pid) if kernel_pid else False
+        self._start = (self.clock(), _read_cpu_seconds(kernel_pid) if kernel_pid else None, peak_rss_reset)
+
+    def end_cell(self, cell, cell_position):
+        start_time, start_cpu_seconds, peak_rss_reset = self._start
+        end_cpu_seconds = _read_cpu_seconds(self._pid) if self._pid else None
+        metrics = {
+            'wall_seconds': round(self.clock() - start_time, 6),
+            'cpu_seconds': round(end_cpu_seconds - start_cpu_seconds, 6)
+                if start_cpu_seconds is not None and end_cpu_seconds is not None else None,
+            'peak_rss_bytes': _read_peak_rss_bytes(self._pid) if self._pid else None,
+            'peak_rss_reset': peak_rss_reset
+        }
+        cell.metadata[CELL_METRICS_METADATA_KEY] = metrics
+        cell_metrics = {'cell': cell_position}
+        cell_metrics.update(metrics)
+        self.cells.append(cell_metrics)
+
+    def get_metrics(self):
+        return {
+            'wall_seconds': round(sum(cell['wall_seconds'] for cell in self.cells), 6),
+            'cells': self.cells
+        }
+
+def _execute_code_cell(execute, cell, cell_position, kernel_pid, nb, checkpointer, profiler):
+    profiler.start_cell(kernel_pid)
+    try:
+        return execute()
+    finally:
+        profiler.end_cell(cell, cell_position)
+        if checkpointer:
+            checkpointer.cell_executed(nb)
+
+def _create_execute_preprocessor(kernel_name, nb, checkpointer, profiler):
+    from nbconvert.preprocessors import ExecutePreprocessor
+
+    class ProfilingExecutePreprocessor(ExecutePreprocessor):
+        def preprocess_cell(self, cell, resources, cell_index, *args, **kwargs):
+            # nbconvert 5 forgets the client of a kernel it did not start once the notebook ran
+            self.kernel_client = self.kc
+            execute = lambda: super(ProfilingExecutePreprocessor, self).preprocess_cell(
+                cell, resources, cell_index, *args, **kwargs)
+            if cell.cell_type != 'code':
+                return execute()
+            return _execute_code_cell(execute, cell, cell_index, _get_kernel_pid(self.km), nb, checkpointer, profiler)
+
+    return ProfilingExecutePreprocessor(timeout=None, kernel_name=kernel_name)
+
+class _CellExecutionError(Exception):
+    pass
+
+def _json_safe_data(data):
+    # some formatters return binary data, e.g. png images, which nbformat stores base64 encoded
+    return {mimetype: base64.b64encode(value).decode('ascii') if isinstance(value, bytes) else value
+        for mimetype, value in data.items()}
+
+class _OutputStream(io.TextIOBase):
+    """Writes a stream, e.g. stdout, into the outputs of the cell that is running in the in-process shell."""
+    encoding = 'utf-8'
+
+    def __init__(self, shell, name):
+        self.shell = shell
+        self.name = name
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if isinstance(text, bytes):
+            text = text.decode(self.encoding, 'replace')
+        if text:
+            self.shell.append_stream(self.name, text)
+        return len(text)
+
+def _create_in_process_shell():
+    from IPython.core.displayhook import DisplayHook
+    from IPython.core.displaypub import DisplayPublisher
+    from IPython.core.interactiveshell import InteractiveShell
+    from traitlets import Type
+    from traitlets.config import Config
+
+    class CapturingDisplayHook(DisplayHook):
+        """Records the value of a cell's last expression as an execute_result output instead of printing it."""
+        def write_output_prompt(self):
+            pass
+
+        def write_format_data(self, format_dict, md_dict=None):
+            self.shell.append_output(nbformat.v4.new_output('execute_result', data=_json_safe_data(format_dict),
+                metadata=md_dict or {}, execution_count=self.prompt_count))
+
+        def finish_displayhook(self):
+            pass
+
+    class CapturingDisplayPublisher(DisplayPublisher):
+        def publish(self, data, metadata=None, source=None, *args, **kwargs):
+            display_id = (kwargs.get('transient') or {}).get('display_id')
+            self.shell.publish_display_data(_json_safe_data(data), metadata or {}, display_id, kwargs.get('update'))
+
+        def clear_output(self, wait=False):
+            self.shell.clear_outputs(wait)
+
+    class InProcessShell(InteractiveShell):
+        """Runs cells like the kernel's shell does, but records their outputs instead of sending them."""
+        displayhook_class = Type(CapturingDisplayHook)
+        display_pub_class = Type(CapturingDisplayPublisher)
+        # shell commands write to sys.stdout rather than to this process' stdout file descriptor
+        system = InteractiveShell.system_piped
+
+        def start_cell(self):
+            self.cell_outputs = []
+            self.clear_before_next_output = False
+            self.displays = {}
+
+        def append_output(self, output):
+            if self.clear_before_next_output:
+                del self.cell_outputs[:]
+                self.clear_before_next_output = False
+            self.cell_outputs.append(output)
+
+        def append_stream(self, name, text):
+            last_output = self.cell_outputs[-1] if self.cell_outputs else None
+            if (not self.clear_before_next_output and last_output
+                    and last_output.output_type == 'stream' and last_output.name == name):
+                last_output.text += text
+            else:
+                self.append_output(nbformat.v4.new_output('stream', name=name, text=text))
+
+        def clear_outputs(self, wait):
+            if wait:
+                self.clear_before_next_output = True
+            else:
+                del self.cell_outputs[:]
+
+        def publish_display_data(self, data, metadata, display_id, update):
+            if update:
+                for output in self.displays.get(display_id, []):
+                    output.data = data
+                    output.metadata = metadata
+                return
+            output = nbformat.v4.new_output('display_data', data=data, metadata=metadata)
+            if display_id:
+                self.displays.setdefault(display_id, []).append(output)
+            self.append_output(output)
+
+        def _showtraceback(self, etype, evalue, stb):
+            self.append_output(nbformat.v4.new_output('error', ename=getattr(etype, '__name__', str(etype)),
+                evalue=str(evalue), traceback=stb))
+
+    # display() and the inline matplotlib backend look the shell up as the InteractiveShell singleton,
+    # which is replaced so that every run starts from an empty namespace
+    InteractiveShell.clear_instance()
+    # the history database is bound to the thread that opens it, while the shell is closed at exit by the main thread
+    config = Config()
+    config.HistoryManager.enabled = False
+    return InProcessShell.instance(config=config)
+
+class _InProcessExecutor(object):
+    """Runs the notebook's code cells in an IPython shell inside this process, which avoids starting a kernel
+    process and exchanging messages with it. Like ExecutePreprocessor, it stops at the first failing cell."""
+    def __init__(self, nb, checkpointer, profiler):
+        self.nb = nb
+        self.checkpointer = checkpointer
+        self.profiler = profiler
+
+    def preprocess(self, nb, resources):
+        shell = _create_in_process_shell()
+        path = resources.get('metadata', {}).get('path')
+        if path:
+            os.chdir(path)
+        for cell_position, cell in enumerate(nb.cells):
+            if cell.cell_type == 'code' and cell.source.strip():
+                _execute_code_cell(lambda: self._execute_cell(shell, cell, cell_position), cell, cell_position,
+                    os.getpid(), self.nb, self.checkpointer, self.profiler)
+        return nb, resources
+
+    @staticmethod
+    def _execute_cell(shell, cell, cell_position):
+        shell.start_cell()
+        cell.execution_count = shell.execution_count
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = _OutputStream(shell, 'stdout'), _OutputStream(shell, 'stderr')
+        try:
+            result = shell.run_cell(cell.source, store_history=True)
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            cell.outputs = shell.cell_outputs
+        if not result.success and RAISES_EXCEPTION_TAG not in cell.metadata.get('tags', []):
+            error = result.error_in_exec or result.error_before_exec
+            raise _CellExecutionError("An error occurred while executing cell {}: {!r}".format(cell_position, error))
+
+def _start_kernel(kernel_name, path):
+    from jupyter_client.manager import KernelManager
+    km = KernelManager(kernel_name=kernel_name)
+    km.start_kernel(cwd=path or None)
+    return km
+
+def _get_run_setup_source(environment, path):
+    # %reset keeps the imported modules loaded, and the execution count restarts so that the cells of every
+    # run are numbered from 1. ipykernel 4 and 5 count executions separately from the shell. the history is
+    # stored by session and line number, so the restarted lines go to a new session.
+    lines = ["get_ipython().run_line_magic('reset', '-f')",
+        "get_ipython().history_manager.reset(new_session=True)",
+        "get_ipython().execution_count = 1",
+        "get_ipython().kernel.execution_count = 0",
+        "import os",
+        "os.environ.update({!r})".format(environment)]
+    if path:
+        lines.append("os.chdir({!r})".format(path))
+    lines.append("del os")
+    return "\n".join(lines)
+
+def _execute_silently(km, source):
+    kc = km.client()
+    kc.start_channels()
+    try:
+        kc.wait_for_ready(timeout=KERNEL_TIMEOUT_SECONDS)
+        reply = kc.execute_interactive(source, silent=True, store_history=False, timeout=KERNEL_TIMEOUT_SECONDS)
+    finally:
+        kc.stop_channels()
+    if reply['content']['status'] != 'ok':
+        raise RuntimeError("Failed to prepare the kernel: " + reply['content'].get('evalue', ''))
+
+class _KernelSession(object):
+    """Runs notebooks one after another in the same kernel process, so that the modules a run imports are already
+    loaded for the next run. The kernel's namespace is reset before each run, and the kernel is replaced after
+    a failed run, since whatever state the failure left behind cannot be trusted."""
+    def __init__(self):
+        self.km = None
+
+    def execute(self, context, checkpointer, profiler, environment):
+        if self.km is None:
+            self.km = _start_kernel(context.kernel_name, context.notebook_dir)
+        preprocessor = _create_execute_preprocessor(context.kernel_name, context.nb, checkpointer, profiler)
+        try:
+            _execute_silently(self.km, _get_run_setup_source(environment, context.notebook_dir))
+            preprocessor.preprocess(context.nb, {'metadata': {'path': context.notebook_dir}}, km=self.km)
+        except Exception:
+            self.close()
+            raise
+        finally:
+            kernel_client = getattr(preprocessor, 'kernel_client', None)
+            if kernel_client is not None:
+                kernel_client.stop_channels()
+
+    def close(self):
+        if self.km is not None:
+            try:
+                self.km.shutdown_kernel(now=True)
+            except Exception:
+                logger.warning("Failed to shut down a kernel.", exc_info=True)
+            self.km = None
+
+class _InProcessSession(object):
+    """Runs notebooks in this process. Every run gets a new shell, while the imported modules stay loaded."""
+    def execute(self, context, checkpointer, profiler, environment):
+        os.environ.update(environment)
+        _InProcessExecutor(context.nb, checkpointer, profiler).preprocess(
             context.nb, {'metadata': {'path': context.notebook_dir}})
+
+    def close(self):
+        pass
+
+def _get_execution_mode():
+    execution_mode = os.environ.get(EXECUTION_MODE_ENV_VAR) or SUBPROCESS_EXECUTION_MODE
+    if execution_mode not in (SUBPROCESS_EXECUTION_MODE, IN_PROCESS_EXECUTION_MODE):
+        logger.warning("Unknown execution mode {}, running the notebook in a kernel process.".format(execution_mode))
+        return SUBPROCESS_EXECUTION_MODE
+    return execution_mode
+
+def _create_session(execution_mode):
+    if execution_mode == IN_PROCESS_EXECUTION_MODE:
+        return _InProcessSession()
+    return _KernelSession()
+
+def _get_batch_concurrency(execution_mode, run_count):
+    concurrency = int(os.environ.get(BATCH_CONCURRENCY_ENV_VAR) or 1)
+    if concurrency > 1 and execution_mode == IN_PROCESS_EXECUTION_MODE:
+        # the in-process shell is a singleton and the runs would share sys.stdout
+        logger.warning("The runs of a batch execute one after another in the {} execution mode.".format(execution_mode))
+        return 1
+    return max(1, min(concurrency, run_count))
+
+class _BatchExecutionError(Exception):
+    pass
+
+_prefetch_lock = threading.Lock()
+
+def _run(context, session, run_position, spool_folder):
+    # variables are removed from the context once they are replaced
+    dataset_versions = _get_dataset_versions(context.variables)
+    _replace_variables_in_notebook(context)
+    # concurrent runs would otherwise download the same dataset content into the same file
+    with _prefetch_lock:
+        manifest_filepath = _prefetch_datasets(dataset_versions,
+            manifest_filename='manifest{}.json'.format(run_position))
+
+    output_file_uploader = _OutputFileUploader(spool_folder,
+        lambda filepath, s3_uri: _upload_file_to_s3(filepath, s3_uri, context.s3), _get_upload_max_concurrency())
+    checkpointer = _Checkpointer.from_environment(
+        lambda ipynb_json: _write_to_s3(context.output_ipynb_s3_uri, ipynb_json, context.s3, IPYNB_CONTENT_TYPE))
+    profiler = _CellProfiler()
+    closeables = [checkpointer, output_file_uploader] if checkpointer else [output_file_uploader]
+    try:
+        session.execute(context, checkpointer, profiler, {OUTPUT_SPOOL_FOLDER_ENV_VAR: spool_folder,
+            DATASET_MANIFEST_ENV_VAR: manifest_filepath or ''})
+    except BaseException:
+        _close_and_write_output(context, profiler, closeables)
+        raise
+    close_error = _close_and_write_output(context, profiler, closeables)
+    if close_error:
+        raise close_error
+
+def _close_and_write_output(context, profiler, closeables):
+    """Closes the checkpointer and the output file uploader, and writes the outputs even if closing failed, e.g.
+    because an output file could not be uploaded, so that the executed notebook is not lost. Returns the first
+    error of closing."""
+    close_error = None
+    for closeable in closeables:
+        try:
+            closeable.close()
+        except Exception as error:
+            logger.warning("Failed to close the {}.".format(type(closeable).__name__), exc_info=True)
+            close_error = close_error or error
+    _write_output_to_s3(context, profiler.get_metrics())
+    return close_error
+
+def _run_in_idle_session(sessions, context, run_position, spool_folder):
+    session = sessions.get()
+    try:
+        _run(context, session, run_position, spool_folder)
+    finally:
+        sessions.put(session)
+
+def run_notebook(context=None):
+    """Runs the notebook with the given context, or once per set of variables of the params. The runs of a batch
+    share warm sessions, IOTA_BATCH_CONCURRENCY of them in parallel, and a failed run does not stop the others."""
+    contexts = [context] if context else _load_contexts()
+    execution_mode = _get_execution_mode()
+    concurrency = _get_batch_concurrency(execution_mode, len(contexts))
+    spool_folder = os.environ.get(OUTPUT_SPOOL_FOLDER_ENV_VAR) or DEFAULT_OUTPUT_SPOOL_FOLDER
+    # kernels inherit the PYTHONPATH that exposes the helpers when they start
+    _expose_helpers_to_kernel()
+
+    sessions = queue.Queue()
+    for _ in range(concurrency):
+        sessions.put(_create_session(execution_mode))
+    failed_run_positions = []
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            runs = [executor.submit(_run_in_idle_session, sessions, run_context, run_position,
+                os.path.join(spool_folder, 'run{}'.format(run_position)))
+                for run_position, run_context in enumerate(contexts)]
+            for run_position, run in enumerate(runs):
+                try:
+                    run.result()
+                except Exception:
+                    if len(contexts) == 1:
+                        raise
+                    logger.error("Run {} of the batch failed.".format(run_position), exc_info=True)
+                    failed_run_positions.append(run_position)
     finally:
-        _write_output_to_s3(context)
+        while not sessions.empty():
+            sessions.get().close()
+    if failed_run_positions:
+        raise _BatchExecutionError("Runs {} of the batch failed.".format(failed_run_positions))
+
+def _write_variable_index(notebook_path, index_filepath, var_names):
+    with io.open(notebook_path, encoding='utf-8') as f:
+        nb = nbformat.read(f, as_version=nbformat.NO_CONVERT)
+    with open(index_filepath, 'w') as index_file:
+        json.dump(build_variable_index(nb, var_names), index_file)
 
 if __name__ == "__main__":
-    run_notebook()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--build-variable-index', nargs=2, metavar=('NOTEBOOK_PATH', 'INDEX_PATH'),
+        help='write the variable index of a notebook instead of running it')
+    parser.add_argument('--variables', nargs='*', default=[], help='the variables to index')
+    args = parser.parse_args()
+    if args.build_variable_index:
+        notebook_path, index_filepath = args.build_variable_index
+        _write_variable_index(notebook_path, index_filepath, args.variables)
+    else:
+        run_notebook()
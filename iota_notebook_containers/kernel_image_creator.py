@@ -3,43 +3,86 @@ Create image from containerized kernel
 Steps:
     1. Copy the containerized kernel
     2. Copy all env variables and files along the sys paths of the kernel's python env onto that copy
-    3. Commit the container to OUTPUT_IMAGE
+    3. Commit the container to OUTPUT_IMAGE, tagged with the containerization's job id
     4. Set the entrypoint to a script that will run the notebook with the appropriate python executable
+    5. Copy an index of where the notebook's variables are assigned, so that the script does not need to parse the notebook
 """
 import ast
 import docker
 import logging
 import os
+import requests
 import shutil
 import subprocess
 import tarfile
+import time
 import traceback
+import uuid
 
-from collections import namedtuple
+from collections import Counter, namedtuple
 from hurry.filesize import size
 from io import BytesIO
 from pathlib import Path
 
-from iota_notebook_containers.constants import CONTAINER_NAME, SAGEMAKER_FOLDER, AWS_SETTINGS_FOLDER
+from iota_notebook_containers.build_artifacts import BuildArtifacts
+from iota_notebook_containers.build_governor import BuildGovernor
+from iota_notebook_containers.build_journal import BuildJournal
+from iota_notebook_containers.constants import CONTAINER_NAME, SAGEMAKER_FOLDER, AWS_SETTINGS_FOLDER, \
+    BUILD_COPY_RETRIES_ENV_VAR, BUILD_COPY_RETRY_BACKOFF_ENV_VAR
+from iota_notebook_containers.containerization_metrics import ContainerizationMetrics
 from iota_notebook_containers.containerized_kernel_utils import remove_containerized_prefix
 from environment_kernels import EnvironmentKernelSpecManager
 
 ImageCreationStatus = namedtuple("ImageCreationStatus", "progress image error_msg error_trace")
 
+class FileBatchLimits(object):
+    """The most bytes and files that the next batch copied onto the container may hold."""
+    def __init__(self, max_bytes, max_files):
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+
 class KernelImageCreator(object):
-    ASTTOKENS_PACKAGE = "asttokens==1.1.10"
     CONDA_PREFIX = "conda_"
+    DATASET_VARIABLE_TYPE = "datasetContentVersionId"
+    DATASET_VARIABLES_ENV_VAR = "IOTA_DATASET_VARIABLES"
+    DEFAULT_COPY_RETRIES = 3
+    DEFAULT_COPY_RETRY_BACKOFF_SECONDS = 2.0
+    DEFAULT_DOCKER_ROOT_DIR = "/"
     DOCKER_TIMEOUT = 600
+    # rough throughputs of the copy onto the container, the commit and the push, used to predict how long
+    # a containerization takes before it starts. the pushed layers are gzip compressed.
+    ESTIMATED_COPY_BYTES_PER_SECOND = 100 * 1024 * 1024
+    ESTIMATED_COPY_SECONDS_PER_FILE = 0.0005
+    ESTIMATED_COMMIT_BYTES_PER_SECOND = 200 * 1024 * 1024
+    ESTIMATED_PUSH_BYTES_PER_SECOND = 20 * 1024 * 1024
+    ESTIMATED_PUSH_COMPRESSION_RATIO = 0.45
     ENV_FOLDER = "/home/ec2-user/anaconda3/envs/"
     EXCLUDE_FROM_CP = ".pyc"
     FAILURE_MSG = "Image creation failed."
+    # the batches start small, so that the first progress update comes quickly, and are then scaled by the
+    # measured copy time towards TARGET_FILEBATCH_SECONDS, by at most a factor of FILEBATCH_MAX_SCALING per batch.
+    # counting files as well as bytes keeps the tar headers of many small files from making a batch slow.
+    FILEBATCH_MAX_SCALING = 2.0
+    INITIAL_FILEBATCH_FILES = 4096
+    INITIAL_FILEBATCH_SIZE = 64 * 1024 * 1024 # 64 mb
+    INSUFFICIENT_SPACE_ERROR_FMT = "There is insufficient space remaining on this instance to " + \
+        "containerize this notebook. Containerization would require {} of additional space."
     INTERIM_CONTAINER_NAME = "interim_containerized_kernel"
+    LARGEST_DIRECTORIES_COUNT = 10
+    MAX_FILEBATCH_FILES = 65536
     MAX_FILEBATCH_SIZE = 512 * 1024 * 1024 # 0.5 gb
+    MIN_FILEBATCH_FILES = 64
+    MIN_FILEBATCH_SIZE = 4 * 1024 * 1024 # 4 mb
     NOTEBOOK_EXECUTION_FILE = "iota_run_nb.py"
     NOTEBOOK_EXECUTION_FILEPATH = "/home/ec2-user/iota_run_nb.py"
     NOTEBOOK_PATH_ENV_VAR = "NOTEBOOK_PATH"
     OUTPUT_IMAGE = "output_image"
+    RESUMABLE_FAILURE_MSG = "Image creation failed while copying files onto the container. " + \
+        "Containerizing this notebook again continues with the files that were not copied yet."
+    OUT_OF_SPACE_ERROR_FMT = "This instance ran out of space while containerizing this notebook. " + \
+        "Containerization would require {} of additional space."
     SPACE_REQUIREMENT_FUDGE_BYTES = 10 * 1024 * 1024 # 10 mb
+    TARGET_FILEBATCH_SECONDS = 2.0
     # we multiply by 1.9 because the data will be duplicated while it is stored in
     # both the container and the image. this is a conservative estimate because the
     # image is compressed. a quick empirical measure found the space use to be
@@ -47,58 +90,174 @@ class KernelImageCreator(object):
     # 2x would be safer, but that would block instances with the current amount
     # of free space from containerizing images
     REQUIRED_SPACE_PER_FILES_SPACE = 1.9
+    VARIABLE_INDEX_FILEPATH = "/home/ec2-user/iota_run_nb_index.json"
 
     logger = logging.getLogger(__name__)
     docker_client = docker.from_env(timeout=DOCKER_TIMEOUT)
 
     @classmethod
-    def create(cls, containerized_kernel, notebook_path):
+    def create(cls, containerized_kernel, notebook_path, variables=(), job_id=None, metrics=None):
+        metrics = metrics or ContainerizationMetrics()
+        # a journaled interim container is kept until this containerization decides not to resume it
+        copying = False
+        keep_interim_container = True
         try:
+            original_container = cls.docker_client.containers.get(CONTAINER_NAME)
+            dataset_variable_names = [variable["name"] for variable in variables
+                if variable["type"] == cls.DATASET_VARIABLE_TYPE]
+            build = {"kernel": containerized_kernel, "notebook_path": notebook_path,
+                "dataset_variable_names": dataset_variable_names, "image": original_container.image.id}
+            interim_container, copied_file_versions, resumed_job_id = cls._get_resumable_interim_container(build)
+            job_id = resumed_job_id or job_id or uuid.uuid4().hex
+            keep_interim_container = False
+
             cls.logger.info("Clearing any pre-existing output images or containers")
-            cls._delete_output_container_and_image()
+            with metrics.time_phase(ContainerizationMetrics.CLEANUP_PHASE):
+                cls._delete_output_container_and_image()
+                BuildArtifacts.collect(cls.docker_client, active_job_id=job_id, building_notebook_path=notebook_path)
             kernel = remove_containerized_prefix(containerized_kernel)
             cls._copy_notebook_execution_file_to_dest()
             python_executable = cls._get_env_python_executable(kernel)
 
-            cls.logger.info("Installing asttokens.")
-            pip_path = os.path.join(os.path.dirname(python_executable), "pip")
-            # this package is required by iota_run_nb.py
-            subprocess.check_output([pip_path, "install", "-q", cls.ASTTOKENS_PACKAGE])
-
-            folders_to_copy = cls._get_folders_to_copy(kernel, python_executable)
-            insufficient_space_msg = cls._get_message_if_space_insufficient(
-                cls._generate_files_to_copy(folders_to_copy, cls.EXCLUDE_FROM_CP))
+            with metrics.time_phase(ContainerizationMetrics.VARIABLE_INDEX_PHASE):
+                cls._build_variable_index(python_executable, notebook_path,
+                    [variable["name"] for variable in variables])
+
+            with metrics.time_phase(ContainerizationMetrics.WALK_PHASE):
+                folders_to_copy = cls._get_folders_to_copy(kernel, python_executable)
+                generate_files_to_copy = lambda: cls._generate_files_not_copied(
+                    cls._generate_files_to_copy(folders_to_copy, cls.EXCLUDE_FROM_CP), copied_file_versions)
+                docker_root_dir = cls._get_docker_root_dir()
+                files_bytes = cls._get_total_size_of_files(generate_files_to_copy())
+                metrics.add(ContainerizationMetrics.WALK_PHASE, bytes=files_bytes)
+            required_bytes = cls._get_required_space_bytes(files_bytes)
+            insufficient_space_msg = cls._get_message_if_space_insufficient(required_bytes, docker_root_dir)
             if insufficient_space_msg:
                 yield ImageCreationStatus(progress=0, image=None,
                     error_msg=insufficient_space_msg, error_trace=None)
                 return
 
-            original_container = cls.docker_client.containers.get(CONTAINER_NAME)
-            interim_container = cls._create_interim_container(original_container, containerized_kernel, notebook_path)
-            interim_container.start()
+            if interim_container:
+                cls.logger.info("Resuming the copy onto the container of job {}.".format(job_id))
+            else:
+                interim_container = cls._create_interim_container(original_container, containerized_kernel,
+                    notebook_path, dataset_variable_names, BuildArtifacts.get_labels(
+                        BuildArtifacts.INTERIM_CONTAINER, job_id, notebook_path, kernel))
+                BuildJournal.start(dict(build, job_id=job_id, container_id=interim_container.id))
+            if interim_container.status != "running":
+                interim_container.start()
 
             cls.logger.info("Copying files onto the container.")
-            total_to_copy = cls._get_total_size_of_files(cls._generate_files_to_copy(folders_to_copy, cls.EXCLUDE_FROM_CP))
-            total_copied = 0
-            for filepaths in cls._split_into_batches(cls._generate_files_to_copy(folders_to_copy, cls.EXCLUDE_FROM_CP)):
-                cls._copy_onto_container(interim_container, filepaths)
-                total_copied += cls._get_total_size_of_files(filepaths)
-                progress = int(100*float(total_copied)/total_to_copy)
-                yield ImageCreationStatus(progress=progress, image=None, error_msg=None, error_trace=None)
+            copying = True
+            for status in cls._copy_files_onto_container(interim_container, generate_files_to_copy,
+                    required_bytes, docker_root_dir, BuildGovernor.from_env(), metrics):
+                yield status
+                if status.error_msg:
+                    return
+            copying = False
+            if os.path.exists(cls.VARIABLE_INDEX_FILEPATH):
+                cls._copy_onto_container(interim_container, [cls.VARIABLE_INDEX_FILEPATH])
 
             cls.logger.info("Writing the container to an image.")
-            interim_container.commit(cls.OUTPUT_IMAGE,
-                changes='ENTRYPOINT ["{}","{}"]'.format(python_executable, cls.NOTEBOOK_EXECUTION_FILEPATH))
+            # the labels given here are merged with those the container inherited from its own image
+            with metrics.time_phase(ContainerizationMetrics.COMMIT_PHASE):
+                image = interim_container.commit(cls.OUTPUT_IMAGE, tag=job_id,
+                    changes='ENTRYPOINT ["{}","{}"]'.format(python_executable, cls.NOTEBOOK_EXECUTION_FILEPATH),
+                    conf={"Labels": BuildArtifacts.get_labels(BuildArtifacts.OUTPUT_IMAGE, job_id, notebook_path,
+                        kernel)}).id
             cls.logger.info("Containerization complete.")
-            image = cls.docker_client.images.get(cls.OUTPUT_IMAGE).id
             yield ImageCreationStatus(progress=100, image=image, error_msg=None, error_trace=None)
         except Exception as exception:
             cls.logger.exception("Caught unhandled exception while creating the image.")
-            yield ImageCreationStatus(progress=0, image=None, error_msg=cls.FAILURE_MSG,
+            # the interim container holds the files copied so far, unless the failure was not a transient one
+            resumable = copying and cls._is_transient_failure(exception)
+            keep_interim_container = keep_interim_container or resumable
+            yield ImageCreationStatus(progress=0, image=None,
+                error_msg=cls.RESUMABLE_FAILURE_MSG if resumable else cls.FAILURE_MSG,
                 error_trace=traceback.format_exc())
             raise
         finally:
-            cls._delete_interim_container()
+            if not keep_interim_container:
+                BuildJournal.clear()
+                cls._delete_interim_container()
+
+    @classmethod
+    def estimate(cls, containerized_kernel):
+        """Estimates the size and duration of containerizing a kernel by walking the files that would be copied,
+        without creating any container. The image grows by the copied bytes, on top of the kernel container's image,
+        and the required space is based on them, as when the containerization starts."""
+        kernel = remove_containerized_prefix(containerized_kernel)
+        python_executable = cls._get_env_python_executable(kernel)
+        folders_to_copy = cls._get_folders_to_copy(kernel, python_executable)
+
+        # the execution file is only copied to its destination by create
+        file_count = 1
+        execution_file_stat = os.stat(os.path.join(os.path.dirname(__file__), cls.NOTEBOOK_EXECUTION_FILE))
+        total_bytes = unique_bytes = execution_file_stat.st_size
+        inodes = set()
+        directory_bytes = Counter()
+        for path in cls._get_paths_to_copy(folders_to_copy):
+            for filepath in cls._generate_files_under(path, (cls.EXCLUDE_FROM_CP,)):
+                try:
+                    stat = os.stat(filepath)
+                except OSError:
+                    continue
+                file_count += 1
+                total_bytes += stat.st_size
+                # files reached through several links are copied once per path but only stored once on this instance
+                if (stat.st_dev, stat.st_ino) not in inodes:
+                    inodes.add((stat.st_dev, stat.st_ino))
+                    unique_bytes += stat.st_size
+                directory_bytes[cls._get_top_directory(path, filepath)] += stat.st_size
+
+        push_bytes = int(total_bytes * cls.ESTIMATED_PUSH_COMPRESSION_RATIO)
+        _, _, free_space_bytes = shutil.disk_usage(cls._get_docker_root_dir())
+        return {
+            "file_count": file_count,
+            "total_bytes": total_bytes,
+            "unique_bytes": unique_bytes,
+            "largest_directories": [{"path": directory, "bytes": size_bytes}
+                for directory, size_bytes in directory_bytes.most_common(cls.LARGEST_DIRECTORIES_COUNT)],
+            "projected_image_bytes": total_bytes,
+            "required_space_bytes": cls._get_required_space_bytes(total_bytes),
+            "free_space_bytes": free_space_bytes,
+            "build_seconds": round(total_bytes / cls.ESTIMATED_COPY_BYTES_PER_SECOND
+                + file_count * cls.ESTIMATED_COPY_SECONDS_PER_FILE
+                + total_bytes / cls.ESTIMATED_COMMIT_BYTES_PER_SECOND, 1),
+            "push_seconds": round(push_bytes / cls.ESTIMATED_PUSH_BYTES_PER_SECOND, 1)
+        }
+
+    @classmethod
+    def _copy_files_onto_container(cls, interim_container, generate_files_to_copy, required_bytes, docker_root_dir,
+            governor=None, metrics=None):
+        """Copies the files in batches, stopping with an error status as soon as the space left on docker's
+        data-root cannot hold the rest of the containerization, rather than once the disk is full."""
+        total_to_copy = cls._get_total_size_of_files(generate_files_to_copy())
+        total_copied = 0
+        batch_limits = FileBatchLimits(cls.INITIAL_FILEBATCH_SIZE, cls.INITIAL_FILEBATCH_FILES)
+        for filepaths in cls._split_into_batches(generate_files_to_copy(), batch_limits):
+            # whatever was copied so far already takes up its share of the required space
+            out_of_space_msg = cls._get_message_if_space_insufficient(
+                max(required_bytes - total_copied, cls.SPACE_REQUIREMENT_FUDGE_BYTES), docker_root_dir,
+                cls.OUT_OF_SPACE_ERROR_FMT)
+            if out_of_space_msg:
+                yield ImageCreationStatus(progress=0, image=None, error_msg=out_of_space_msg, error_trace=None)
+                return
+            copy_seconds = cls._copy_onto_container_with_retries(interim_container, filepaths, governor, metrics)
+            BuildJournal.record_batch(filepaths)
+            # the next batch is only split off once this one is copied, so it already uses the scaled limits
+            cls._scale_batch_limits(batch_limits, copy_seconds)
+            batch_bytes = cls._get_total_size_of_files(filepaths)
+            total_copied += batch_bytes
+            if metrics:
+                metrics.add(ContainerizationMetrics.COPY_PHASE, bytes=batch_bytes, files=len(filepaths))
+            progress = int(100*float(total_copied)/total_to_copy)
+            yield ImageCreationStatus(progress=progress, image=None, error_msg=None, error_trace=None)
+
+    @classmethod
+    def _get_top_directory(cls, path, filepath):
+        relative_parts = Path(filepath).relative_to(path).parts
+        return os.path.join(path, relative_parts[0]) if len(relative_parts) > 1 else path
 
     @classmethod
     def _copy_notebook_execution_file_to_dest(cls):
@@ -109,10 +268,25 @@ class KernelImageCreator(object):
         os.makedirs(os.path.dirname(cls.NOTEBOOK_EXECUTION_FILEPATH), exist_ok=True)
         shutil.copy(src, cls.NOTEBOOK_EXECUTION_FILEPATH)
 
+    @classmethod
+    def _build_variable_index(cls, python_executable, notebook_path, variable_names):
+        # a stale index must not end up in the image, although the script would discard it anyway
+        if os.path.exists(cls.VARIABLE_INDEX_FILEPATH):
+            os.remove(cls.VARIABLE_INDEX_FILEPATH)
+        # the index is built with the kernel's own python, so that the offsets match how the script will parse the notebook
+        command = [python_executable, cls.NOTEBOOK_EXECUTION_FILEPATH, "--build-variable-index", notebook_path,
+            cls.VARIABLE_INDEX_FILEPATH, "--variables"] + list(variable_names)
+        try:
+            subprocess.check_output(BuildGovernor.get_helper_command_prefix() + command, stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as error:
+            # without the index the notebook's variables are still replaced, just more slowly
+            cls.logger.warning("Could not build the variable index: " + str(error.output))
+
     @classmethod
     def _get_folders_to_copy(cls, kernel, python_executable):
         command = [python_executable, "-c", "import sys; print(sys.path)"]
-        sys_paths = ast.literal_eval(str(subprocess.check_output(command), "utf-8"))
+        sys_paths = ast.literal_eval(str(subprocess.check_output(BuildGovernor.get_helper_command_prefix() + command),
+            "utf-8"))
         kernel_without_prefix = cls._remove_prefix(kernel, cls.CONDA_PREFIX)
 
         return sys_paths + [os.path.dirname(python_executable)] + [SAGEMAKER_FOLDER, AWS_SETTINGS_FOLDER] + [
@@ -130,38 +304,54 @@ class KernelImageCreator(object):
 
     @classmethod
     def _get_total_size_of_files(cls, filepaths):
+        """Returns the bytes the files take up once copied onto the container. The copy archives each batch
+        with tarfile, which writes sparse files at their full size and only stores a file linked from several
+        paths once if those paths are in the same batch, so the apparent size of every path is an upper bound."""
         total_bytes = 0
         for filepath in filepaths:
             total_bytes += os.path.getsize(filepath)
         return total_bytes
 
     @classmethod
-    def _get_message_if_space_insufficient(cls, paths_to_copy):
-        INSUFFIENT_SPACE_ERROR_FMT = "There is insufficient space remaining on this instance to " + \
-        "containerize this notebook. Containerization would require {} of additional space."
-
-        files_to_copy_bytes = cls._get_total_size_of_files(paths_to_copy)
-        _, _, free_space_bytes = shutil.disk_usage("/")
+    def _get_docker_root_dir(cls):
+        # docker's data-root, where the container and the image are written, is often on another volume than /
+        try:
+            docker_root_dir = cls.docker_client.info().get("DockerRootDir")
+        except Exception:
+            cls.logger.warning("Could not find docker's data-root.", exc_info=True)
+            docker_root_dir = None
+        # the daemon's data-root is not visible from here if it runs on another host, e.g. in a vm
+        if docker_root_dir and os.path.isdir(docker_root_dir):
+            return docker_root_dir
+        return cls.DEFAULT_DOCKER_ROOT_DIR
 
-        required_bytes = int(cls.REQUIRED_SPACE_PER_FILES_SPACE * files_to_copy_bytes
-            ) + cls.SPACE_REQUIREMENT_FUDGE_BYTES
+    @classmethod
+    def _get_message_if_space_insufficient(cls, required_bytes, docker_root_dir, error_fmt=INSUFFICIENT_SPACE_ERROR_FMT):
+        _, _, free_space_bytes = shutil.disk_usage(docker_root_dir)
 
         if required_bytes > free_space_bytes:
-            cls.logger.info("Insufficient space to containerize. Has {} bytes, requires {} bytes, " +
-                "with fudge space requires {} bytes.".format(
-                    free_space_bytes, files_to_copy_bytes, required_bytes))
+            cls.logger.info("Insufficient space to containerize in {}. Has {} bytes, requires {} bytes.".format(
+                docker_root_dir, free_space_bytes, required_bytes))
 
             additional_required_bytes = required_bytes - free_space_bytes
             human_readable_additional_space_required = size(required_bytes - free_space_bytes)
-            return INSUFFIENT_SPACE_ERROR_FMT.format("{} bytes ({})".format(
+            return error_fmt.format("{} bytes ({})".format(
                 additional_required_bytes, human_readable_additional_space_required))
-            
+
     @classmethod
-    def _create_interim_container(cls, original_container, kernel, notebook_path):
+    def _get_required_space_bytes(cls, files_to_copy_bytes):
+        return int(cls.REQUIRED_SPACE_PER_FILES_SPACE * files_to_copy_bytes) + cls.SPACE_REQUIREMENT_FUDGE_BYTES
+
+    @classmethod
+    def _create_interim_container(cls, original_container, kernel, notebook_path, dataset_variable_names=(),
+            labels=None):
         cls._delete_interim_container()
 
         environment = EnvironmentKernelSpecManager().get_kernel_spec(kernel).env
         environment[cls.NOTEBOOK_PATH_ENV_VAR] = notebook_path
+        if dataset_variable_names:
+            # iota_run_nb.py downloads the content of these variables' datasets before running the notebook
+            environment[cls.DATASET_VARIABLES_ENV_VAR] = ",".join(dataset_variable_names)
 
         interim_container_creation_result = cls.docker_client.api.create_container(
             name=cls.INTERIM_CONTAINER_NAME,
@@ -170,7 +360,8 @@ class KernelImageCreator(object):
             stdin_open=True,
             detach=True,
             host_config={"network_mode": "host"},
-            environment=environment
+            environment=environment,
+            labels=labels
         )
 
         if interim_container_creation_result["Warnings"]:
@@ -180,25 +371,34 @@ class KernelImageCreator(object):
 
     @classmethod
     def _delete_interim_container(cls):
-        if cls.INTERIM_CONTAINER_NAME in (container.name for container in cls.docker_client.containers.list(all=True)):
-            interim_container = cls.docker_client.containers.get(cls.INTERIM_CONTAINER_NAME)
+        # matched by name rather than label, as containers from before the labels would still block the name.
+        # the name filter is a regular expression over names that start with a slash.
+        for interim_container in cls.docker_client.containers.list(all=True,
+                filters={"name": "^/{}$".format(cls.INTERIM_CONTAINER_NAME)}):
             interim_container.stop()
             interim_container.remove()
 
     @classmethod
     def _generate_files_to_copy(cls, sys_paths, *exclude_exts):
         yield cls.NOTEBOOK_EXECUTION_FILEPATH
+        for path in cls._get_paths_to_copy(sys_paths):
+            for filepath in cls._generate_files_under(path, exclude_exts):
+                yield filepath
+
+    @classmethod
+    def _get_paths_to_copy(cls, sys_paths):
         candidate_paths = set(sys_paths)
-        paths_to_copy = set([path for path in candidate_paths - cls._get_child_paths(candidate_paths)
-            if os.path.exists(path)])
+        return sorted(path for path in candidate_paths - cls._get_child_paths(candidate_paths)
+            if os.path.exists(path))
 
-        for path in sorted(paths_to_copy):
-            for root, subdirs, files in os.walk(path, followlinks=True):
-                for f in sorted(files):
-                    _, ext = os.path.splitext(f)
-                    if not exclude_exts or ext not in exclude_exts:
-                        filepath = os.path.join(root, f)
-                        yield filepath
+    @classmethod
+    def _generate_files_under(cls, path, exclude_exts):
+        for root, subdirs, files in os.walk(path, followlinks=True):
+            for f in sorted(files):
+                _, ext = os.path.splitext(f)
+                if not exclude_exts or ext not in exclude_exts:
+                    filepath = os.path.join(root, f)
+                    yield filepath
 
     @classmethod
     def _get_child_paths(cls, paths):
@@ -210,13 +410,17 @@ class KernelImageCreator(object):
         return child_paths
 
     @classmethod
-    def _split_into_batches(cls, filepaths):
+    def _split_into_batches(cls, filepaths, batch_limits=None):
+        """Splits the files into batches within the limits, which are read again for each batch, so that
+        they can change while the batches are generated. A file larger than the limit is a batch on its own."""
+        batch_limits = batch_limits or FileBatchLimits(cls.MAX_FILEBATCH_SIZE, cls.MAX_FILEBATCH_FILES)
         total_size = 0
         filepath_batch = []
 
         for filepath in filepaths:
             file_size = os.path.getsize(filepath)
-            if file_size + total_size <= cls.MAX_FILEBATCH_SIZE:
+            if not filepath_batch or (file_size + total_size <= batch_limits.max_bytes
+                    and len(filepath_batch) < batch_limits.max_files):
                 filepath_batch.append(filepath)
                 total_size += file_size
             else:
@@ -227,22 +431,104 @@ class KernelImageCreator(object):
             yield filepath_batch
 
     @classmethod
-    def _copy_onto_container(cls, interim_container, filepaths):
+    def _scale_batch_limits(cls, batch_limits, copy_seconds):
+        scaling = cls.TARGET_FILEBATCH_SECONDS / copy_seconds if copy_seconds > 0 else cls.FILEBATCH_MAX_SCALING
+        scaling = min(max(scaling, 1 / cls.FILEBATCH_MAX_SCALING), cls.FILEBATCH_MAX_SCALING)
+        batch_limits.max_bytes = int(min(max(batch_limits.max_bytes * scaling, cls.MIN_FILEBATCH_SIZE),
+            cls.MAX_FILEBATCH_SIZE))
+        batch_limits.max_files = int(min(max(batch_limits.max_files * scaling, cls.MIN_FILEBATCH_FILES),
+            cls.MAX_FILEBATCH_FILES))
+
+    @classmethod
+    def _copy_onto_container_with_retries(cls, interim_container, filepaths, governor=None, metrics=None):
+        """Returns the seconds the attempt that succeeded spent copying, see _copy_onto_container."""
+        retries = int(os.environ.get(BUILD_COPY_RETRIES_ENV_VAR, cls.DEFAULT_COPY_RETRIES))
+        backoff_seconds = float(os.environ.get(BUILD_COPY_RETRY_BACKOFF_ENV_VAR, cls.DEFAULT_COPY_RETRY_BACKOFF_SECONDS))
+        for attempt in range(retries + 1):
+            try:
+                return cls._copy_onto_container(interim_container, filepaths, governor, metrics)
+            except Exception as exception:
+                if attempt == retries or not cls._is_transient_failure(exception):
+                    raise
+                delay_seconds = backoff_seconds * 2 ** attempt
+                cls.logger.warning("Copying a batch of {} files onto the container failed, retrying in {} seconds".format(
+                    len(filepaths), delay_seconds), exc_info=True)
+                if metrics:
+                    metrics.add(ContainerizationMetrics.COPY_PHASE, retries=1)
+                    metrics.add(ContainerizationMetrics.RETRY_WAIT_PHASE, seconds=delay_seconds)
+                time.sleep(delay_seconds)
+
+    @classmethod
+    def _is_transient_failure(cls, exception):
+        # the daemon's connection dropped, it timed out or it failed on its side, rather than rejected the request
+        if isinstance(exception, docker.errors.APIError):
+            return not exception.is_client_error()
+        return isinstance(exception, requests.exceptions.RequestException)
+
+    @classmethod
+    def _get_resumable_interim_container(cls, build):
+        """Returns the interim container of the journaled build, the versions of the files copied onto it and its
+        job id, if the build was created from the same inputs and its container is still there."""
+        journaled_build, copied_file_versions = BuildJournal.load()
+        if not journaled_build or {key: journaled_build.get(key) for key in build} != build or \
+                "container_id" not in journaled_build or "job_id" not in journaled_build:
+            return None, {}, None
+        try:
+            interim_container = cls.docker_client.containers.get(journaled_build["container_id"])
+        except docker.errors.NotFound:
+            return None, {}, None
+        return interim_container, copied_file_versions, journaled_build["job_id"]
+
+    @classmethod
+    def _generate_files_not_copied(cls, filepaths, copied_file_versions):
+        for filepath in filepaths:
+            if filepath not in copied_file_versions or \
+                    copied_file_versions[filepath] != BuildJournal.get_file_version(filepath):
+                yield filepath
+
+    @classmethod
+    def _copy_onto_container(cls, interim_container, filepaths, governor=None, metrics=None):
+        """Returns the seconds spent archiving the files and putting the archive onto the container, without the
+        time the governor held the copy back."""
+        throttle_seconds = 0
+        start = time.monotonic()
         tarstream = BytesIO()
         with tarfile.TarFile(fileobj=tarstream, mode="w") as tar:
             for filepath in filepaths:
                 tar.add(filepath)
+                if governor:
+                    throttle_seconds += cls._pace(governor, metrics, os.path.getsize(filepath))
         tarstream.seek(0)
-        interim_container.put_archive("/", tarstream)
+        archive_seconds = time.monotonic() - start - throttle_seconds
+        if metrics:
+            metrics.add(ContainerizationMetrics.ARCHIVE_PHASE, seconds=archive_seconds)
+        start = time.monotonic()
+        try:
+            interim_container.put_archive("/", tarstream)
+        finally:
+            put_seconds = time.monotonic() - start
+            if metrics:
+                metrics.add(ContainerizationMetrics.COPY_PHASE, seconds=put_seconds)
+        if governor:
+            cls._pace(governor, metrics)
+        return archive_seconds + put_seconds
+
+    @classmethod
+    def _pace(cls, governor, metrics, bytes_read=0):
+        throttle_seconds = governor.pace(bytes_read)
+        if metrics:
+            metrics.add(ContainerizationMetrics.THROTTLE_PHASE, seconds=throttle_seconds)
+        return throttle_seconds
 
     @classmethod
     def _delete_output_container_and_image(cls):
+        # output images are tagged with their job id and garbage collected by BuildArtifacts,
+        # this only removes the output image tagged latest by containerizations from before the labels
         try:
             output_image = cls.docker_client.images.get(cls.OUTPUT_IMAGE)
-            for container in cls.docker_client.containers.list(all=True):
-                if container.image == output_image:
-                    container.stop()
-                    container.remove()
+            for container in cls.docker_client.containers.list(all=True, filters={"ancestor": output_image.id}):
+                container.stop()
+                container.remove()
             cls.docker_client.images.remove(output_image.id, force=True)
         except docker.errors.ImageNotFound:
             pass
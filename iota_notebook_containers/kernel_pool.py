@@ -0,0 +1,78 @@
+"""
+Keeps idle, pre-warmed kernels running inside the kernel container
+Each idle kernel is a warm_kernel.py process listening on a unix socket in the pool folder.
+The pool folder lives in the jupyter runtime folder, which is mounted at the same path in the
+container, so the runner can connect to those sockets from the host.
+"""
+import glob
+import json
+import logging
+import os
+import shutil
+import socket
+
+from iota_notebook_containers.constants import JUPYTER_RUNTIME_FOLDER
+from iota_notebook_containers import warm_kernel
+
+logger = logging.getLogger(__name__)
+
+class KernelPool(object):
+    CLAIMED_EXT = ".claimed"
+    POOL_FOLDER = os.path.join(JUPYTER_RUNTIME_FOLDER, "iota_kernel_pool")
+    POOLABLE_KERNEL_MODULES = ("ipykernel", "ipykernel_launcher")
+    WARM_KERNEL_FILEPATH = os.path.abspath(warm_kernel.__file__)
+
+    def __init__(self, container, kernel_name, kernel_argv, size, preload_modules=()):
+        self._container = container
+        self._kernel_argv = kernel_argv
+        self._size = size
+        self._preload_modules = list(preload_modules)
+        self._folder = os.path.join(self.POOL_FOLDER, kernel_name)
+
+    @classmethod
+    def is_poolable(cls, kernel_argv):
+        # warm kernels can only stand in for kernels that are started as "python -m ipykernel ..."
+        return len(kernel_argv) > 3 and kernel_argv[1] == "-m" and kernel_argv[2] in cls.POOLABLE_KERNEL_MODULES
+
+    @classmethod
+    def clear(cls):
+        # sockets left over from a previous container run no longer have anyone listening on them
+        shutil.rmtree(cls.POOL_FOLDER, ignore_errors=True)
+
+    def claim(self, connection_file, environment, cwd):
+        for ready_path in sorted(self._get_paths(warm_kernel.READY_EXT)):
+            claimed_path = os.path.splitext(ready_path)[0] + self.CLAIMED_EXT
+            try:
+                # renaming is atomic, so only one runner can win each idle kernel
+                os.rename(ready_path, claimed_path)
+            except FileNotFoundError:
+                continue
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                connection.connect(claimed_path)
+            except OSError:
+                logger.info(f'Discarding stale pooled kernel socket {ready_path}')
+                connection.close()
+                continue
+            finally:
+                os.remove(claimed_path)
+            argv = [arg.format(connection_file=connection_file) for arg in self._kernel_argv[3:]]
+            claim = {"argv": argv, "env": environment, "cwd": cwd}
+            connection.sendall(json.dumps(claim).encode("utf-8") + b"\n")
+            logger.info(f'Claimed pooled kernel {ready_path}')
+            return connection
+        return None
+
+    def fill(self, environment):
+        os.makedirs(self._folder, exist_ok=True)
+        missing = self._size - len(self._get_paths(warm_kernel.READY_EXT, warm_kernel.PENDING_EXT))
+        api = self._container.client.api
+        for _ in range(missing):
+            command = [self._kernel_argv[0], self.WARM_KERNEL_FILEPATH, self._folder] + self._preload_modules
+            exec_id = api.exec_create(self._container.id, command, environment=environment)["Id"]
+            api.exec_start(exec_id, detach=True)
+        if missing > 0:
+            logger.info(f'Started {missing} pooled kernels in {self._folder}')
+
+    def _get_paths(self, *exts):
+        return [path for ext in exts for path in glob.glob(os.path.join(self._folder, "*" + ext))]
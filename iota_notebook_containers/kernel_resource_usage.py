@@ -0,0 +1,55 @@
+"""
+Reports the resource usage of kernels that run in their own container
+"""
+import docker
+import json
+
+from concurrent.futures import ThreadPoolExecutor
+from tornado.ioloop import IOLoop
+from tornado.web import RequestHandler
+
+from iota_notebook_containers.constants import KERNEL_NAME_LABEL, KERNEL_ID_LABEL
+
+class KernelResourceUsage(object):
+    # each stats call waits for docker to take two cpu samples, so we query the containers in parallel
+    MAX_WORKERS = 8
+
+    @classmethod
+    def get_kernel_resource_usage(cls):
+        docker_client = docker.from_env()
+        kernel_containers = docker_client.containers.list(filters={"label": KERNEL_ID_LABEL})
+        if not kernel_containers:
+            return []
+        with ThreadPoolExecutor(max_workers=min(cls.MAX_WORKERS, len(kernel_containers))) as executor:
+            return list(executor.map(cls._get_container_resource_usage, kernel_containers))
+
+    @classmethod
+    def _get_container_resource_usage(cls, kernel_container):
+        stats = kernel_container.stats(stream=False)
+        memory_stats = stats.get("memory_stats", {})
+        return {
+            "kernel_name": kernel_container.labels.get(KERNEL_NAME_LABEL),
+            "kernel_id": kernel_container.labels.get(KERNEL_ID_LABEL),
+            "cpu_percent": cls._get_cpu_percent(stats),
+            "memory_usage_bytes": memory_stats.get("usage"),
+            "memory_limit_bytes": memory_stats.get("limit")
+        }
+
+    @classmethod
+    def _get_cpu_percent(cls, stats):
+        cpu_stats = stats.get("cpu_stats", {})
+        precpu_stats = stats.get("precpu_stats", {})
+        cpu_delta = cpu_stats.get("cpu_usage", {}).get("total_usage", 0) - \
+            precpu_stats.get("cpu_usage", {}).get("total_usage", 0)
+        system_delta = cpu_stats.get("system_cpu_usage", 0) - precpu_stats.get("system_cpu_usage", 0)
+        if cpu_delta <= 0 or system_delta <= 0:
+            return 0.0
+        online_cpus = cpu_stats.get("online_cpus") or len(cpu_stats["cpu_usage"].get("percpu_usage") or [None])
+        return 100.0 * online_cpus * cpu_delta / system_delta
+
+
+class KernelResourceUsageHandler(RequestHandler):
+    async def get(self):
+        kernel_resource_usage = await IOLoop.current().run_in_executor(
+            None, KernelResourceUsage.get_kernel_resource_usage)
+        self.write(json.dumps(kernel_resource_usage))
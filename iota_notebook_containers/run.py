@@ -3,17 +3,243 @@ import logging
 import os
 import signal
 import sys
+import time
+from collections import deque
 from environment_kernels import EnvironmentKernelSpecManager
 
+from iota_notebook_containers.constants import CONTAINER_NAME, KERNEL_POOL_SIZE_ENV_VAR, \
+    KERNEL_POOL_PRELOAD_MODULES_ENV_VAR, KERNEL_CONTAINER_MODE_ENV_VAR, KERNEL_CPU_SHARES_ENV_VAR, \
+    KERNEL_MEMORY_LIMIT_ENV_VAR, KERNEL_CONTAINER_VOLUMES, KERNEL_NAME_LABEL, KERNEL_ID_LABEL, \
+    SHARED_CONTAINER_MODE, PER_KERNEL_CONTAINER_MODE
+from iota_notebook_containers.kernel_pool import KernelPool
+
 logger = logging.getLogger(__name__)
 
+class _KernelOutputLog(object):
+    """Forwards kernel output to the log line by line, keeping only a bounded tail of it in memory."""
+    MAX_LINE_BYTES = 4 * 1024
+    # the log is shared with everything else the extension does, so a single chatty kernel may only use part of it
+    MAX_LOGGED_BYTES = 1024 * 1024
+    TAIL_LINES = 100
+
+    def __init__(self):
+        self.tail = deque(maxlen=self.TAIL_LINES)
+        self._line = b''
+        self._truncated_bytes = 0
+        self._logged_bytes = 0
+
+    def write(self, chunk):
+        lines = chunk.split(b'\n')
+        for line in lines[:-1]:
+            self._append(line)
+            self._end_line()
+        self._append(lines[-1])
+
+    def close(self):
+        if self._line or self._truncated_bytes:
+            self._end_line()
+        if self._logged_bytes >= self.MAX_LOGGED_BYTES:
+            logger.info(f'Last {len(self.tail)} lines of kernel output:\n' + '\n'.join(self.tail))
+
+    def _append(self, data):
+        remaining_bytes = max(self.MAX_LINE_BYTES - len(self._line), 0)
+        self._line += data[:remaining_bytes]
+        self._truncated_bytes += max(len(data) - remaining_bytes, 0)
+
+    def _end_line(self):
+        line = self._line.decode('utf-8', errors='replace')
+        if self._truncated_bytes:
+            line += f' [truncated {self._truncated_bytes} bytes]'
+        self._line = b''
+        self._truncated_bytes = 0
+        self.tail.append(line)
+
+        if self._logged_bytes < self.MAX_LOGGED_BYTES:
+            logger.info('Kernel output: ' + line)
+            self._logged_bytes += len(line)
+            if self._logged_bytes >= self.MAX_LOGGED_BYTES:
+                logger.info(f'Kernel output exceeded {self.MAX_LOGGED_BYTES} bytes. ' +
+                    'Only its last lines will be logged when the kernel exits.')
+
+
+class _ExecKernelProcess(object):
+    """A kernel started on demand with an exec in the kernel container.
+    The exec runs as this process's user, so that the kernel can be signalled directly from the host."""
+    KERNEL_PID_TIMEOUT_SECONDS = 5
+    KERNEL_PID_POLL_SECONDS = 0.01
+
+    def __init__(self, container, kernel_command):
+        self._container = container
+        self._kernel_command = kernel_command
+        self._exec_id = None
+        self._kernel_pid = None
+        self._kernel_pidfd = None
+
+    def start(self):
+        api = self._container.client.api
+        self._exec_id = api.exec_create(self._container.id, self._kernel_command,
+            environment=dict(os.environ), workdir=os.getcwd(), user=f'{os.getuid()}:{os.getgid()}')['Id']
+        kernel_output = api.exec_start(self._exec_id, stream=True)
+        self._kernel_pid = self._wait_for_kernel_pid()
+        self._kernel_pidfd = self._open_pidfd()
+        logger.info(f'Started kernel with pid {self._kernel_pid}')
+        return kernel_output
+
+    def send_signal(self, signum):
+        start = time.time()
+        if not self._kernel_pid:
+            # the kernel may have been interrupted before its exec reported a pid
+            self._kernel_pid = self._read_kernel_pid()
+        if not self._kernel_pid or not self._is_running():
+            logger.info(f'Not sending signal {signum} as kernel started with {self._kernel_command} is not running.')
+            return
+        try:
+            if self._kernel_pidfd is not None:
+                signal.pidfd_send_signal(self._kernel_pidfd, signum)
+            else:
+                os.kill(self._kernel_pid, signum)
+        except PermissionError:
+            # the kernel runs as another user than this process, e.g. if docker remaps the users of its containers.
+            # the exec is still exact because we target the kernel's pid inside the container's namespace.
+            # the shell's kill builtin is used, since the image need not have a kill binary.
+            kill_kernel_command = ['sh', '-c', f'kill -s {int(signum)} {self._get_namespace_pid()}']
+            _, kill_kernel_output = self._container.exec_run(kill_kernel_command)
+            logger.info(f'Sent signal {signum} to kernel from within the container: ' + str(kill_kernel_output))
+        except ProcessLookupError:
+            logger.info(f'Not sending signal {signum} as kernel {self._kernel_pid} already exited.')
+            return
+        logger.info(f'Sent signal {signum} to kernel {self._kernel_pid} in {1000 * (time.time() - start):.1f} ms')
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+        if self._kernel_pidfd is not None:
+            os.close(self._kernel_pidfd)
+            self._kernel_pidfd = None
+
+    def _read_kernel_pid(self):
+        if self._exec_id is None:
+            return None
+        # docker execs the kernel command directly, so the exec's pid is the kernel's pid
+        return self._container.client.api.exec_inspect(self._exec_id)['Pid'] or None
+
+    def _wait_for_kernel_pid(self):
+        # docker answers exec_start before it starts the exec's process, whose pid is 0 until then
+        deadline = time.monotonic() + self.KERNEL_PID_TIMEOUT_SECONDS
+        kernel_pid = self._read_kernel_pid()
+        while not kernel_pid and time.monotonic() < deadline:
+            time.sleep(self.KERNEL_PID_POLL_SECONDS)
+            kernel_pid = self._read_kernel_pid()
+        return kernel_pid
+
+    def _open_pidfd(self):
+        # a pidfd keeps referring to the kernel after it exits, so signals through it cannot hit a reused pid
+        if not self._kernel_pid or not hasattr(os, 'pidfd_open'):
+            return None
+        try:
+            pidfd = os.pidfd_open(self._kernel_pid)
+        except OSError:
+            return None
+        # the kernel may have exited and its pid been reused before the pidfd was opened
+        if not self._container.client.api.exec_inspect(self._exec_id)['Running']:
+            os.close(pidfd)
+            return None
+        return pidfd
+
+    def _is_running(self):
+        # signalling through the pidfd fails once the kernel exited, so only a plain pid needs checking: it is only
+        # valid while the exec is running, after that it may have been reused by another process
+        return self._kernel_pidfd is not None or self._container.client.api.exec_inspect(self._exec_id)['Running']
+
+    def _get_namespace_pid(self):
+        # the last NSpid entry is the pid within the innermost pid namespace, i.e. the container's
+        with open(f'/proc/{self._kernel_pid}/status') as status_file:
+            for line in status_file:
+                if line.startswith('NSpid:'):
+                    return int(line.split()[-1])
+        return self._kernel_pid
+
+
+class _PooledKernelProcess(object):
+    """A pre-warmed kernel claimed from the kernel pool. See warm_kernel.py for the other end of the socket."""
+    OUTPUT_CHUNK_BYTES = 4096
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def start(self):
+        return iter(lambda: self._connection.recv(self.OUTPUT_CHUNK_BYTES), b'')
+
+    def send_signal(self, signum):
+        start = time.time()
+        try:
+            self._connection.sendall(f'{int(signum)}\n'.encode('utf-8'))
+        except OSError:
+            logger.info(f'Not sending signal {signum} as the pooled kernel is not running.')
+            return
+        logger.info(f'Sent signal {signum} to pooled kernel in {1000 * (time.time() - start):.1f} ms')
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+        # the pooled kernel also stops once it notices the socket is closed
+        self._connection.close()
+
+
+class _KernelContainerProcess(object):
+    """A kernel running in its own container, created from the kernel container's image with its own resource limits."""
+    CONTAINER_NAME_PREFIX = "containerized_kernel_"
+    STOP_TIMEOUT_SECONDS = 5
+
+    def __init__(self, docker_client, image, kernel_name, kernel_command, connection_file, cpu_shares=None, mem_limit=None):
+        self._docker_client = docker_client
+        self._image = image
+        self._kernel_name = kernel_name
+        self._kernel_command = kernel_command
+        self._kernel_id = os.path.splitext(os.path.basename(connection_file))[0]
+        self._cpu_shares = cpu_shares
+        self._mem_limit = mem_limit
+        self._kernel_container = None
+
+    def start(self):
+        self._kernel_container = self._docker_client.containers.run(self._image, self._kernel_command,
+            name=self.CONTAINER_NAME_PREFIX + self._kernel_id, detach=True, environment=dict(os.environ),
+            working_dir=os.getcwd(), volumes=KERNEL_CONTAINER_VOLUMES, network_mode='host',
+            # the kernel would otherwise be pid 1, which ignores signals it has no handler for
+            init=True, cpu_shares=self._cpu_shares, mem_limit=self._mem_limit,
+            labels={KERNEL_NAME_LABEL: self._kernel_name, KERNEL_ID_LABEL: self._kernel_id})
+        logger.info(f'Started kernel container {self._kernel_container.name} with cpu shares {self._cpu_shares} ' +
+            f'and memory limit {self._mem_limit}')
+        return self._kernel_container.logs(stream=True, follow=True)
+
+    def send_signal(self, signum):
+        start = time.time()
+        try:
+            self._kernel_container.kill(signal=int(signum))
+        except (AttributeError, docker.errors.APIError):
+            logger.info(f'Not sending signal {signum} as the kernel container is not running.')
+            return
+        logger.info(f'Sent signal {signum} to kernel container in {1000 * (time.time() - start):.1f} ms')
+
+    def terminate(self):
+        if not self._kernel_container:
+            return
+        try:
+            self._kernel_container.stop(timeout=self.STOP_TIMEOUT_SECONDS)
+            self._kernel_container.remove()
+        except docker.errors.NotFound:
+            pass
+
+
 class ContainerizedKernelRunner(object):
 
     def __init__(self, kernel_name, connection_file):
         self._kernel_name = kernel_name
-        kernel_argv = EnvironmentKernelSpecManager().get_kernel_spec(self._kernel_name).argv
-        self._kernel_command = ' '.join(kernel_argv).format(connection_file=connection_file)
-        self._container = docker.from_env().containers.get('containerized_kernels')
+        self._connection_file = connection_file
+        self._kernel_argv = EnvironmentKernelSpecManager().get_kernel_spec(self._kernel_name).argv
+        self._kernel_command = ' '.join(self._kernel_argv).format(connection_file=connection_file)
+        self._docker_client = docker.from_env()
+        self._container = self._docker_client.containers.get(CONTAINER_NAME)
+        self._container_mode = os.environ.get(KERNEL_CONTAINER_MODE_ENV_VAR, SHARED_CONTAINER_MODE)
+        self._kernel_process = None
 
     def _set_up_signal_handlers(self):
         for signum in (signal.SIGTERM, signal.SIGQUIT):
@@ -21,23 +247,58 @@ class ContainerizedKernelRunner(object):
         signal.signal(signal.SIGINT, lambda *_: self._send_kill_signal_to_kernel(signal.SIGINT))
 
     def _send_kill_signal_to_kernel(self, signum):
-        kill_kernel_command = f'''sh -c "kill -s {signum} $(ps --no-heading --width 1024 -eo pid,command | grep -P '(\d)+(\s)+{self._kernel_command}' | awk '{{print $1}}')"'''
-        _, kill_kernel_output = self._container.exec_run(kill_kernel_command)
-        logger.info(f'Tried sending signal {signum} to kernel started with {self._kernel_command}: ' + str(kill_kernel_output))
+        if self._kernel_process:
+            self._kernel_process.send_signal(signum)
+
+    def _start_container(self):
+        if self._container.status != 'running':
+            KernelPool.clear()
+        self._container.start()
+
+    def _get_kernel_pool(self):
+        pool_size = int(os.environ.get(KERNEL_POOL_SIZE_ENV_VAR, 0))
+        if pool_size <= 0 or not KernelPool.is_poolable(self._kernel_argv):
+            return None
+        preload_modules = [module for module in os.environ.get(KERNEL_POOL_PRELOAD_MODULES_ENV_VAR, '').split(',') if module]
+        return KernelPool(self._container, self._kernel_name, self._kernel_argv, pool_size, preload_modules)
+
+    def _create_kernel_container_process(self):
+        cpu_shares = os.environ.get(KERNEL_CPU_SHARES_ENV_VAR)
+        return _KernelContainerProcess(self._docker_client, self._container.image.id, self._kernel_name,
+            self._kernel_command, self._connection_file, cpu_shares=int(cpu_shares) if cpu_shares else None,
+            mem_limit=os.environ.get(KERNEL_MEMORY_LIMIT_ENV_VAR))
+
+    def _create_kernel_process(self, kernel_pool):
+        connection = kernel_pool.claim(self._connection_file, dict(os.environ), os.getcwd()) if kernel_pool else None
+        if connection:
+            return _PooledKernelProcess(connection)
+        return _ExecKernelProcess(self._container, self._kernel_command)
 
     def run(self):
         self._set_up_signal_handlers()
-        self._container.start()
         logger.info(f'Running kernel: {self._kernel_command} from {os.getcwd()}')
+        kernel_pool = None
+        if self._container_mode == PER_KERNEL_CONTAINER_MODE:
+            self._kernel_process = self._create_kernel_container_process()
+        else:
+            self._start_container()
+            kernel_pool = self._get_kernel_pool()
+            self._kernel_process = self._create_kernel_process(kernel_pool)
+        kernel_output_log = _KernelOutputLog()
         try:
-            _, kernel_output = self._container.exec_run(self._kernel_command, environment=dict(os.environ), workdir=os.getcwd())
-            logger.info(f'Kernel output: {str(kernel_output)}')
+            kernel_output = self._kernel_process.start()
+            if kernel_pool:
+                # refill only once this kernel is up, so that it does not compete with the refill for startup time
+                kernel_pool.fill(dict(os.environ))
+            for chunk in kernel_output:
+                kernel_output_log.write(chunk)
         finally:
-            self._send_kill_signal_to_kernel(signal.SIGTERM)
+            kernel_output_log.close()
+            self._kernel_process.terminate()
 
 if __name__ == '__main__':
     try:
         ContainerizedKernelRunner(kernel_name=sys.argv[1], connection_file=sys.argv[2]).run()
     except:
         logger.exception('Caught unhandled exception: ')
-        raise
\ No newline at end of file
+        raise
@@ -4,11 +4,14 @@ define([
   "base/js/utils",
 ], function(Jupyter, $, utils){
   var CREATE_REPO_ENDPOINT = "create_repo";
+  var CONTAINERIZATION_ESTIMATE_ENDPOINT = "upload_to_repo/estimate";
   var EXTENSION_VERSION_ENDPOINT = "extension_version/is_latest";
   var IS_CONTAINERIZATION_ONGOING_ENDPOINT = "upload_to_repo/is_ongoing";
   var LIST_REPOS_ENDPOINT = "list_repos";
   var UPLOAD_TO_REPO_ENDPOINT = "upload_to_repo";
 
+  var LIST_VARIABLES_COMM_TARGET = "iota_list_variables";
+
   var KERNEL_NAME_FIELD = "kernel_name";
   var NEXT_TOKEN_FIELD = "next_token";
   var NOTEBOOK_PATH_FIELD = "notebook_path";
@@ -24,6 +27,7 @@ define([
   var PROGRESS_DATA_FIELD = "data";
 
   var baseUrl = utils.get_body_data("baseUrl");
+  var listVariablesComm = null;
 
   function getToken(name){
     match = document.cookie.match(new RegExp(TOKEN_FIELD + "=" + TOKEN_REGEX));
@@ -50,6 +54,13 @@ define([
     return $.getJSON(requestUrl);
   };
 
+  function getContainerizationEstimate(){
+    var requestUrl = utils.url_path_join(baseUrl, CONTAINERIZATION_ESTIMATE_ENDPOINT);
+    payload = {};
+    payload[KERNEL_NAME_FIELD] = Jupyter.notebook.kernel["name"];
+    return $.getJSON(requestUrl, payload);
+  };
+
   function isContainerizationOngoing(){
     var requestUrl = utils.url_path_join(baseUrl, IS_CONTAINERIZATION_ONGOING_ENDPOINT);
     return $.getJSON(requestUrl);
@@ -79,22 +90,31 @@ define([
     onMessage(progressData["step"], progressData["progress"], progressData["error_msg"]);
   };
 
-  function listVariables(handleVariables) {
+  // the variables are listed once the comm opens, and the variables that changed are sent after each execution
+  function listVariables(handleVariables, handleChangedVariables) {
     var codeUrl = Jupyter.notebook.base_url + "nbextensions/iota_notebook_containers/list_variables.py";
     $.get(codeUrl).done(function(code) {
-      Jupyter.notebook.kernel.execute(code, { iopub: { output: function(_) {} } }, { silent: false });
-      Jupyter.notebook.kernel.execute('print(_list_kernel_vars())', { iopub: { output: function(msg) {
-        var variables = msg.content['text'];
-        if (!variables) {
-          variables = '[]'
+      // the code runs with its own globals, which keeps its names out of the user's namespace
+      var registerCode = "exec(compile(" + JSON.stringify(code) + ", 'list_variables.py', 'exec'), " +
+        "{'__name__': '" + LIST_VARIABLES_COMM_TARGET + "'})";
+      Jupyter.notebook.kernel.execute(registerCode, {}, { silent: true, store_history: false });
+      if (listVariablesComm) {
+        listVariablesComm.close();
+      }
+      listVariablesComm = Jupyter.notebook.kernel.comm_manager.new_comm(LIST_VARIABLES_COMM_TARGET, {});
+      listVariablesComm.on_msg(function(msg) {
+        var data = msg.content.data;
+        if (data.variables) {
+          handleVariables(data.variables);
+        } else if (handleChangedVariables) {
+          handleChangedVariables(data.added, data.removed);
         }
-        var jsonVars = JSON.parse(variables);
-        handleVariables(jsonVars);
-      } } }, { silent: false });
+      });
     })
   }
 
   return {createRepo: createRepo, getRepos: getRepos, uploadToRepo: uploadToRepo,
     listVariables: listVariables, isContainerizationOngoing: isContainerizationOngoing,
-    getExtensionIsLatestVersion: getExtensionIsLatestVersion}
+    getExtensionIsLatestVersion: getExtensionIsLatestVersion,
+    getContainerizationEstimate: getContainerizationEstimate}
 });
\ No newline at end of file
@@ -1,27 +1,81 @@
-import json
-import tornado
+"""
+Lists the notebook's variables for the containerization wizard over a comm.
+The wizard runs this file in the kernel with its own globals, so that none of its names end up in the
+user's namespace, and then opens a comm to the registered target. The kernel replies with all the variables
+at once and, while the comm stays open, sends the variables that changed after each execution.
+Values are only type checked where they are stored in the user's namespace, never evaluated by name.
+"""
+import numbers
 
 from IPython import get_ipython
-from IPython.core.magics.namespace import NamespaceMagics
-
-# we don't have to worry about this dict polluting the namespace because
-# dicts are not one of the returned types
-PYTHON_TYPE_TO_IOT_TYPE = {
-    "str": "string",
-    "NoneType": "string",
-    "int": "double",
-    "float": "double",
-    "long": "double"
-}
-
-def _list_kernel_vars():
-    _nms = NamespaceMagics()
-    _Jupyter = get_ipython()
-    _nms.shell = _Jupyter.kernel.shell
-
-    variables = [v for v in _nms.who_ls() if _get_var_type(v) in PYTHON_TYPE_TO_IOT_TYPE]
-    return json.dumps([{'varName': v, 'varType': PYTHON_TYPE_TO_IOT_TYPE[_get_var_type(v)]}
-    	for v in variables])
-
-def _get_var_type(var):
-	return type(eval(var)).__name__
\ No newline at end of file
+
+COMM_TARGET = "iota_list_variables"
+STRING_TYPE = "string"
+DOUBLE_TYPE = "double"
+
+def get_iot_type(value):
+    # numpy registers its scalar types with the numbers abstract base classes, e.g. numpy.int64 is a
+    # numbers.Integral, and numpy.float64 and numpy.str_ subclass float and str. pandas uses numpy's scalars.
+    if value is None or isinstance(value, str):
+        return STRING_TYPE
+    if isinstance(value, numbers.Real) and not isinstance(value, bool):
+        return DOUBLE_TYPE
+    return None
+
+def list_variables(shell):
+    # the same names as %who_ls, i.e. without private names and those the kernel defines itself
+    user_ns_hidden = shell.user_ns_hidden
+    not_hidden = object()
+    variables = []
+    for name, value in list(shell.user_ns.items()):
+        if name.startswith('_') or value is user_ns_hidden.get(name, not_hidden):
+            continue
+        iot_type = get_iot_type(value)
+        if iot_type:
+            variables.append({'varName': name, 'varType': iot_type})
+    return sorted(variables, key=lambda variable: variable['varName'])
+
+class VariableLister(object):
+    def __init__(self, shell):
+        self.shell = shell
+        self.comms = []
+        self.variables = []
+
+    def open(self, comm, open_msg):
+        self.comms.append(comm)
+        comm.on_close(lambda close_msg: self.comms.remove(comm))
+        self.variables = list_variables(self.shell)
+        comm.send({'variables': self.variables})
+
+    def post_execute(self):
+        if not self.comms:
+            return
+        variables = list_variables(self.shell)
+        if variables == self.variables:
+            return
+        previous_types = {variable['varName']: variable['varType'] for variable in self.variables}
+        names = set(variable['varName'] for variable in variables)
+        added = [variable for variable in variables if previous_types.get(variable['varName']) != variable['varType']]
+        removed = [name for name in previous_types if name not in names]
+        self.variables = variables
+        for comm in list(self.comms):
+            comm.send({'added': added, 'removed': removed})
+
+def _get_comm_manager(shell):
+    comm_manager = getattr(shell.kernel, 'comm_manager', None)
+    if comm_manager is None:
+        # ipykernel 6.18 and later keep the comm manager in the comm package
+        import comm
+        comm_manager = comm.get_comm_manager()
+    return comm_manager
+
+def register(shell):
+    comm_manager = _get_comm_manager(shell)
+    if COMM_TARGET in comm_manager.targets:
+        return
+    lister = VariableLister(shell)
+    comm_manager.register_target(COMM_TARGET, lister.open)
+    shell.events.register('post_execute', lister.post_execute)
+
+if __name__ == COMM_TARGET:
+    register(get_ipython())
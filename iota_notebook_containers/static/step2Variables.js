@@ -85,7 +85,7 @@ define([
   '</div>';
 
   function onModalOpen(){
-    api.listVariables(addDetectedVariableRowsOrShowMessage);
+    api.listVariables(addDetectedVariableRowsOrShowMessage, addChangedVariableRows);
     $("#" + ERROR_SECTION_ID).hide();
     $("#" + EXECUTE_NOTEBOOK_MSG_SECTION_ID).hide();
     createTable();
@@ -243,6 +243,19 @@ define([
     }
   };
 
+  // variables that the notebook defines while the wizard is open are added, but rows are never removed
+  // since they may have been edited
+  function addChangedVariableRows(addedVariables, removedVariableNames){
+    var names = getNames();
+    for(i=0, len=addedVariables.length; i<len; i++){
+      var variable = variableModule.buildFromDetectedVariable(addedVariables[i]);
+      if (names.indexOf(variable.name) === -1 && getTable().rows().count() < MAX_NUM_VARIABLES){
+        addDetectedVariableRow(variable.name, variable.type);
+        $("#" + EXECUTE_NOTEBOOK_MSG_SECTION_ID).fadeOut();
+      }
+    }
+  };
+
   function addDetectedVariableRow(variableName, variableType){
     var nameForm = '<input value="' + variableName +
       '" type="text" class="form-control ' +
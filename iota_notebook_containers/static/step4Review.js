@@ -1,5 +1,6 @@
 define([
-], function(){
+  "./api",
+], function(api){
   var ID = "step4";
   var TAB_TITLE = "4. Review";
 
@@ -7,12 +8,20 @@ define([
   var CONTAINER_DESCRIPTION_ID = "step4_container_description";
   var REPOSITORY_ID = "step4_destination_repo";
   var VARIABLE_TABLE_ID = "step4_variable_table";
+  var ESTIMATE_ID = "step4_estimate";
+  var LARGEST_DIRECTORIES_ID = "step4_largest_directories";
+
+  var ESTIMATING_MSG = "Estimating...";
+  var ESTIMATE_FAILED_MSG = "Could not estimate the size of the container.";
+  var BYTE_UNITS = ["B", "KB", "MB", "GB", "TB"];
 
   var DATATABLE_COLUMN_DEFS = [{className: "dt-center", "targets": "_all"}];
   var FORM_HTML = '<div style="overflow: auto;"> ' +
     '<div><strong> Container Name: </strong> <span id="' + CONTAINER_NAME_ID + '"> </span></div>' +
     '<div><strong> Container Description: </strong> <span id="' + CONTAINER_DESCRIPTION_ID + '"></span></div>' +
-    '<div><strong> Upload To: </strong> <span id="' + REPOSITORY_ID + '"></span></div> <br>' +
+    '<div><strong> Upload To: </strong> <span id="' + REPOSITORY_ID + '"></span></div>' +
+    '<div><strong> Estimate: </strong> <span id="' + ESTIMATE_ID + '"></span></div>' +
+    '<ul id="' + LARGEST_DIRECTORIES_ID + '"></ul> <br>' +
     '<div>' + 
       '<table + class="table table-striped table-bordered" style="width:100%;" id="' + VARIABLE_TABLE_ID + '">' +
         '<thead>' +
@@ -58,6 +67,8 @@ define([
     $("#" + CONTAINER_DESCRIPTION_ID).text(description);
     $("#" + REPOSITORY_ID).text(repository);
 
+    updateEstimate();
+
     var dt = getTable();
     dt.clear();
 
@@ -67,6 +78,49 @@ define([
     }
   };
 
+  // the estimate lets users prune their environment before they start a long containerization
+  function updateEstimate(){
+    $("#" + ESTIMATE_ID).text(ESTIMATING_MSG);
+    $("#" + LARGEST_DIRECTORIES_ID).empty();
+    api.getContainerizationEstimate().done(showEstimate).fail(function(){
+      $("#" + ESTIMATE_ID).text(ESTIMATE_FAILED_MSG);
+    });
+  };
+
+  function showEstimate(estimate){
+    var text = estimate.file_count + " files, " + formatBytes(estimate.total_bytes) + " (" +
+      formatBytes(estimate.unique_bytes) + " unique). The image grows by " +
+      formatBytes(estimate.projected_image_bytes) + ". Building takes about " +
+      formatSeconds(estimate.build_seconds) + " and uploading about " + formatSeconds(estimate.push_seconds) + ".";
+    if (estimate.required_space_bytes > estimate.free_space_bytes){
+      text += " This instance lacks " + formatBytes(estimate.required_space_bytes - estimate.free_space_bytes) +
+        " of free space to containerize this notebook.";
+    }
+    $("#" + ESTIMATE_ID).text(text);
+
+    var list = $("#" + LARGEST_DIRECTORIES_ID);
+    for(i=0, len=estimate.largest_directories.length; i < len; i++){
+      var directory = estimate.largest_directories[i];
+      list.append($("<li>").text(directory.path + ": " + formatBytes(directory.bytes)));
+    }
+  };
+
+  function formatBytes(bytes){
+    var unit = 0;
+    while (bytes >= 1024 && unit < BYTE_UNITS.length - 1){
+      bytes /= 1024;
+      unit++;
+    }
+    return bytes.toFixed(unit ? 1 : 0) + " " + BYTE_UNITS[unit];
+  };
+
+  function formatSeconds(seconds){
+    if (seconds < 60){
+      return Math.ceil(seconds) + " seconds";
+    }
+    return Math.ceil(seconds / 60) + " minutes";
+  };
+
   function getTable(){
     return $("#" + VARIABLE_TABLE_ID).DataTable();
   };
@@ -0,0 +1,75 @@
+"""
+Pre-warmed kernel process for the containerized kernel pool
+This script runs inside the kernel container with the kernel's own python executable, so it
+may only depend on the standard library and ipykernel.
+Steps:
+    1. Import ipykernel and any requested modules ahead of time
+    2. Listen on a unix socket in the pool folder until a runner claims this process
+    3. Adopt the claim's working directory, environment and kernel arguments
+    4. Write the kernel's output back over the socket and raise any signal number received over it
+"""
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import uuid
+
+READY_EXT = ".sock"
+PENDING_EXT = ".pending"
+
+# running this file as a script puts its folder first on the path, where it would shadow user modules
+if sys.path and os.path.abspath(sys.path[0]) == os.path.dirname(os.path.abspath(__file__)):
+    del sys.path[0]
+
+def _import_modules(module_names):
+    for module_name in module_names:
+        try:
+            __import__(module_name)
+        except Exception:
+            pass # the kernel will report the failure if the notebook imports the module itself
+
+def _listen(pool_folder):
+    name = str(uuid.uuid4())
+    pending_path = os.path.join(pool_folder, name + PENDING_EXT)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(pending_path)
+    # the runner connecting to this socket is not necessarily the container's user
+    os.chmod(pending_path, 0o666)
+    server.listen(1)
+    # only advertise the socket once a claim can be accepted
+    os.rename(pending_path, os.path.join(pool_folder, name + READY_EXT))
+    return server
+
+def _receive_claim(reader):
+    claim = reader.readline()
+    if not claim:
+        sys.exit(0)
+    return json.loads(claim.decode("utf-8"))
+
+def _forward_signals(reader):
+    for line in reader:
+        os.kill(os.getpid(), int(line))
+    # the runner is gone, so nobody is managing this kernel anymore
+    os.kill(os.getpid(), signal.SIGTERM)
+
+def main(pool_folder, module_names):
+    from ipykernel import kernelapp
+    _import_modules(module_names)
+
+    server = _listen(pool_folder)
+    connection, _ = server.accept()
+    server.close()
+    reader = connection.makefile("rb")
+    claim = _receive_claim(reader)
+
+    os.chdir(claim["cwd"])
+    os.environ.update(claim["env"])
+    os.dup2(connection.fileno(), sys.stdout.fileno())
+    os.dup2(connection.fileno(), sys.stderr.fileno())
+    threading.Thread(target=_forward_signals, args=(reader,), daemon=True).start()
+    kernelapp.launch_new_instance(argv=claim["argv"])
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2:])
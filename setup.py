@@ -17,7 +17,6 @@ setup(
     ],
     tests_require = [
         "moto",
-        "asttokens==1.1.10",
         "freezegun==0.3.10",
         "selenium==3.12.0",
     ],
@@ -0,0 +1,122 @@
+"""
+Measures the cost of iota_run_nb, the script that runs a notebook inside a containerized image.
+    1. import time: how long `import iota_run_nb` takes in a fresh interpreter
+    2. time to first cell: how long from starting the interpreter until the notebook's first cell runs
+    3. total time: how long running a notebook of many small cells takes
+    4. batch time: how long running the notebook with several sets of variables takes, one invocation per set
+       compared with a single batch invocation
+The last three are measured for each execution mode, i.e. in a kernel process and in process.
+
+Usage: python tst/iota_notebook_containers/benchmark_iota_run_nb.py [--repeat N] [--kernel-name NAME] [--cells N]
+    [--batch N]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import nbformat
+
+# the image copies iota_run_nb.py on its own, so it is imported as a top level module rather than
+# through the iota_notebook_containers package, whose __init__ loads the notebook server
+SCRIPT_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "iota_notebook_containers")
+
+IMPORT_TIME_SCRIPT = """
+import time
+start = time.perf_counter()
+import iota_run_nb
+print(time.perf_counter() - start)
+"""
+
+# runs the notebook the way the image's entrypoint does, but without writing the outputs to s3
+RUN_NOTEBOOK_SCRIPT = """
+import sys
+import iota_run_nb
+iota_run_nb.PARAMS_FILEPATH = sys.argv[1]
+iota_run_nb._write_output_to_s3 = lambda context, metrics=None: None
+iota_run_nb.run_notebook()
+"""
+
+def _run_python(script, *args, env=None):
+    return subprocess.check_output([sys.executable, "-c", script] + list(args),
+        cwd=SCRIPT_FOLDER, env=env, universal_newlines=True)
+
+def _measure_import_time():
+    return float(_run_python(IMPORT_TIME_SCRIPT))
+
+def _write_benchmark_inputs(folder, first_cell_time_filepath, cell_count, batch_size=None):
+    notebook_path = os.path.join(folder, "notebook.ipynb")
+    notebook = nbformat.v4.new_notebook(cells=[
+        nbformat.v4.new_code_cell("import time\nopen({!r}, 'w').write(repr(time.time()))".format(first_cell_time_filepath)),
+        nbformat.v4.new_code_cell("a = 1")] +
+        [nbformat.v4.new_code_cell("print(a + {})".format(position)) for position in range(cell_count)])
+    nbformat.write(notebook, notebook_path)
+    params_filepath = os.path.join(folder, "params")
+    output_uris = {"ipynb": "s3://bucket/output.ipynb", "html": "s3://bucket/output.html"}
+    with open(params_filepath, "w") as params_file:
+        if batch_size is None:
+            json.dump({"Variables": {"a": 2}, "Context": {"Analysis": notebook_path, "OutputUris": output_uris}},
+                params_file)
+        else:
+            json.dump({"Variables": [{"a": position} for position in range(batch_size)],
+                "Context": {"Analysis": notebook_path, "OutputUris": [output_uris] * batch_size}}, params_file)
+    return params_filepath
+
+def _get_environment(kernel_name, execution_mode):
+    env = dict(os.environ, IOTA_EXECUTION_MODE=execution_mode)
+    if kernel_name:
+        env["KERNEL_NAME"] = kernel_name
+    return env
+
+def _measure_run(kernel_name, execution_mode, cell_count):
+    """Returns the time to the first cell and the total time of running the benchmark notebook."""
+    env = _get_environment(kernel_name, execution_mode)
+    with tempfile.TemporaryDirectory() as folder:
+        first_cell_time_filepath = os.path.join(folder, "first_cell_time")
+        params_filepath = _write_benchmark_inputs(folder, first_cell_time_filepath, cell_count)
+        start = time.time()
+        _run_python(RUN_NOTEBOOK_SCRIPT, params_filepath, env=env)
+        total_time = time.time() - start
+        with open(first_cell_time_filepath) as first_cell_time_file:
+            return float(first_cell_time_file.read()) - start, total_time
+
+def _measure_batch(kernel_name, execution_mode, cell_count, batch_size):
+    """Returns the time of running the benchmark notebook batch_size times, first in separate invocations and
+    then as one batch."""
+    env = _get_environment(kernel_name, execution_mode)
+    with tempfile.TemporaryDirectory() as folder:
+        first_cell_time_filepath = os.path.join(folder, "first_cell_time")
+        params_filepath = _write_benchmark_inputs(folder, first_cell_time_filepath, cell_count)
+        start = time.time()
+        for _ in range(batch_size):
+            _run_python(RUN_NOTEBOOK_SCRIPT, params_filepath, env=env)
+        separate_time = time.time() - start
+        params_filepath = _write_benchmark_inputs(folder, first_cell_time_filepath, cell_count, batch_size)
+        start = time.time()
+        _run_python(RUN_NOTEBOOK_SCRIPT, params_filepath, env=env)
+        return separate_time, time.time() - start
+
+def _report(name, measurements):
+    print("{}: median {:.3f}s, min {:.3f}s, max {:.3f}s over {} runs".format(
+        name, statistics.median(measurements), min(measurements), max(measurements), len(measurements)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--kernel-name", default=None, help="defaults to the first installed kernel")
+    parser.add_argument("--cells", type=int, default=100, help="number of small cells of the benchmark notebook")
+    parser.add_argument("--batch", type=int, default=5, help="number of sets of variables of the benchmark batch")
+    args = parser.parse_args()
+    _report("import time", [_measure_import_time() for _ in range(args.repeat)])
+    for execution_mode in ("subprocess", "in_process"):
+        runs = [_measure_run(args.kernel_name, execution_mode, args.cells) for _ in range(args.repeat)]
+        _report("{} time to first cell".format(execution_mode), [run[0] for run in runs])
+        _report("{} total time".format(execution_mode), [run[1] for run in runs])
+        batches = [_measure_batch(args.kernel_name, execution_mode, args.cells, args.batch) for _ in range(args.repeat)]
+        _report("{} separate runs time".format(execution_mode), [batch[0] for batch in batches])
+        _report("{} batch time".format(execution_mode), [batch[1] for batch in batches])
@@ -0,0 +1,62 @@
+"""
+Measures how long interrupting a kernel in the shared kernel container takes, i.e. how long the runner takes to
+deliver the signal once Jupyter asks it to
+    1. ps | grep | awk exec: the runner used to look the kernel up by its command line with an exec in the container
+    2. kill exec: the runner signals the kernel's pid with an exec in the container, which it falls back to when it may
+       not signal the kernel from the host
+    3. direct: the runner signals the kernel it started itself, as the same user, from the host
+A sleeping process stands in for the kernel and is sent the null signal, which goes the same way as an interrupt
+but leaves the process running.
+
+Requires docker and a running containerized_kernels container, i.e. an instance with the extension installed.
+
+Usage: python tst/iota_notebook_containers/benchmark_run.py [--repeat N] [--processes N]
+"""
+import argparse
+import signal
+import statistics
+import time
+
+import docker
+
+from iota_notebook_containers.constants import CONTAINER_NAME
+from iota_notebook_containers.run import _ExecKernelProcess
+
+KERNEL_COMMAND = "sleep 3600"
+NULL_SIGNAL = 0
+# the command line the runner used to match the kernel with, before it kept track of the kernel's pid
+PS_GREP_AWK_KILL_COMMAND = '''sh -c "kill -s {} $(ps --no-heading --width 1024 -eo pid,command | grep -P '(\\d)+(\\s)+{}' | awk '{{print $1}}')"'''
+
+def _measure(send_signal, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        send_signal()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def _report(name, measurements):
+    print("{}: median {:.1f}ms, min {:.1f}ms, max {:.1f}ms over {} signals".format(name,
+        1000 * statistics.median(measurements), 1000 * min(measurements), 1000 * max(measurements), len(measurements)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--processes", type=int, default=1,
+        help="number of stand-in kernels running in the container, which the ps | grep | awk lookup scales with")
+    args = parser.parse_args()
+    container = docker.from_env().containers.get(CONTAINER_NAME)
+    kernel_processes = [_ExecKernelProcess(container, KERNEL_COMMAND) for _ in range(args.processes)]
+    for kernel_process in kernel_processes:
+        kernel_process.start()
+    try:
+        kernel_process = kernel_processes[0]
+        _report("ps | grep | awk exec", _measure(lambda: container.exec_run(
+            PS_GREP_AWK_KILL_COMMAND.format(NULL_SIGNAL, KERNEL_COMMAND)), args.repeat))
+        _report("kill exec", _measure(lambda: container.exec_run(
+            ["sh", "-c", "kill -s {} {}".format(NULL_SIGNAL, kernel_process._get_namespace_pid())]),
+            args.repeat))
+        _report("direct", _measure(lambda: kernel_process.send_signal(NULL_SIGNAL), args.repeat))
+    finally:
+        for kernel_process in kernel_processes:
+            kernel_process.send_signal(signal.SIGKILL)
@@ -0,0 +1,128 @@
+import os
+import unittest
+
+from unittest.mock import patch, MagicMock
+
+from iota_notebook_containers.build_artifacts import BuildArtifacts
+from iota_notebook_containers.constants import BUILD_ARTIFACT_LABEL, BUILD_JOB_ID_LABEL, BUILD_NOTEBOOK_LABEL, \
+    BUILD_IMAGES_PER_NOTEBOOK_ENV_VAR, BUILD_IMAGES_MAX_BYTES_ENV_VAR
+
+class TestBuildArtifacts(unittest.TestCase):
+    def setUp(self):
+        self.docker_client = MagicMock()
+        self.docker_client.containers.list.return_value = []
+        patcher = patch.dict(os.environ)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop(BUILD_IMAGES_PER_NOTEBOOK_ENV_VAR, None)
+        os.environ.pop(BUILD_IMAGES_MAX_BYTES_ENV_VAR, None)
+
+    def _create_image(self, job_id, notebook_path, created, size=1):
+        image = MagicMock(id="sha256:" + job_id, attrs={"Created": created, "Size": size})
+        image.labels = BuildArtifacts.get_labels(BuildArtifacts.OUTPUT_IMAGE, job_id, notebook_path, "python3")
+        return image
+
+    def _get_removed_images(self):
+        return [call.args[0] for call in self.docker_client.images.remove.call_args_list]
+
+    def test_GIVEN_build_WHEN_get_labels_THEN_artifact_job_and_notebook_labeled(self):
+        # WHEN
+        labels = BuildArtifacts.get_labels(BuildArtifacts.OUTPUT_IMAGE, "job", "folder/a.ipynb", "python3")
+
+        # THEN
+        self.assertEqual(BuildArtifacts.OUTPUT_IMAGE, labels[BUILD_ARTIFACT_LABEL])
+        self.assertEqual("job", labels[BUILD_JOB_ID_LABEL])
+        self.assertEqual("folder/a.ipynb", labels[BUILD_NOTEBOOK_LABEL])
+
+    def test_GIVEN_artifact_WHEN_list_images_THEN_filtered_by_label_on_server(self):
+        # WHEN
+        BuildArtifacts.list_images(self.docker_client, BuildArtifacts.OUTPUT_IMAGE)
+
+        # THEN
+        self.docker_client.images.list.assert_called_once_with(
+            filters={"label": "{}={}".format(BUILD_ARTIFACT_LABEL, BuildArtifacts.OUTPUT_IMAGE)})
+
+    def test_GIVEN_interim_containers_WHEN_collect_THEN_only_active_job_container_kept(self):
+        # GIVEN
+        active_container = MagicMock(labels={BUILD_JOB_ID_LABEL: "active"})
+        stale_container = MagicMock(labels={BUILD_JOB_ID_LABEL: "stale"})
+        self.docker_client.containers.list.return_value = [active_container, stale_container]
+        self.docker_client.images.list.return_value = []
+
+        # WHEN
+        BuildArtifacts.collect(self.docker_client, active_job_id="active")
+
+        # THEN
+        active_container.remove.assert_not_called()
+        stale_container.remove.assert_called_once_with(force=True)
+
+    def test_GIVEN_images_of_notebooks_WHEN_collect_THEN_newest_per_notebook_kept(self):
+        # GIVEN
+        os.environ[BUILD_IMAGES_PER_NOTEBOOK_ENV_VAR] = "2"
+        self.docker_client.images.list.return_value = [
+            self._create_image("a1", "a.ipynb", "2024-01-01T00:00:01Z"),
+            self._create_image("a3", "a.ipynb", "2024-01-01T00:00:03Z"),
+            self._create_image("b1", "b.ipynb", "2024-01-01T00:00:01Z"),
+            self._create_image("a2", "a.ipynb", "2024-01-01T00:00:02Z")]
+
+        # WHEN
+        BuildArtifacts.collect(self.docker_client)
+
+        # THEN
+        self.assertEqual(["sha256:a1"], self._get_removed_images())
+
+    def test_GIVEN_notebook_being_built_WHEN_collect_THEN_its_new_image_counted(self):
+        # GIVEN
+        self.docker_client.images.list.return_value = [
+            self._create_image("a1", "a.ipynb", "2024-01-01T00:00:01Z"),
+            self._create_image("b1", "b.ipynb", "2024-01-01T00:00:01Z")]
+
+        # WHEN
+        BuildArtifacts.collect(self.docker_client, active_job_id="a2", building_notebook_path="a.ipynb")
+
+        # THEN
+        self.assertEqual(["sha256:a1"], self._get_removed_images())
+
+    def test_GIVEN_images_over_max_bytes_WHEN_collect_THEN_oldest_removed_but_active_kept(self):
+        # GIVEN
+        os.environ[BUILD_IMAGES_MAX_BYTES_ENV_VAR] = "250"
+        self.docker_client.images.list.return_value = [
+            self._create_image("active", "a.ipynb", "2024-01-01T00:00:01Z", size=100),
+            self._create_image("b", "b.ipynb", "2024-01-01T00:00:02Z", size=100),
+            self._create_image("c", "c.ipynb", "2024-01-01T00:00:03Z", size=100)]
+
+        # WHEN
+        BuildArtifacts.collect(self.docker_client, active_job_id="active")
+
+        # THEN
+        self.assertEqual(["sha256:b"], self._get_removed_images())
+
+    def test_GIVEN_container_of_image_WHEN_collect_THEN_container_removed_before_image(self):
+        # GIVEN
+        container = MagicMock()
+        image = self._create_image("a1", "a.ipynb", "2024-01-01T00:00:01Z")
+        self.docker_client.images.list.return_value = [image,
+            self._create_image("a2", "a.ipynb", "2024-01-01T00:00:02Z")]
+        self.docker_client.containers.list.side_effect = lambda all, filters: \
+            [container] if filters == {"ancestor": image.id} else []
+
+        # WHEN
+        BuildArtifacts.collect(self.docker_client)
+
+        # THEN
+        container.remove.assert_called_once_with(force=True)
+        self.docker_client.images.remove.assert_called_once_with(image.id, force=True)
+
+    def test_GIVEN_failing_removal_WHEN_collect_THEN_other_images_still_removed(self):
+        # GIVEN
+        self.docker_client.images.remove.side_effect = [RuntimeError("conflict"), None]
+        self.docker_client.images.list.return_value = [
+            self._create_image("a1", "a.ipynb", "2024-01-01T00:00:01Z"),
+            self._create_image("a2", "a.ipynb", "2024-01-01T00:00:02Z"),
+            self._create_image("a3", "a.ipynb", "2024-01-01T00:00:03Z")]
+
+        # WHEN
+        BuildArtifacts.collect(self.docker_client)
+
+        # THEN
+        self.assertEqual(["sha256:a2", "sha256:a1"], self._get_removed_images())
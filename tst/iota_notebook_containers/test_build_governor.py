@@ -0,0 +1,130 @@
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import zmq
+
+from unittest.mock import patch
+
+from iota_notebook_containers.build_governor import BuildGovernor
+
+class TestBuildGovernor(unittest.TestCase):
+    def _pace(self, governor_kwargs, times, cpu_times, bytes_read=0):
+        """Creates a governor and paces it once, the work taking from the first to the second time."""
+        with patch("time.monotonic", side_effect=[times[0], times[1], times[1]]), \
+                patch("time.thread_time", side_effect=[cpu_times[0], cpu_times[1], cpu_times[1]]), \
+                patch("time.sleep") as sleep:
+            governor = BuildGovernor(kernel_latency_ms=0, **governor_kwargs)
+            governor.pace(bytes_read)
+        return governor, sleep
+
+    def test_GIVEN_read_cap_WHEN_pace_THEN_sleep_until_read_within_cap(self):
+        _, sleep = self._pace({"read_bytes_per_second": 100}, [0, 0.5], [0, 0], bytes_read=100)
+        sleep.assert_called_once_with(0.5)
+
+    def test_GIVEN_cpu_budget_WHEN_pace_THEN_sleep_until_cpu_within_budget(self):
+        _, sleep = self._pace({"cpu_budget": 0.5}, [0, 0.4], [0, 0.4])
+        sleep.assert_called_once_with(0.4)
+
+    def test_GIVEN_work_within_limits_WHEN_pace_THEN_no_sleep(self):
+        _, sleep = self._pace({"read_bytes_per_second": 100, "cpu_budget": 0.5}, [0, 1], [0, 0.1], bytes_read=10)
+        sleep.assert_not_called()
+
+    def test_GIVEN_reduced_work_share_WHEN_pace_THEN_sleep_for_rest_of_time(self):
+        # GIVEN
+        with patch("time.monotonic", side_effect=[0, 1, 1]), patch("time.sleep") as sleep:
+            governor = BuildGovernor(kernel_latency_ms=0)
+            governor.work_share = 0.25
+
+            # WHEN
+            governor.pace()
+
+        # THEN
+        sleep.assert_called_once_with(3)
+
+    def test_GIVEN_kernel_latency_WHEN_adjust_work_share_THEN_halved_while_slow_and_doubled_once_fast(self):
+        # GIVEN
+        governor = BuildGovernor(kernel_latency_ms=100)
+
+        # WHEN
+        work_shares = []
+        for latency_ms in [500, 500, 500, 500, 50, None]:
+            governor._adjust_work_share(latency_ms)
+            work_shares.append(governor.work_share)
+
+        # THEN
+        self.assertEqual([0.5, 0.25, 0.125, 0.125, 0.25, 0.5], work_shares)
+
+    def _write_connection_files(self, hb_ports):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        for name, hb_port in hb_ports.items():
+            with open(os.path.join(folder.name, name), "w") as f:
+                json.dump({"transport": "tcp", "ip": "127.0.0.1", "hb_port": hb_port}, f)
+        patcher = patch.object(BuildGovernor, "KERNEL_CONNECTION_FILES", os.path.join(folder.name, "kernel-*.json"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_GIVEN_kernels_WHEN_probe_kernel_latency_ms_THEN_kernels_that_stop_answering_count_as_slow(self):
+        # GIVEN
+        context = zmq.Context.instance()
+        heartbeat = context.socket(zmq.REP)
+        heartbeat.linger = 0
+        port = heartbeat.bind_to_random_port("tcp://127.0.0.1")
+        echo = threading.Thread(target=lambda: heartbeat.send(heartbeat.recv()))
+        echo.start()
+        self._write_connection_files({"kernel-answering.json": port, "kernel-stale.json": 1})
+        governor = BuildGovernor(kernel_latency_ms=200)
+
+        # WHEN
+        first_latency_ms = governor.probe_kernel_latency_ms()
+        echo.join()
+        heartbeat.close()
+        second_latency_ms = governor.probe_kernel_latency_ms()
+
+        # THEN
+        self.assertLess(first_latency_ms, 200)
+        self.assertEqual(200, second_latency_ms)
+
+    def test_GIVEN_answering_kernel_WHEN_probe_kernel_latency_ms_THEN_no_wait_for_stale_connection_files(self):
+        # GIVEN
+        context = zmq.Context.instance()
+        heartbeat = context.socket(zmq.REP)
+        heartbeat.linger = 0
+        self.addCleanup(heartbeat.close)
+        port = heartbeat.bind_to_random_port("tcp://127.0.0.1")
+        echo = threading.Thread(target=lambda: [heartbeat.send(heartbeat.recv()) for _ in range(2)])
+        echo.start()
+        self._write_connection_files({"kernel-answering.json": port, "kernel-stale.json": 1})
+        governor = BuildGovernor(kernel_latency_ms=500)
+
+        # WHEN
+        governor.probe_kernel_latency_ms()
+        start = time.monotonic()
+        latency_ms = governor.probe_kernel_latency_ms()
+        probe_seconds = time.monotonic() - start
+        echo.join()
+
+        # THEN
+        self.assertLess(latency_ms, 500)
+        self.assertLess(probe_seconds, 0.4)
+
+    def test_GIVEN_kernel_stopped_answering_WHEN_probe_kernel_latency_ms_THEN_no_longer_probed_after_max_missed(self):
+        # GIVEN
+        self._write_connection_files({"kernel-gone.json": 1})
+        governor = BuildGovernor(kernel_latency_ms=50)
+        governor._responsive_connection_files.update(glob.glob(BuildGovernor.KERNEL_CONNECTION_FILES))
+
+        # WHEN
+        latencies_ms = [governor.probe_kernel_latency_ms() for _ in range(BuildGovernor.MAX_MISSED_PROBES + 1)]
+
+        # THEN
+        self.assertEqual([50] * BuildGovernor.MAX_MISSED_PROBES + [None], latencies_ms)
+
+    def test_GIVEN_no_kernels_WHEN_probe_kernel_latency_ms_THEN_none(self):
+        with tempfile.TemporaryDirectory() as folder, \
+                patch.object(BuildGovernor, "KERNEL_CONNECTION_FILES", os.path.join(folder, "kernel-*.json")):
+            self.assertIsNone(BuildGovernor().probe_kernel_latency_ms())
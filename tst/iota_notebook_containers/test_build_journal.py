@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+
+from unittest.mock import patch
+
+from iota_notebook_containers.build_journal import BuildJournal
+
+class TestBuildJournal(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+        patcher = patch.object(BuildJournal, "FILEPATH", os.path.join(self.folder, "journal.jsonl"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _write_file(self, name, content):
+        filepath = os.path.join(self.folder, name)
+        with open(filepath, "w") as f:
+            f.write(content)
+        return filepath
+
+    def test_GIVEN_no_journal_WHEN_load_THEN_no_build(self):
+        self.assertEqual((None, {}), BuildJournal.load())
+        self.assertIsNone(BuildJournal.get_job_id())
+
+    def test_GIVEN_recorded_batches_WHEN_load_THEN_build_and_copied_file_versions(self):
+        # GIVEN
+        build = {"job_id": "job", "container_id": "container"}
+        filepaths = [self._write_file("file1", "a"), self._write_file("file2", "bb")]
+        BuildJournal.start(build)
+        BuildJournal.record_batch(filepaths[:1])
+        BuildJournal.record_batch(filepaths[1:])
+
+        # WHEN
+        observed_build, copied_file_versions = BuildJournal.load()
+
+        # THEN
+        self.assertEqual(build, observed_build)
+        self.assertEqual({filepath: BuildJournal.get_file_version(filepath) for filepath in filepaths},
+            copied_file_versions)
+        self.assertEqual("job", BuildJournal.get_job_id())
+
+    def test_GIVEN_last_batch_cut_short_WHEN_load_THEN_batch_ignored(self):
+        # GIVEN
+        filepath = self._write_file("file1", "a")
+        BuildJournal.start({"job_id": "job"})
+        BuildJournal.record_batch([filepath])
+        with open(BuildJournal.FILEPATH, "a") as journal:
+            journal.write('[["file2", 1')
+
+        # WHEN
+        _, copied_file_versions = BuildJournal.load()
+
+        # THEN
+        self.assertEqual([filepath], list(copied_file_versions))
+
+    def test_GIVEN_batch_cut_short_WHEN_record_batch_THEN_partial_line_dropped(self):
+        # GIVEN
+        filepaths = [self._write_file("file1", "a"), self._write_file("file2", "bb")]
+        BuildJournal.start({"job_id": "job"})
+        BuildJournal.record_batch(filepaths[:1])
+        with open(BuildJournal.FILEPATH, "a") as journal:
+            journal.write('[["file3", 1')
+
+        # WHEN
+        BuildJournal.record_batch(filepaths[1:])
+        _, copied_file_versions = BuildJournal.load()
+
+        # THEN
+        self.assertEqual(filepaths, list(copied_file_versions))
+        with open(BuildJournal.FILEPATH) as journal:
+            self.assertNotIn("file3", journal.read())
+
+    def test_GIVEN_unreadable_batch_WHEN_load_THEN_other_batches_loaded(self):
+        # GIVEN
+        filepaths = [self._write_file("file1", "a"), self._write_file("file2", "bb")]
+        BuildJournal.start({"job_id": "job"})
+        BuildJournal.record_batch(filepaths[:1])
+        with open(BuildJournal.FILEPATH, "a") as journal:
+            journal.write('[["file3", 1[["file4", 1, 2]]\n{"not": "a batch"}\n')
+        BuildJournal.record_batch(filepaths[1:])
+
+        # WHEN
+        build, copied_file_versions = BuildJournal.load()
+
+        # THEN
+        self.assertEqual({"job_id": "job"}, build)
+        self.assertEqual(filepaths, list(copied_file_versions))
+
+    def test_GIVEN_unreadable_build_WHEN_load_THEN_no_build_and_journal_cleared(self):
+        # GIVEN
+        with open(BuildJournal.FILEPATH, "w") as journal:
+            journal.write('{"job_id": "jo\n')
+
+        # WHEN
+        observed = BuildJournal.load()
+
+        # THEN
+        self.assertEqual((None, {}), observed)
+        self.assertFalse(os.path.exists(BuildJournal.FILEPATH))
+
+    def test_GIVEN_journal_WHEN_clear_THEN_no_build(self):
+        # GIVEN
+        BuildJournal.start({"job_id": "job"})
+
+        # WHEN
+        BuildJournal.clear()
+        BuildJournal.clear()
+
+        # THEN
+        self.assertEqual((None, {}), BuildJournal.load())
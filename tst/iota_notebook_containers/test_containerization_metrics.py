@@ -0,0 +1,63 @@
+import unittest
+
+from collections import Counter, OrderedDict
+from unittest.mock import patch
+
+from iota_notebook_containers.containerization_metrics import ContainerizationMetrics
+
+class TestContainerizationMetrics(unittest.TestCase):
+    def setUp(self):
+        for totals, empty in [("phase_totals", OrderedDict()), ("phase_runs", Counter()), ("outcome_totals", Counter())]:
+            patcher = patch.object(ContainerizationMetrics, totals, empty)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_GIVEN_phases_WHEN_as_dict_THEN_counters_accumulated_per_phase(self):
+        # GIVEN
+        metrics = ContainerizationMetrics()
+
+        # WHEN
+        with patch("time.monotonic", side_effect=[10, 12.5]):
+            with metrics.time_phase(ContainerizationMetrics.WALK_PHASE):
+                pass
+        metrics.add(ContainerizationMetrics.COPY_PHASE, seconds=1, bytes=100, files=2)
+        metrics.add(ContainerizationMetrics.COPY_PHASE, seconds=2, bytes=50, files=1)
+
+        # THEN
+        self.assertEqual({ContainerizationMetrics.WALK_PHASE: {"seconds": 2.5},
+            ContainerizationMetrics.COPY_PHASE: {"seconds": 3, "bytes": 150, "files": 3}}, metrics.as_dict())
+
+    def test_GIVEN_failing_phase_WHEN_time_phase_THEN_time_still_recorded(self):
+        # GIVEN
+        metrics = ContainerizationMetrics()
+
+        # WHEN
+        with patch("time.monotonic", side_effect=[0, 1]):
+            with self.assertRaises(RuntimeError):
+                with metrics.time_phase(ContainerizationMetrics.COMMIT_PHASE):
+                    raise RuntimeError("commit failed")
+
+        # THEN
+        self.assertEqual({ContainerizationMetrics.COMMIT_PHASE: {"seconds": 1}}, metrics.as_dict())
+
+    def test_GIVEN_finished_containerizations_WHEN_to_prometheus_text_THEN_totals_per_phase_and_outcome(self):
+        # GIVEN
+        for bytes_copied, outcome in [(100, ContainerizationMetrics.SUCCESS_OUTCOME),
+                (50, ContainerizationMetrics.FAILURE_OUTCOME)]:
+            metrics = ContainerizationMetrics()
+            metrics.add(ContainerizationMetrics.COPY_PHASE, seconds=1.5, bytes=bytes_copied)
+            metrics.finish(outcome)
+
+        # WHEN
+        text = ContainerizationMetrics.to_prometheus_text()
+
+        # THEN
+        lines = text.splitlines()
+        self.assertIn('iota_containerizations_total{outcome="success"} 1', lines)
+        self.assertIn('iota_containerizations_total{outcome="failure"} 1', lines)
+        self.assertIn('iota_containerization_phase_runs_total{phase="copy"} 2', lines)
+        self.assertIn('iota_containerization_phase_seconds_total{phase="copy"} 3.0', lines)
+        self.assertIn('iota_containerization_phase_bytes_total{phase="copy"} 150', lines)
+        self.assertIn("# TYPE iota_containerization_phase_files_total counter", lines)
+        self.assertFalse(any(line.startswith("iota_containerization_phase_files_total{") for line in lines))
+        self.assertTrue(text.endswith("\n"))
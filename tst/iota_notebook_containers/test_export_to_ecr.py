@@ -16,6 +16,7 @@ from freezegun import freeze_time
 from tornado.testing import AsyncHTTPTestCase
 from unittest.mock import patch, MagicMock
 
+from iota_notebook_containers.containerization_metrics import ContainerizationMetrics
 from iota_notebook_containers.containerization_status_log_entry import ContainerizationStatusLogEntry
 from iota_notebook_containers.kernel_image_creator import KernelImageCreator, ImageCreationStatus
 from iota_notebook_containers.export_to_ecr import CreateNewRepoHandler, ListRepoHandler, \
@@ -182,7 +183,7 @@ class TestCreateNewRepoHandler(AsyncHTTPTestCase):
             "var2": json.dumps({"type": "double", "description": "best var"})
         }
 
-        KernelImageCreator.create = lambda x, y: [ImageCreationStatus(progress=100, image=IMAGE, error_msg=None, error_trace=None)]
+        KernelImageCreator.create = lambda x, y, z, **kwargs: [ImageCreationStatus(progress=100, image=IMAGE, error_msg=None, error_trace=None)]
         notebook_modification_time = time.time()
 
         ecr_client = boto3.client("ecr")
@@ -253,7 +254,7 @@ class TestCreateNewRepoHandler(AsyncHTTPTestCase):
             self.assertEquals(100, log_entry.progress)
             self.assertEquals(None, log_entry.error_msg)
             self.assertEquals(None, log_entry.error_trace)
-            self.assertEquals("1.0.0", log_entry.version)
+            self.assertEquals("1.1.0", log_entry.version)
             self.assertEquals("irrelevant", log_entry.notebook_path)
 
         put_image_mock.assert_called_once_with(imageManifest=json.dumps({'annotations': expected_annotations}),
@@ -266,7 +267,7 @@ class TestCreateNewRepoHandler(AsyncHTTPTestCase):
         IMAGE = "image"
         OUTPUT = "output"
         ecr_client = boto3.client(ECR)
-        KernelImageCreator.create = lambda x, y: [ImageCreationStatus(progress=100, image=IMAGE, error_msg=None, error_trace=None)]
+        KernelImageCreator.create = lambda x, y, z, **kwargs: [ImageCreationStatus(progress=100, image=IMAGE, error_msg=None, error_trace=None)]
         mock_logger = MagicMock()
 
         # WHEN
@@ -337,6 +338,30 @@ class TestCreateNewRepoHandler(AsyncHTTPTestCase):
             ImageUploadStatus(progress=99, error_msg=error_msg, error_trace=None)]
         self.assertEquals(expected, output_statuses)
 
+    @tornado.testing.gen_test
+    @patch('iota_notebook_containers.export_to_ecr.UploadToRepoHandler.add_annotations_to_manifest')
+    @patch("docker.from_env", MagicMock())
+    def test_GIVEN_layers_pushed_WHEN_upload_image_to_repo_THEN_push_and_annotate_phases_measured(self, add_annotations_to_manifest):
+        # GIVEN
+        repository_uri = self.ecr_client.create_repository(
+            repositoryName=self.REPO_NAME)["repository"]["repositoryUri"]
+        status_dicts = [{"status": "Pushing", "id": "layer1", "progressDetail": {"total": 100, "current": 40}},
+            {"status": "Pushing", "id": "layer1", "progressDetail": {"total": 100, "current": 100}},
+            {"status": "Pushing", "id": "layer2", "progressDetail": {"total": 50, "current": 50}},
+            {"status": "Pushed", "id": "layer2", "progressDetail": {}}]
+        docker_client = docker.from_env()
+        docker_client.api.push.return_value = [str.encode(json.dumps(status_dict)) for status_dict in status_dicts]
+        metrics = ContainerizationMetrics()
+
+        # WHEN
+        list(UploadToRepoHandler.upload_image_to_repo(self.REPO_NAME, repository_uri, "", "", metrics))
+
+        # THEN
+        phases = metrics.as_dict()
+        self.assertEqual(150, phases[ContainerizationMetrics.PUSH_PHASE]["bytes"])
+        self.assertIn("seconds", phases[ContainerizationMetrics.PUSH_PHASE])
+        self.assertIn("seconds", phases[ContainerizationMetrics.ANNOTATE_PHASE])
+
     @tornado.testing.gen_test
     def test_GIVEN_diff_from_previous_progress_WHEN_status_should_be_reported_THEN_true(self):
         # GIVEN
@@ -0,0 +1,207 @@
+import docker
+import json
+import os
+import tempfile
+import unittest
+
+from unittest.mock import patch, MagicMock
+
+from iota_notebook_containers.install_kernels import KernelContainerCreator, ContainerizedKernelInstaller
+
+class TestKernelContainerCreator(unittest.TestCase):
+    def setUp(self):
+        self.docker_client = MagicMock()
+        with patch("docker.from_env", return_value=self.docker_client):
+            with patch.dict("os.environ", {"IOTA_KERNEL_BASE_IMAGE": "amazonlinux@sha256:abc"}):
+                self.creator = KernelContainerCreator("containerized_kernels")
+
+    def _create_unpinned_creator(self):
+        with patch("docker.from_env", return_value=self.docker_client):
+            return KernelContainerCreator("containerized_kernels")
+
+    def test_GIVEN_base_image_WHEN_get_image_tag_THEN_tag_depends_on_base_image(self):
+        other_creator = self._create_unpinned_creator()
+        self.assertIn("FROM amazonlinux@sha256:abc", self.creator._dockerfile)
+        self.assertTrue(self.creator._get_image_tag("amazonlinux@sha256:abc").startswith("containerized_kernels:"))
+        self.assertNotEqual(self.creator._get_image_tag("amazonlinux@sha256:abc"),
+            other_creator._get_image_tag("amazonlinux@sha256:abc"))
+        self.assertNotEqual(other_creator._get_image_tag("sha256:old"), other_creator._get_image_tag("sha256:new"))
+
+    def test_GIVEN_pinned_base_image_WHEN_resolve_base_image_id_THEN_not_pulled(self):
+        self.assertEqual("amazonlinux@sha256:abc", self.creator._resolve_base_image_id())
+        self.docker_client.images.pull.assert_not_called()
+
+    def test_GIVEN_base_image_present_locally_WHEN_resolve_base_image_id_THEN_not_pulled(self):
+        # GIVEN
+        creator = self._create_unpinned_creator()
+        self.docker_client.images.get.return_value = MagicMock(id="sha256:local")
+
+        # WHEN
+        base_image_id = creator._resolve_base_image_id()
+
+        # THEN
+        self.assertEqual("sha256:local", base_image_id)
+        self.docker_client.images.get.assert_called_once_with("amazonlinux:2023")
+        self.docker_client.images.pull.assert_not_called()
+
+    def test_GIVEN_base_image_missing_locally_WHEN_create_THEN_pull_and_build_from_pulled_image(self):
+        # GIVEN
+        creator = self._create_unpinned_creator()
+        self.docker_client.images.pull.return_value = MagicMock(id="sha256:new")
+        stale_tag = creator._get_image_tag("sha256:old")
+        self.docker_client.images.get.side_effect = lambda tag: MagicMock() if tag == stale_tag \
+            else self._raise(docker.errors.ImageNotFound("missing"))
+
+        # WHEN
+        creator._create()
+
+        # THEN
+        self.docker_client.images.pull.assert_called_once_with("amazonlinux", tag="2023")
+        self.docker_client.images.build.assert_called_once()
+        self.assertEqual(creator._get_image_tag("sha256:new"), self.docker_client.images.build.call_args[1]["tag"])
+        self.assertEqual({"iota_notebook_containers.kernel_dockerfile": creator._get_dockerfile_hash()},
+            self.docker_client.images.build.call_args[1]["labels"])
+
+    def test_GIVEN_base_image_unresolvable_WHEN_create_THEN_reuse_cached_image_built_from_dockerfile(self):
+        # GIVEN
+        creator = self._create_unpinned_creator()
+        cached_tag = creator._get_image_tag("sha256:cached")
+        self.docker_client.images.pull.side_effect = docker.errors.APIError("no network")
+        self.docker_client.images.get.side_effect = lambda tag: MagicMock() if tag == cached_tag \
+            else self._raise(docker.errors.ImageNotFound("missing"))
+        # the cached image is only listed once the cache is loaded
+        self.docker_client.images.list.side_effect = [[], [MagicMock(tags=[cached_tag])]]
+
+        with tempfile.NamedTemporaryFile() as cached_image:
+            creator._image_cache_path = cached_image.name
+
+            # WHEN
+            creator._create()
+
+        # THEN
+        self.docker_client.images.load.assert_called_once()
+        self.docker_client.images.build.assert_not_called()
+        self.assertEqual(cached_tag, self.docker_client.containers.create.call_args[0][0])
+
+    def _raise(self, exception):
+        raise exception
+
+    def test_GIVEN_existing_image_WHEN_create_THEN_skip_build(self):
+        # WHEN
+        self.creator._create()
+
+        # THEN
+        self.docker_client.images.build.assert_not_called()
+        self.docker_client.containers.create.assert_called_once()
+        self.assertEqual(self.creator._get_image_tag("amazonlinux@sha256:abc"),
+            self.docker_client.containers.create.call_args[0][0])
+
+    def test_GIVEN_no_image_WHEN_create_THEN_build_and_save_to_cache(self):
+        # GIVEN
+        self.docker_client.images.get.side_effect = docker.errors.ImageNotFound("missing")
+        self.docker_client.api.get_image.return_value = [b"image", b"data"]
+
+        with tempfile.TemporaryDirectory() as cache_folder:
+            self.creator._image_cache_path = os.path.join(cache_folder, "kernel_image.tar")
+
+            # WHEN
+            self.creator._create()
+
+            # THEN
+            self.docker_client.images.build.assert_called_once()
+            self.assertEqual(self.creator._get_image_tag("amazonlinux@sha256:abc"),
+                self.docker_client.images.build.call_args[1]["tag"])
+            with open(self.creator._image_cache_path, "rb") as f:
+                self.assertEqual(b"imagedata", f.read())
+
+    def test_GIVEN_cached_image_WHEN_create_THEN_load_instead_of_build(self):
+        # GIVEN
+        self.docker_client.images.get.side_effect = [docker.errors.ImageNotFound("missing"), MagicMock()]
+
+        with tempfile.NamedTemporaryFile() as cached_image:
+            self.creator._image_cache_path = cached_image.name
+
+            # WHEN
+            self.creator._create()
+
+        # THEN
+        self.docker_client.images.load.assert_called_once()
+        self.docker_client.images.build.assert_not_called()
+
+class TestContainerizedKernelInstaller(unittest.TestCase):
+    def setUp(self):
+        self.kernels_folder = tempfile.TemporaryDirectory()
+        self.kernel_spec_manager = MagicMock()
+        self.kernel_spec_manager.find_kernel_specs.return_value = {"conda_python3": "", "conda_mxnet_p36": "",
+            "conda_anaconda3": "", "python3": ""}
+        self.kernel_spec_manager.get_kernel_spec.side_effect = lambda name: MagicMock(env={"PATH": "/bin"},
+            argv=["/envs/{}/bin/python".format(name), "-m", "ipykernel_launcher"])
+        self.python_versions = {}
+        check_output = patch("iota_notebook_containers.install_kernels.subprocess.check_output",
+            side_effect=lambda args, **kwargs: self.python_versions.get(args[0], b"3\n"))
+        check_output.start()
+        self.addCleanup(check_output.stop)
+        with patch("iota_notebook_containers.install_kernels.EnvironmentKernelSpecManager", return_value=self.kernel_spec_manager):
+            self.installer = ContainerizedKernelInstaller()
+        self.installer.KERNELS_FOLDER = self.kernels_folder.name
+
+    def tearDown(self):
+        self.kernels_folder.cleanup()
+
+    def _write_installed_kernel_json(self, installed_name, kernel_json):
+        os.makedirs(os.path.join(self.kernels_folder.name, installed_name))
+        with open(os.path.join(self.kernels_folder.name, installed_name, "kernel.json"), "w") as f:
+            json.dump(kernel_json, f)
+
+    def test_GIVEN_conda_kernels_WHEN_install_THEN_install_only_user_envs(self):
+        # WHEN
+        report = self.installer.install()
+
+        # THEN
+        installed = [c[0][1] for c in self.kernel_spec_manager.install_kernel_spec.call_args_list]
+        self.assertCountEqual(["Containerized_conda_python3", "Containerized_conda_mxnet_p36"], installed)
+        self.assertCountEqual(installed, report[ContainerizedKernelInstaller.INSTALLED])
+
+    def test_GIVEN_python2_kernel_WHEN_install_THEN_kernel_not_containerized(self):
+        # GIVEN
+        self.python_versions["/envs/conda_mxnet_p36/bin/python"] = b"2\n"
+
+        # WHEN
+        report = self.installer.install()
+
+        # THEN
+        installed = [c[0][1] for c in self.kernel_spec_manager.install_kernel_spec.call_args_list]
+        self.assertEqual(["Containerized_conda_python3"], installed)
+        self.assertEqual(["Containerized_conda_python3"], report[ContainerizedKernelInstaller.INSTALLED])
+
+    def test_GIVEN_installed_kernels_WHEN_install_THEN_only_write_changed_kernels(self):
+        # GIVEN
+        self._write_installed_kernel_json("containerized_conda_python3",
+            self.installer._get_kernel_json("conda_python3", "Containerized conda_python3"))
+        self._write_installed_kernel_json("containerized_conda_mxnet_p36",
+            self.installer._get_kernel_json("conda_mxnet_p36", "Containerized old_name"))
+
+        # WHEN
+        report = self.installer.install()
+
+        # THEN
+        installed = [c[0][1] for c in self.kernel_spec_manager.install_kernel_spec.call_args_list]
+        self.assertEqual(["Containerized_conda_mxnet_p36"], installed)
+        self.assertEqual(["Containerized_conda_python3"], report[ContainerizedKernelInstaller.UNCHANGED])
+        self.assertEqual(["Containerized_conda_mxnet_p36"], report[ContainerizedKernelInstaller.UPDATED])
+
+    def test_GIVEN_kernel_without_env_WHEN_install_THEN_remove_only_our_kernels(self):
+        # GIVEN
+        self._write_installed_kernel_json("containerized_conda_deleted_env",
+            self.installer._get_kernel_json("conda_deleted_env", "Containerized conda_deleted_env"))
+        self._write_installed_kernel_json("containerized_other", {"argv": ["python", "-m", "other"]})
+
+        # WHEN
+        report = self.installer.install()
+
+        # THEN
+        self.assertEqual(["containerized_conda_deleted_env"], report[ContainerizedKernelInstaller.REMOVED])
+        self.assertEqual(["containerized_other"], os.listdir(self.kernels_folder.name))
+
+if __name__ == '__main__':
+    unittest.main()
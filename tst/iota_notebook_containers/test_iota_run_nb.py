@@ -1,6 +1,15 @@
+import base64
+import boto3
+import gzip
 import json
+import moto
+import nbformat
 import os
+import tempfile
+import threading
+import time
 import unittest
+from botocore.exceptions import ClientError
 from mock import patch, mock_open, MagicMock
 
 class TestNotebookRunner(unittest.TestCase):
@@ -20,6 +29,103 @@ class TestNotebookRunner(unittest.TestCase):
                     actual = json.dumps(test_context.nb, sort_keys=True)
                     self.assertEqual(expected, actual)
 
+    @patch("docker.from_env", MagicMock())
+    @patch("boto3.resource", MagicMock())
+    def test_GIVEN_variable_index_WHEN_replace_variables_in_notebook_THEN_same_output_without_parsing(self):
+        # GIVEN
+        expected = self._get_expected_output()
+        from iota_notebook_containers import iota_run_nb
+        test_context = self._get_context_for_test()
+        variable_index = iota_run_nb.build_variable_index(test_context.nb, test_context.variables.keys())
+        test_context.variable_index = json.loads(json.dumps(variable_index))
+
+        # WHEN
+        with patch("iota_notebook_containers.iota_run_nb._sorted_assignments") as sorted_assignments:
+            iota_run_nb._replace_variables_in_notebook(test_context)
+
+        # THEN
+        sorted_assignments.assert_not_called()
+        self.assertEqual(expected, json.dumps(test_context.nb, sort_keys=True))
+
+    @patch("docker.from_env", MagicMock())
+    @patch("boto3.resource", MagicMock())
+    def test_GIVEN_outdated_variable_index_WHEN_replace_variables_in_notebook_THEN_parse_changed_cells(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        test_context = self._get_context_for_test()
+        variable_index = iota_run_nb.build_variable_index(test_context.nb, test_context.variables.keys())
+        test_context.variable_index = variable_index
+        test_context.nb.cells[1].source = "b = 'changed'\na = 1"
+
+        # WHEN
+        iota_run_nb._replace_variables_in_notebook(test_context)
+
+        # THEN
+        self.assertEqual("b = 'hi'\na = 6", test_context.nb.cells[1].source)
+
+    @patch("docker.from_env", MagicMock())
+    @patch("boto3.resource", MagicMock())
+    def test_GIVEN_variable_not_in_index_WHEN_replace_variables_in_notebook_THEN_parse_all_cells(self):
+        # GIVEN
+        expected = self._get_expected_output()
+        from iota_notebook_containers import iota_run_nb
+        test_context = self._get_context_for_test()
+        test_context.variable_index = iota_run_nb.build_variable_index(test_context.nb, ["a"])
+
+        # WHEN
+        iota_run_nb._replace_variables_in_notebook(test_context)
+
+        # THEN
+        self.assertEqual(expected, json.dumps(test_context.nb, sort_keys=True))
+
+    @patch("docker.from_env", MagicMock())
+    def test_GIVEN_no_kernel_name_WHEN_context_created_THEN_s3_and_kernel_specs_only_used_on_access(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        with patch("boto3.resource") as resource, \
+                patch("iota_notebook_containers.iota_run_nb._get_default_kernel_name", return_value="python3") as get_default, \
+                patch.dict(os.environ, {"KERNEL_NAME": ""}):
+            # WHEN
+            test_context = self._get_context_for_test()
+
+            # THEN
+            resource.assert_not_called()
+            get_default.assert_not_called()
+            self.assertEqual("python3", test_context.kernel_name)
+            self.assertEqual(test_context.s3, test_context.s3)
+            resource.assert_called_once_with("s3")
+            get_default.assert_called_once_with()
+
+    def test_GIVEN_multiline_and_unicode_assignments_WHEN_replace_variables_THEN_only_values_replaced(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        source = ("é = 'ü'; a = {'x': 1,\n"
+                  "     'y': [2, 3]}  # a; comment\n"
+                  "def f():\n"
+                  "    b = \\\n"
+                  "        f(1) if x else 2\n"
+                  "c = 'a=b' 'c'\n")
+        variables = {"é": 1, "a": 2, "b": 3, "c": 4}
+
+        # WHEN
+        actual = iota_run_nb._replace_variables(source, variables)
+
+        # THEN
+        self.assertEqual("é = 1; a = 2  # a; comment\ndef f():\n    b = \\\n        3\nc = 4\n", actual)
+        self.assertEqual({}, variables)
+
+    def _get_expected_output(self):
+        expected_output_file_path = os.path.join(os.path.dirname(__file__), 'resources', 'output.ipynb')
+        with open(expected_output_file_path) as f:
+            return json.dumps(json.load(f), sort_keys=True)
+
+    def _get_context_for_test(self):
+        params = self._get_params_for_test()
+        with patch("builtins.open", mock_open(read_data='')):
+            with patch("json.load", MagicMock(return_value=params)):
+                from iota_notebook_containers import iota_run_nb
+                return iota_run_nb.Context()
+
     def _get_params_for_test(self):
         params_file_path = os.path.join(os.path.dirname(__file__), 'resources', 'params')
         notebook_file_path = os.path.join(os.path.dirname(__file__), 'resources', 'notebook.ipynb')
@@ -28,5 +134,665 @@ class TestNotebookRunner(unittest.TestCase):
             params['Context']['Analysis'] = notebook_file_path
         return params
 
+# newer botocore releases send checksums as trailers that the s3 mock does not decode
+@patch.dict(os.environ, {"AWS_REQUEST_CHECKSUM_CALCULATION": "when_required"})
+class TestWriteOutputToS3(unittest.TestCase):
+    BUCKET = "my-bucket"
+
+    @moto.mock_s3
+    def test_GIVEN_large_notebook_WHEN_write_output_to_s3_THEN_outputs_uploaded_in_parts(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=self.BUCKET)
+        context = self._get_context(s3, "x" * 12 * 1024 * 1024)
+
+        # WHEN
+        with patch("iota_notebook_containers.iota_run_nb._render_html", return_value="<html></html>"), \
+                patch.dict(os.environ, {iota_run_nb.UPLOAD_PART_SIZE_MB_ENV_VAR: "5"}):
+            iota_run_nb._write_output_to_s3(context)
+
+        # THEN
+        ipynb = s3.Object(self.BUCKET, "output.ipynb").get()
+        self.assertEqual(nbformat.writes(context.nb), ipynb["Body"].read().decode("utf-8"))
+        self.assertTrue(ipynb["ETag"].endswith('-3"'))
+        self.assertEqual(b"<html></html>", s3.Object(self.BUCKET, "output.html").get()["Body"].read())
+
+    def test_GIVEN_notebook_WHEN_write_output_to_s3_THEN_html_rendered_during_ipynb_upload(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        context = self._get_context(MagicMock(), "output")
+        ipynb_upload_started = threading.Event()
+        def write_to_s3(s3_uri, text, s3, content_type):
+            if s3_uri.endswith(".ipynb"):
+                ipynb_upload_started.set()
+        def render_html(nb):
+            self.assertTrue(ipynb_upload_started.wait(5))
+            return "<html></html>"
+
+        # WHEN
+        with patch("iota_notebook_containers.iota_run_nb._write_to_s3", side_effect=write_to_s3) as mock_write, \
+                patch("iota_notebook_containers.iota_run_nb._render_html", side_effect=render_html) as mock_render:
+            iota_run_nb._write_output_to_s3(context)
+
+        # THEN
+        mock_render.assert_called_once_with(context.nb)
+        self.assertEqual(2, mock_write.call_count)
+
+    @moto.mock_s3
+    def test_GIVEN_offload_threshold_WHEN_write_output_to_s3_THEN_large_output_data_moved_to_separate_object(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=self.BUCKET)
+        context = self._get_context(s3, "output")
+        image = os.urandom(20 * 1024)
+        context.nb.cells[0].outputs.append(nbformat.v4.new_output("display_data", data={
+            "image/png": base64.b64encode(image).decode("ascii"), "text/plain": "<Figure>"}))
+
+        # WHEN
+        with patch("iota_notebook_containers.iota_run_nb._render_html", return_value="<html></html>") as render_html, \
+                patch.dict(os.environ, {iota_run_nb.OUTPUT_OFFLOAD_THRESHOLD_KB_ENV_VAR: "10"}):
+            iota_run_nb._write_output_to_s3(context)
+
+        # THEN
+        render_html.assert_called_once_with(context.nb)
+        self.assertIn("image/png", context.nb.cells[0].outputs[1].data)
+        ipynb = nbformat.reads(s3.Object(self.BUCKET, "output.ipynb").get()["Body"].read().decode("utf-8"), as_version=4)
+        output = ipynb.cells[0].outputs[1]
+        self.assertEqual({"text/plain": "<Figure>"}, output.data)
+        offloaded = output.metadata[iota_run_nb.OFFLOADED_OUTPUTS_METADATA_KEY]["image/png"]
+        self.assertEqual({"uri": "s3://my-bucket/output_outputs/cell0_output1.png", "encoding": "base64"}, offloaded)
+        image_object = s3.Object(self.BUCKET, "output_outputs/cell0_output1.png").get()
+        self.assertEqual(image, image_object["Body"].read())
+        self.assertEqual("image/png", image_object["ContentType"])
+        self.assertEqual(context.nb.cells[0].outputs[0], ipynb.cells[0].outputs[0])
+
+    @moto.mock_s3
+    def test_GIVEN_gzip_compression_WHEN_write_output_to_s3_THEN_outputs_uploaded_with_content_encoding(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=self.BUCKET)
+        context = self._get_context(s3, "output")
+
+        # WHEN
+        with patch("iota_notebook_containers.iota_run_nb._render_html", return_value="<html></html>"), \
+                patch.dict(os.environ, {iota_run_nb.OUTPUT_COMPRESSION_ENV_VAR: "gzip"}):
+            iota_run_nb._write_output_to_s3(context)
+
+        # THEN
+        ipynb = s3.Object(self.BUCKET, "output.ipynb").get()
+        self.assertEqual("gzip", ipynb["ContentEncoding"])
+        self.assertEqual(iota_run_nb.IPYNB_CONTENT_TYPE, ipynb["ContentType"])
+        self.assertEqual(nbformat.writes(context.nb), gzip.decompress(ipynb["Body"].read()).decode("utf-8"))
+        html = s3.Object(self.BUCKET, "output.html").get()
+        self.assertEqual("gzip", html["ContentEncoding"])
+        self.assertEqual(b"<html></html>", gzip.decompress(html["Body"].read()))
+
+    @moto.mock_s3
+    def test_GIVEN_metrics_WHEN_write_output_to_s3_THEN_metrics_uploaded_next_to_ipynb(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=self.BUCKET)
+        context = self._get_context(s3, "output")
+        metrics = {"wall_seconds": 1.5, "cells": [{"cell": 0, "wall_seconds": 1.5}]}
+
+        # WHEN
+        with patch("iota_notebook_containers.iota_run_nb._render_html", return_value="<html></html>"):
+            iota_run_nb._write_output_to_s3(context, metrics)
+
+        # THEN
+        metrics_object = s3.Object(self.BUCKET, "output_metrics.json").get()
+        self.assertEqual(metrics, json.loads(metrics_object["Body"].read().decode("utf-8")))
+        self.assertEqual("application/json", metrics_object["ContentType"])
+
+    @moto.mock_s3
+    def test_GIVEN_metrics_upload_fails_WHEN_write_output_to_s3_THEN_notebook_still_uploaded(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=self.BUCKET)
+        context = self._get_context(s3, "output")
+        write_to_s3 = iota_run_nb._write_to_s3
+        def _deny_metrics(s3_uri, *args):
+            if s3_uri.endswith("_metrics.json"):
+                raise RuntimeError("access denied")
+            write_to_s3(s3_uri, *args)
+
+        # WHEN
+        with patch("iota_notebook_containers.iota_run_nb._render_html", return_value="<html></html>"), \
+                patch("iota_notebook_containers.iota_run_nb._write_to_s3", side_effect=_deny_metrics):
+            iota_run_nb._write_output_to_s3(context, {"wall_seconds": 1.5, "cells": []})
+
+        # THEN
+        s3.Object(self.BUCKET, "output.ipynb").get()
+        s3.Object(self.BUCKET, "output.html").get()
+        with self.assertRaises(ClientError):
+            s3.Object(self.BUCKET, "output_metrics.json").get()
+
+    def _get_context(self, s3, output_text):
+        context = MagicMock()
+        context.nb = nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell(
+            "print('output')", outputs=[nbformat.v4.new_output("stream", text=output_text)])])
+        context.output_ipynb_s3_uri = "s3://{}/output.ipynb".format(self.BUCKET)
+        context.output_html_s3_uri = "s3://{}/output.html".format(self.BUCKET)
+        context.s3 = s3
+        return context
+
+class TestCellProfiler(unittest.TestCase):
+
+    def test_GIVEN_kernel_pid_WHEN_code_cell_profiled_THEN_metrics_recorded_in_cell_metadata(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        cell = nbformat.v4.new_code_cell("a = 1")
+        profiler = iota_run_nb._CellProfiler(clock=MagicMock(side_effect=[10, 12.5]))
+
+        # WHEN
+        with patch("iota_notebook_containers.iota_run_nb._reset_peak_rss", return_value=True) as reset_peak_rss, \
+                patch("iota_notebook_containers.iota_run_nb._read_cpu_seconds", side_effect=[1.25, 3.5]), \
+                patch("iota_notebook_containers.iota_run_nb._read_peak_rss_bytes", return_value=1024):
+            profiler.start_cell(42)
+            profiler.end_cell(cell, 3)
+
+        # THEN
+        reset_peak_rss.assert_called_once_with(42)
+        expected = {"wall_seconds": 2.5, "cpu_seconds": 2.25, "peak_rss_bytes": 1024, "peak_rss_reset": True}
+        self.assertEqual(expected, cell.metadata[iota_run_nb.CELL_METRICS_METADATA_KEY])
+        expected.update(cell=3)
+        self.assertEqual({"wall_seconds": 2.5, "cells": [expected]}, profiler.get_metrics())
+
+    def test_GIVEN_unknown_kernel_pid_WHEN_code_cell_profiled_THEN_only_wall_time_recorded(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        cell = nbformat.v4.new_code_cell("a = 1")
+        profiler = iota_run_nb._CellProfiler(clock=MagicMock(side_effect=[10, 11]))
+
+        # WHEN
+        profiler.start_cell(None)
+        profiler.end_cell(cell, 0)
+
+        # THEN
+        self.assertEqual({"wall_seconds": 1, "cpu_seconds": None, "peak_rss_bytes": None, "peak_rss_reset": False},
+            cell.metadata[iota_run_nb.CELL_METRICS_METADATA_KEY])
+
+    @unittest.skipUnless(os.path.exists("/proc/self/status"), "requires procfs")
+    def test_GIVEN_running_process_WHEN_read_usage_THEN_cpu_seconds_and_peak_rss_returned(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        pid = os.getpid()
+
+        # WHEN
+        cpu_seconds = iota_run_nb._read_cpu_seconds(pid)
+        peak_rss_bytes = iota_run_nb._read_peak_rss_bytes(pid)
+
+        # THEN
+        self.assertGreater(cpu_seconds, 0)
+        self.assertGreater(peak_rss_bytes, 0)
+
+class LocalDatasetService(object):
+    """Stands in for the iotanalytics client, serving dataset content from local files."""
+    def __init__(self, folder, contents, page_size=1):
+        self.folder = folder
+        self.contents = contents
+        self.page_size = page_size
+
+    def list_datasets(self, nextToken="0"):
+        names = sorted(self.contents)
+        start = int(nextToken)
+        response = {"datasetSummaries": [{"datasetName": name} for name in names[start:start + self.page_size]]}
+        if start + self.page_size < len(names):
+            response["nextToken"] = str(start + self.page_size)
+        return response
+
+    def get_dataset_content(self, datasetName, versionId):
+        if versionId not in self.contents[datasetName]:
+            raise ClientError({"Error": {"Code": "ResourceNotFoundException"}}, "GetDatasetContent")
+        entries = []
+        for entry_name, text in self.contents[datasetName][versionId].items():
+            filepath = os.path.join(self.folder, "{}_{}_{}".format(datasetName, versionId, entry_name))
+            with open(filepath, "w") as entry_file:
+                entry_file.write(text)
+            entries.append({"entryName": entry_name, "dataURI": "file://" + filepath})
+        return {"entries": entries}
+
+class TestDatasetPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.service_folder = tempfile.TemporaryDirectory()
+        self.cache_folder = tempfile.TemporaryDirectory()
+        self.service = LocalDatasetService(self.service_folder.name, {
+            "dataset_a": {"v1": {"a.csv": "1,2"}},
+            "dataset_b": {"v2": {"b.csv": "3,4"}, "v3": {"c.csv": "5,6"}}
+        })
+
+    def tearDown(self):
+        self.service_folder.cleanup()
+        self.cache_folder.cleanup()
+
+    def test_GIVEN_dataset_versions_WHEN_prefetch_THEN_content_of_each_variable_downloaded(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        prefetcher = iota_run_nb._DatasetPrefetcher(self.service, self.cache_folder.name)
+
+        # WHEN
+        paths = prefetcher.prefetch({"first": "v1", "second": "v3", "third": "v1"})
+
+        # THEN
+        expected_a = os.path.join(self.cache_folder.name, "dataset_a", "v1", "a.csv")
+        expected_c = os.path.join(self.cache_folder.name, "dataset_b", "v3", "c.csv")
+        self.assertEqual({"first": [expected_a], "second": [expected_c], "third": [expected_a]}, paths)
+        with open(expected_a) as a, open(expected_c) as c:
+            self.assertEqual(["1,2", "5,6"], [a.read(), c.read()])
+
+    def test_GIVEN_unknown_version_WHEN_prefetch_THEN_other_variables_downloaded(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        prefetcher = iota_run_nb._DatasetPrefetcher(self.service, self.cache_folder.name)
+
+        # WHEN
+        paths = prefetcher.prefetch({"first": "v1", "missing": "v9"})
+
+        # THEN
+        self.assertEqual(["first"], list(paths))
+
+    def test_GIVEN_many_datasets_WHEN_prefetch_THEN_lookups_capped_and_stopped_once_version_found(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        service = LocalDatasetService(self.service_folder.name,
+            dict({"dataset_{:02}".format(position): {} for position in range(20)}, dataset_00={"v1": {"a.csv": "1"}}),
+            page_size=100)
+        get_dataset_content = service.get_dataset_content
+        lock = threading.Lock()
+        in_flight = [0]
+        lookups = []
+        def counting_get_dataset_content(datasetName, versionId):
+            with lock:
+                in_flight[0] += 1
+                lookups.append((datasetName, versionId, in_flight[0]))
+            try:
+                time.sleep(0.01)
+                return get_dataset_content(datasetName, versionId)
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+        service.get_dataset_content = counting_get_dataset_content
+        prefetcher = iota_run_nb._DatasetPrefetcher(service, self.cache_folder.name, max_lookups=2)
+
+        # WHEN
+        paths = prefetcher.prefetch({"first": "v1"})
+
+        # THEN
+        self.assertEqual(["first"], list(paths))
+        self.assertLessEqual(max(in_flight for _, _, in_flight in lookups), 2)
+        self.assertLessEqual(len(lookups), 3)
+
+    def test_GIVEN_failing_lookup_WHEN_prefetch_THEN_failure_logged_and_other_datasets_looked_up(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        get_dataset_content = self.service.get_dataset_content
+        def throttled_get_dataset_content(datasetName, versionId):
+            if datasetName == "dataset_a":
+                raise ClientError({"Error": {"Code": "ThrottlingException"}}, "GetDatasetContent")
+            return get_dataset_content(datasetName, versionId)
+        self.service.get_dataset_content = throttled_get_dataset_content
+        prefetcher = iota_run_nb._DatasetPrefetcher(self.service, self.cache_folder.name)
+
+        # WHEN
+        with self.assertLogs(iota_run_nb.logger, level="WARNING") as logs:
+            paths = prefetcher.prefetch({"first": "v1", "second": "v3"})
+
+        # THEN
+        self.assertEqual(["second"], list(paths))
+        self.assertTrue(any("dataset_a" in message for message in logs.output))
+
+    def test_GIVEN_dataset_variables_WHEN_prefetch_datasets_THEN_paths_available_to_kernel(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        variables = {"dataset": "v2", "other": "v1", "number": 5}
+        environment = {iota_run_nb.DATASET_VARIABLES_ENV_VAR: "dataset,unset",
+            iota_run_nb.DATASET_CACHE_FOLDER_ENV_VAR: self.cache_folder.name, "PYTHONPATH": "/lib"}
+
+        with patch.dict(os.environ, environment):
+            # WHEN
+            iota_run_nb._prefetch_datasets(iota_run_nb._get_dataset_versions(variables), self.service)
+
+            # THEN
+            expected = os.path.join(self.cache_folder.name, "dataset_b", "v2", "b.csv")
+            self.assertEqual([expected], iota_run_nb.get_dataset_paths("dataset"))
+            self.assertEqual(os.pathsep.join([iota_run_nb.SCRIPT_FOLDER, "/lib"]), os.environ["PYTHONPATH"])
+
+    def test_GIVEN_failing_service_WHEN_prefetch_datasets_THEN_continue_without_datasets(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        service = MagicMock()
+        service.list_datasets.side_effect = ClientError({"Error": {"Code": "AccessDeniedException"}}, "ListDatasets")
+
+        with patch.dict(os.environ, {iota_run_nb.DATASET_CACHE_FOLDER_ENV_VAR: self.cache_folder.name}):
+            os.environ.pop(iota_run_nb.DATASET_MANIFEST_ENV_VAR, None)
+            # WHEN
+            iota_run_nb._prefetch_datasets({"dataset": "v2"}, service)
+
+            # THEN
+            self.assertRaises(KeyError, iota_run_nb.get_dataset_paths, "dataset")
+
+class TestOutputFileUploader(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.spool_folder = os.path.join(self.folder.name, "spool")
+        self.filepath = os.path.join(self.folder.name, "result.csv")
+        with open(self.filepath, "w") as result_file:
+            result_file.write("1,2")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_GIVEN_spooled_files_WHEN_close_THEN_files_uploaded_and_removed_from_spool(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        uploads = {}
+        def upload(filepath, s3_uri):
+            with open(filepath) as spooled_file:
+                uploads[s3_uri] = spooled_file.read()
+        uploader = iota_run_nb._OutputFileUploader(self.spool_folder, upload)
+        with patch.dict(os.environ, {iota_run_nb.OUTPUT_SPOOL_FOLDER_ENV_VAR: self.spool_folder}):
+            iota_run_nb.upload_file(self.filepath, "s3://bucket/first.csv")
+            with open(self.filepath, "w") as result_file:
+                result_file.write("3,4")
+            iota_run_nb.upload_file(self.filepath, "s3://bucket/second.csv")
+
+        # WHEN
+        uploader.close()
+
+        # THEN
+        self.assertEqual({"s3://bucket/first.csv": "1,2", "s3://bucket/second.csv": "3,4"}, uploads)
+        self.assertEqual([], os.listdir(self.spool_folder))
+        self.assertEqual([], uploader.failed_s3_uris)
+
+    def test_GIVEN_failing_upload_WHEN_close_THEN_upload_retried(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        upload = MagicMock(side_effect=[Exception("throttled"), Exception("throttled"), None])
+        sleep = MagicMock()
+        uploader = iota_run_nb._OutputFileUploader(self.spool_folder, upload, sleep=sleep)
+        with patch.dict(os.environ, {iota_run_nb.OUTPUT_SPOOL_FOLDER_ENV_VAR: self.spool_folder}):
+            iota_run_nb.upload_file(self.filepath, "s3://bucket/result.csv")
+
+        # WHEN
+        uploader.close()
+
+        # THEN
+        self.assertEqual(3, upload.call_count)
+        self.assertEqual([((1,),), ((2,),)], sleep.call_args_list)
+        self.assertEqual([], os.listdir(self.spool_folder))
+
+    def test_GIVEN_upload_failing_every_attempt_WHEN_close_THEN_failure_recorded_and_file_kept(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        upload = MagicMock(side_effect=Exception("access denied"))
+        uploader = iota_run_nb._OutputFileUploader(self.spool_folder, upload, sleep=MagicMock())
+        with patch.dict(os.environ, {iota_run_nb.OUTPUT_SPOOL_FOLDER_ENV_VAR: self.spool_folder}):
+            iota_run_nb.upload_file(self.filepath, "s3://bucket/result.csv")
+
+        # WHEN
+        uploader.close()
+
+        # THEN
+        self.assertEqual(iota_run_nb._OutputFileUploader.MAX_ATTEMPTS, upload.call_count)
+        self.assertEqual(["s3://bucket/result.csv"], uploader.failed_s3_uris)
+        self.assertEqual(2, len(os.listdir(self.spool_folder)))
+
+    @moto.mock_s3
+    @patch.dict(os.environ, {"AWS_REQUEST_CHECKSUM_CALCULATION": "when_required"})
+    def test_GIVEN_no_spool_folder_WHEN_upload_file_THEN_file_uploaded_immediately(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="bucket")
+
+        with patch.dict(os.environ, {iota_run_nb.OUTPUT_SPOOL_FOLDER_ENV_VAR: ""}):
+            # WHEN
+            iota_run_nb.upload_file(self.filepath, "s3://bucket/result.csv")
+
+        # THEN
+        self.assertEqual(b"1,2", s3.Object("bucket", "result.csv").get()["Body"].read())
+
+class TestInProcessExecutor(unittest.TestCase):
+
+    def test_GIVEN_notebook_WHEN_executed_in_process_THEN_outputs_recorded_like_kernel(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        nb = nbformat.v4.new_notebook(cells=[
+            nbformat.v4.new_code_cell("a = 1\nprint('hello'); print('world')\na + 1"),
+            nbformat.v4.new_markdown_cell("text"),
+            nbformat.v4.new_code_cell("from IPython.display import display\ndisplay({'text/plain': str(a)}, raw=True)"),
+            nbformat.v4.new_code_cell("1/0", metadata={"tags": ["raises-exception"]})])
+        profiler = iota_run_nb._CellProfiler()
+
+        # WHEN
+        iota_run_nb._InProcessExecutor(nb, None, profiler).preprocess(nb, {})
+
+        # THEN
+        nbformat.validate(nb)
+        self.assertEqual([nbformat.v4.new_output("stream", name="stdout", text="hello\nworld\n"),
+            nbformat.v4.new_output("execute_result", data={"text/plain": "2"}, execution_count=nb.cells[0].execution_count)],
+            nb.cells[0].outputs)
+        self.assertEqual([nbformat.v4.new_output("display_data", data={"text/plain": "1"})], nb.cells[2].outputs)
+        self.assertEqual("ZeroDivisionError", nb.cells[3].outputs[0].ename)
+        self.assertEqual([0, 2, 3], [cell["cell"] for cell in profiler.get_metrics()["cells"]])
+
+    def test_GIVEN_failing_cell_WHEN_executed_in_process_THEN_later_cells_not_executed(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        nb = nbformat.v4.new_notebook(cells=[
+            nbformat.v4.new_code_cell("print('before')\nraise ValueError('bad input')"),
+            nbformat.v4.new_code_cell("print('after')")])
+
+        # WHEN
+        with self.assertRaises(iota_run_nb._CellExecutionError):
+            iota_run_nb._InProcessExecutor(nb, None, iota_run_nb._CellProfiler()).preprocess(nb, {})
+
+        # THEN
+        self.assertEqual(["stream", "error"], [output.output_type for output in nb.cells[0].outputs])
+        self.assertEqual("bad input", nb.cells[0].outputs[1].evalue)
+        self.assertEqual([], nb.cells[1].outputs)
+
+    def test_GIVEN_in_process_execution_mode_WHEN_create_session_THEN_no_kernel_started(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+
+        with patch.dict(os.environ, {iota_run_nb.EXECUTION_MODE_ENV_VAR: iota_run_nb.IN_PROCESS_EXECUTION_MODE}):
+            # WHEN
+            session = iota_run_nb._create_session(iota_run_nb._get_execution_mode())
+
+        # THEN
+        self.assertIsInstance(session, iota_run_nb._InProcessSession)
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        # the in-process runs change into the notebook's folder
+        self.addCleanup(os.chdir, os.getcwd())
+        self.folder = tempfile.TemporaryDirectory()
+        self.notebook_path = os.path.join(self.folder.name, "notebook.ipynb")
+        nbformat.write(nbformat.v4.new_notebook(cells=[
+            nbformat.v4.new_code_cell("a = 1"),
+            nbformat.v4.new_code_cell("import os\nprint(a, os.getpid(), 'leftover' in dir())\nleftover = a"),
+            nbformat.v4.new_code_cell("assert a != 2")]), self.notebook_path)
+        self.written_contexts = []
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def _write_params(self, variable_sets, output_uri_count=None):
+        params_filepath = os.path.join(self.folder.name, "params")
+        output_uris = [{"ipynb": "s3://bucket/{}.ipynb".format(position), "html": "s3://bucket/{}.html".format(position)}
+            for position in range(len(variable_sets) if output_uri_count is None else output_uri_count)]
+        with open(params_filepath, "w") as params_file:
+            json.dump({"Variables": variable_sets, "Context": {"Analysis": self.notebook_path, "OutputUris": output_uris}},
+                params_file)
+        return params_filepath
+
+    def _run_notebook(self, params_filepath, execution_mode):
+        from iota_notebook_containers import iota_run_nb
+        environment = {iota_run_nb.EXECUTION_MODE_ENV_VAR: execution_mode,
+            iota_run_nb.OUTPUT_SPOOL_FOLDER_ENV_VAR: os.path.join(self.folder.name, "spool")}
+        with patch.object(iota_run_nb, "PARAMS_FILEPATH", params_filepath), \
+                patch.object(iota_run_nb, "_write_output_to_s3",
+                    lambda context, metrics=None: self.written_contexts.append(context)), \
+                patch.dict(os.environ, environment):
+            iota_run_nb.run_notebook()
+
+    def test_GIVEN_batch_params_WHEN_load_contexts_THEN_context_per_variable_set(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        params_filepath = self._write_params([{"a": 3}, {"a": 4}])
+
+        # WHEN
+        with patch.object(iota_run_nb, "PARAMS_FILEPATH", params_filepath):
+            contexts = iota_run_nb._load_contexts()
+
+        # THEN
+        self.assertEqual([{"a": 3}, {"a": 4}], [context.variables for context in contexts])
+        self.assertEqual(["s3://bucket/0.html", "s3://bucket/1.html"],
+            [context.output_html_s3_uri for context in contexts])
+        self.assertIsNot(contexts[0].nb, contexts[1].nb)
+
+    def test_GIVEN_batch_without_output_uris_per_variable_set_WHEN_load_contexts_THEN_value_error(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        params_filepath = self._write_params([{"a": 3}, {"a": 4}], output_uri_count=1)
+
+        with patch.object(iota_run_nb, "PARAMS_FILEPATH", params_filepath):
+            # WHEN / THEN
+            self.assertRaises(ValueError, iota_run_nb._load_contexts)
+
+    def test_GIVEN_batch_WHEN_run_notebook_in_kernel_THEN_kernel_reused_with_reset_namespace(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        params_filepath = self._write_params([{"a": 3}, {"a": 4}])
+
+        # WHEN
+        self._run_notebook(params_filepath, iota_run_nb.SUBPROCESS_EXECUTION_MODE)
+
+        # THEN
+        printed = sorted(context.nb.cells[1].outputs[0].text.split() for context in self.written_contexts)
+        self.assertEqual([["3", "False"], ["4", "False"]], [[value, leftover] for value, _, leftover in printed])
+        self.assertEqual(printed[0][1], printed[1][1])
+        for context in self.written_contexts:
+            self.assertEqual([1, 2, 3], [cell.execution_count for cell in context.nb.cells])
+            # nothing but the printed line, e.g. no history database errors of the reused kernel
+            self.assertEqual([[], [("stream", "stdout")], []],
+                [[(output.output_type, output.get("name")) for output in cell.outputs] for cell in context.nb.cells])
+            self.assertEqual(1, len(context.nb.cells[1].outputs[0].text.splitlines()))
+
+    def test_GIVEN_failing_run_WHEN_run_notebook_batch_THEN_other_runs_complete(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        params_filepath = self._write_params([{"a": 2}, {"a": 3}])
+
+        # WHEN
+        with self.assertRaises(iota_run_nb._BatchExecutionError):
+            self._run_notebook(params_filepath, iota_run_nb.IN_PROCESS_EXECUTION_MODE)
+
+        # THEN
+        self.assertEqual(["s3://bucket/0.ipynb", "s3://bucket/1.ipynb"],
+            [context.output_ipynb_s3_uri for context in self.written_contexts])
+        self.assertEqual("error", self.written_contexts[0].nb.cells[2].outputs[0].output_type)
+        self.assertEqual([], self.written_contexts[1].nb.cells[2].outputs)
+
+    def test_GIVEN_output_file_upload_fails_WHEN_run_notebook_THEN_output_written_and_error_raised(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        params_filepath = self._write_params([{"a": 3}])
+
+        # WHEN
+        with patch.object(iota_run_nb._OutputFileUploader, "close", side_effect=RuntimeError("upload failed")), \
+                self.assertRaisesRegex(RuntimeError, "upload failed"):
+            self._run_notebook(params_filepath, iota_run_nb.IN_PROCESS_EXECUTION_MODE)
+
+        # THEN
+        self.assertEqual(["s3://bucket/0.ipynb"], [context.output_ipynb_s3_uri for context in self.written_contexts])
+        self.assertEqual("3 ", self.written_contexts[0].nb.cells[1].outputs[0].text[:2])
+
+class TestCheckpointer(unittest.TestCase):
+
+    def test_GIVEN_no_checkpoint_interval_WHEN_from_environment_THEN_checkpointing_disabled(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        with patch.dict(os.environ, {iota_run_nb.CHECKPOINT_INTERVAL_SECONDS_ENV_VAR: "",
+                iota_run_nb.CHECKPOINT_INTERVAL_CELLS_ENV_VAR: "0"}):
+            # WHEN
+            checkpointer = iota_run_nb._Checkpointer.from_environment(MagicMock())
+
+        # THEN
+        self.assertIsNone(checkpointer)
+
+    def test_GIVEN_cell_interval_and_slow_upload_WHEN_cells_executed_THEN_only_latest_pending_checkpoint_uploaded(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        nb = nbformat.v4.new_notebook()
+        upload_started, release_upload = threading.Event(), threading.Event()
+        uploads = []
+        def upload(ipynb_json):
+            uploads.append(json.loads(ipynb_json)["metadata"]["cells_executed"])
+            upload_started.set()
+            release_upload.wait(5)
+        checkpointer = iota_run_nb._Checkpointer(upload, interval_cells=2)
+
+        # WHEN
+        for cells_executed in range(1, 7):
+            nb.metadata["cells_executed"] = cells_executed
+            checkpointer.cell_executed(nb)
+            if cells_executed == 2:
+                upload_started.wait(5)
+        release_upload.set()
+        self._wait_for(lambda: len(uploads) == 2)
+        checkpointer.close()
+
+        # THEN
+        self.assertEqual([2, 6], uploads)
+
+    def test_GIVEN_seconds_interval_WHEN_cells_executed_THEN_checkpoint_once_interval_elapsed(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        upload = MagicMock()
+        clock = MagicMock(side_effect=[0, 10, 30, 30, 40])
+        checkpointer = iota_run_nb._Checkpointer(upload, interval_seconds=30, clock=clock)
+
+        # WHEN
+        checkpointer.cell_executed(nbformat.v4.new_notebook())
+        checkpointer.cell_executed(nbformat.v4.new_notebook())
+        self._wait_for(lambda: upload.called)
+        checkpointer.cell_executed(nbformat.v4.new_notebook())
+        checkpointer.close()
+
+        # THEN
+        upload.assert_called_once_with(nbformat.writes(nbformat.v4.new_notebook()))
+
+    def test_GIVEN_failing_upload_WHEN_cells_executed_THEN_execution_continues_and_later_checkpoints_uploaded(self):
+        # GIVEN
+        from iota_notebook_containers import iota_run_nb
+        upload = MagicMock(side_effect=[Exception("S3 is unavailable"), None])
+        checkpointer = iota_run_nb._Checkpointer(upload, interval_cells=1)
+
+        # WHEN
+        checkpointer.cell_executed(nbformat.v4.new_notebook())
+        self._wait_for(lambda: upload.call_count == 1)
+        checkpointer.cell_executed(nbformat.v4.new_notebook())
+        self._wait_for(lambda: upload.call_count == 2)
+        checkpointer.close()
+
+        # THEN
+        self.assertEqual(2, upload.call_count)
+
+    def _wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,30 +1,44 @@
+import docker
 import itertools
 import os
+import requests
+import subprocess
+import tarfile
+import tempfile
 import unittest
 
+from io import BytesIO
 from unittest.mock import patch, MagicMock
 
+from iota_notebook_containers import kernel_image_creator
+from iota_notebook_containers.build_governor import BuildGovernor
+from iota_notebook_containers.build_journal import BuildJournal
+from iota_notebook_containers.containerization_metrics import ContainerizationMetrics
 from iota_notebook_containers.kernel_image_creator import KernelImageCreator
 
 class TestKernelImageCreator(unittest.TestCase):
     def test_GIVEN_emtpy_list_WHEN_get_message_if_space_insufficientv_THEN_none(self):
-        self.assertEquals(None, KernelImageCreator._get_message_if_space_insufficient([]))
+        required_bytes = KernelImageCreator._get_required_space_bytes(KernelImageCreator._get_total_size_of_files([]))
+        with patch("shutil.disk_usage", return_value=(None, None, required_bytes)):
+            self.assertEquals(None, KernelImageCreator._get_message_if_space_insufficient(required_bytes, "/"))
 
     def test_GIVEN_suffient_space_WHEN_get_message_if_space_insufficient_THEN_none(self):
-        with patch("os.path.getsize", return_value=1):
-            self.assertEquals(None,
-                KernelImageCreator._get_message_if_space_insufficient(["file", "other_file"]))
+        with patch("shutil.disk_usage", return_value=(None, None, 100)) as disk_usage:
+            self.assertEquals(None, KernelImageCreator._get_message_if_space_insufficient(100, "/var/lib/docker"))
+        disk_usage.assert_called_once_with("/var/lib/docker")
 
     def test_GIVEN_insuffient_space_WHEN_get_message_if_space_insufficient_THEN_msg(self):
         # GIVEN
-        size_of_each_file = 100
+        size_of_each_file = 51200
         free_space = 10
         files = ["file", "other_file"]
 
         # WHEN
         with patch("os.path.getsize", return_value=size_of_each_file):
-            with patch("shutil.disk_usage", return_value=(None, None, free_space)):
-                observed = KernelImageCreator._get_message_if_space_insufficient(files)
+            required_bytes = KernelImageCreator._get_required_space_bytes(
+                KernelImageCreator._get_total_size_of_files(files))
+        with patch("shutil.disk_usage", return_value=(None, None, free_space)):
+            observed = KernelImageCreator._get_message_if_space_insufficient(required_bytes, "/")
 
         # THEN
         additional_required_bytes = int(KernelImageCreator.REQUIRED_SPACE_PER_FILES_SPACE * len(files)
@@ -34,6 +48,168 @@ class TestKernelImageCreator(unittest.TestCase):
 
         self.assertEquals(expected, observed)
 
+    def test_GIVEN_sparse_and_hardlinked_files_WHEN_get_total_size_of_files_THEN_apparent_size_of_every_path(self):
+        # GIVEN
+        with tempfile.TemporaryDirectory() as folder:
+            sparse_filepath = os.path.join(folder, "sparse")
+            with open(sparse_filepath, "wb") as f:
+                f.truncate(1024 * 1024)
+            filepath = os.path.join(folder, "file")
+            self._write_file(filepath, 8192)
+            os.link(filepath, os.path.join(folder, "link"))
+            filepaths = [sparse_filepath, filepath, os.path.join(folder, "link")]
+
+            # WHEN
+            total_bytes = KernelImageCreator._get_total_size_of_files(filepaths)
+
+            # THEN
+            # every path is at most written at its apparent size by the archive the copy sends
+            tarstream = BytesIO()
+            with tarfile.TarFile(fileobj=tarstream, mode="w") as tar:
+                for path in filepaths:
+                    tar.add(path)
+                archived_bytes = sum(member.size for member in tar.getmembers())
+            self.assertEqual(1024 * 1024 + 2 * 8192, total_bytes)
+            self.assertLessEqual(archived_bytes, total_bytes)
+
+    def test_GIVEN_docker_info_WHEN_get_docker_root_dir_THEN_data_root(self):
+        with tempfile.TemporaryDirectory() as docker_root_dir, \
+                patch.object(KernelImageCreator, "docker_client") as docker_client:
+            docker_client.info.return_value = {"DockerRootDir": docker_root_dir}
+            self.assertEqual(docker_root_dir, KernelImageCreator._get_docker_root_dir())
+
+    def test_GIVEN_data_root_not_on_this_host_WHEN_get_docker_root_dir_THEN_root_folder(self):
+        with patch.object(KernelImageCreator, "docker_client") as docker_client:
+            docker_client.info.return_value = {"DockerRootDir": "/does/not/exist"}
+            self.assertEqual(KernelImageCreator.DEFAULT_DOCKER_ROOT_DIR, KernelImageCreator._get_docker_root_dir())
+
+    def test_GIVEN_space_runs_out_WHEN_copy_files_onto_container_THEN_stop_with_error(self):
+        # GIVEN
+        interim_container = MagicMock()
+        file_size = KernelImageCreator.MAX_FILEBATCH_SIZE
+        required_bytes = KernelImageCreator._get_required_space_bytes(2 * file_size)
+        # another process fills the disk while the first batch is copied
+        free_space = [required_bytes, file_size]
+
+        # WHEN
+        with patch("os.path.getsize", return_value=file_size), \
+                patch("shutil.disk_usage", side_effect=[(None, None, free) for free in free_space]), \
+                patch.object(KernelImageCreator, "_copy_onto_container", return_value=1.0) as copy_onto_container, \
+                patch.object(BuildJournal, "record_batch") as record_batch:
+            statuses = list(KernelImageCreator._copy_files_onto_container(interim_container,
+                lambda: iter(["file", "other_file"]), required_bytes, "/var/lib/docker"))
+
+        # THEN
+        copy_onto_container.assert_called_once_with(interim_container, ["file"], None, None)
+        record_batch.assert_called_once_with(["file"])
+        self.assertEqual([50, 0], [status.progress for status in statuses])
+        self.assertIsNone(statuses[0].error_msg)
+        self.assertTrue(statuses[1].error_msg.startswith("This instance ran out of space"))
+
+    def test_GIVEN_transient_failures_WHEN_copy_onto_container_with_retries_THEN_retried_with_backoff(self):
+        # GIVEN
+        interim_container = MagicMock()
+        failures = [requests.exceptions.ConnectionError(), docker.errors.APIError("daemon error",
+            response=MagicMock(status_code=500)), None]
+        metrics = ContainerizationMetrics()
+
+        # WHEN
+        with patch.dict(os.environ, {"IOTA_BUILD_COPY_RETRIES": "2", "IOTA_BUILD_COPY_RETRY_BACKOFF_SECONDS": "1"}), \
+                patch.object(KernelImageCreator, "_copy_onto_container", side_effect=failures) as copy_onto_container, \
+                patch("time.sleep") as sleep:
+            KernelImageCreator._copy_onto_container_with_retries(interim_container, ["file"], metrics=metrics)
+
+        # THEN
+        self.assertEqual(3, copy_onto_container.call_count)
+        self.assertEqual([(1.0,), (2.0,)], [call.args for call in sleep.call_args_list])
+        self.assertEqual({"retries": 2}, metrics.as_dict()[ContainerizationMetrics.COPY_PHASE])
+        self.assertEqual({"seconds": 3.0}, metrics.as_dict()[ContainerizationMetrics.RETRY_WAIT_PHASE])
+
+    def test_GIVEN_rejected_request_WHEN_copy_onto_container_with_retries_THEN_not_retried(self):
+        # GIVEN
+        not_found = docker.errors.NotFound("no such container", response=MagicMock(status_code=404))
+
+        # WHEN/THEN
+        with patch.object(KernelImageCreator, "_copy_onto_container", side_effect=not_found) as copy_onto_container, \
+                patch("time.sleep"):
+            self.assertRaises(docker.errors.NotFound,
+                KernelImageCreator._copy_onto_container_with_retries, MagicMock(), ["file"])
+        copy_onto_container.assert_called_once()
+
+    def test_GIVEN_journaled_build_WHEN_get_resumable_interim_container_THEN_container_of_same_build(self):
+        # GIVEN
+        build = {"kernel": "containerized_python3", "notebook_path": "a.ipynb", "dataset_variable_names": [],
+            "image": "sha256:kernel"}
+        copied_file_versions = {"file": [1, 2]}
+        journaled_build = dict(build, job_id="job", container_id="container")
+
+        # WHEN
+        with patch.object(BuildJournal, "load", return_value=(journaled_build, copied_file_versions)), \
+                patch.object(KernelImageCreator, "docker_client") as docker_client:
+            resumed = KernelImageCreator._get_resumable_interim_container(build)
+            other_notebook = KernelImageCreator._get_resumable_interim_container(dict(build, notebook_path="b.ipynb"))
+
+        # THEN
+        docker_client.containers.get.assert_called_once_with("container")
+        self.assertEqual((docker_client.containers.get.return_value, copied_file_versions, "job"), resumed)
+        self.assertEqual((None, {}, None), other_notebook)
+
+    def test_GIVEN_journal_corrupted_by_crash_WHEN_get_resumable_interim_container_THEN_resumed_with_readable_batches(self):
+        # GIVEN
+        build = {"kernel": "containerized_python3", "notebook_path": "a.ipynb", "dataset_variable_names": [],
+            "image": "sha256:kernel"}
+        with tempfile.TemporaryDirectory() as folder:
+            filepaths = []
+            for name in ["file1", "file2"]:
+                filepaths.append(os.path.join(folder, name))
+                with open(filepaths[-1], "w") as f:
+                    f.write(name)
+            with patch.object(BuildJournal, "FILEPATH", os.path.join(folder, "journal.jsonl")):
+                BuildJournal.start(dict(build, job_id="job", container_id="container"))
+                BuildJournal.record_batch(filepaths[:1])
+                with open(BuildJournal.FILEPATH, "a") as journal:
+                    journal.write('[["file3", 1')
+                BuildJournal.record_batch(filepaths[1:])
+
+                # WHEN
+                with patch.object(KernelImageCreator, "docker_client") as docker_client:
+                    resumed = KernelImageCreator._get_resumable_interim_container(build)
+
+        # THEN
+        interim_container, copied_file_versions, job_id = resumed
+        self.assertEqual(docker_client.containers.get.return_value, interim_container)
+        self.assertEqual(filepaths, list(copied_file_versions))
+        self.assertEqual("job", job_id)
+
+    def test_GIVEN_unreadable_journal_WHEN_get_resumable_interim_container_THEN_not_resumed(self):
+        # GIVEN
+        with tempfile.TemporaryDirectory() as folder:
+            with patch.object(BuildJournal, "FILEPATH", os.path.join(folder, "journal.jsonl")):
+                with open(BuildJournal.FILEPATH, "w") as journal:
+                    journal.write('{"kernel": "containerized_py')
+
+                # WHEN
+                with patch.object(KernelImageCreator, "docker_client") as docker_client:
+                    resumed = KernelImageCreator._get_resumable_interim_container({"kernel": "containerized_python3"})
+
+                # THEN
+                self.assertEqual((None, {}, None), resumed)
+                self.assertFalse(os.path.exists(BuildJournal.FILEPATH))
+        docker_client.containers.get.assert_not_called()
+
+    def test_GIVEN_copied_files_WHEN_generate_files_not_copied_THEN_changed_and_new_files(self):
+        # GIVEN
+        copied_file_versions = {"unchanged": [1, 1], "changed": [1, 1]}
+        versions = {"unchanged": [1, 1], "changed": [2, 2], "new": [1, 1]}
+
+        # WHEN
+        with patch.object(BuildJournal, "get_file_version", side_effect=lambda filepath: versions[filepath]):
+            files = list(KernelImageCreator._generate_files_not_copied(["unchanged", "changed", "new"],
+                copied_file_versions))
+
+        # THEN
+        self.assertEqual(["changed", "new"], files)
+
     def test_remove_prefix_with_prefix_present(self):
         self.assertEquals("text", KernelImageCreator._remove_prefix("prefix_text", "prefix_"))
 
@@ -103,6 +279,60 @@ class TestKernelImageCreator(unittest.TestCase):
         self.assertCountEqual(files[:2], batches[0])
         self.assertCountEqual([files[2]], batches[1])
 
+    def test_GIVEN_file_count_limit_WHEN_split_into_batches_THEN_batches_within_count(self):
+        # GIVEN
+        files = ["file1", "file2", "file3"]
+
+        # WHEN
+        with patch("os.path.getsize", return_value=1):
+            batches = list(KernelImageCreator._split_into_batches(files, kernel_image_creator.FileBatchLimits(100, 2)))
+
+        # THEN
+        self.assertEqual([["file1", "file2"], ["file3"]], batches)
+
+    def test_GIVEN_file_larger_than_limit_WHEN_split_into_batches_THEN_no_empty_batch(self):
+        # WHEN
+        with patch("os.path.getsize", return_value=200):
+            batches = list(KernelImageCreator._split_into_batches(["file1", "file2"],
+                kernel_image_creator.FileBatchLimits(100, 10)))
+
+        # THEN
+        self.assertEqual([["file1"], ["file2"]], batches)
+
+    def test_GIVEN_limits_change_WHEN_split_into_batches_THEN_next_batch_uses_new_limits(self):
+        # GIVEN
+        batch_limits = kernel_image_creator.FileBatchLimits(100, 1)
+        files = ["file1", "file2", "file3", "file4"]
+
+        # WHEN
+        batches = []
+        with patch("os.path.getsize", return_value=1):
+            for batch in KernelImageCreator._split_into_batches(files, batch_limits):
+                batches.append(batch)
+                batch_limits.max_files = 2
+
+        # THEN
+        # the first file of each batch is read before the previous batch is handed out
+        self.assertEqual([["file1"], ["file2", "file3"], ["file4"]], batches)
+
+    def test_GIVEN_copy_time_WHEN_scale_batch_limits_THEN_scaled_towards_target_within_bounds(self):
+        # GIVEN
+        fast = kernel_image_creator.FileBatchLimits(KernelImageCreator.INITIAL_FILEBATCH_SIZE, 1000)
+        slow = kernel_image_creator.FileBatchLimits(KernelImageCreator.INITIAL_FILEBATCH_SIZE, 1000)
+        capped = kernel_image_creator.FileBatchLimits(KernelImageCreator.MAX_FILEBATCH_SIZE,
+            KernelImageCreator.MAX_FILEBATCH_FILES)
+
+        # WHEN
+        KernelImageCreator._scale_batch_limits(fast, KernelImageCreator.TARGET_FILEBATCH_SECONDS / 1.5)
+        KernelImageCreator._scale_batch_limits(slow, KernelImageCreator.TARGET_FILEBATCH_SECONDS * 10)
+        KernelImageCreator._scale_batch_limits(capped, 0)
+
+        # THEN
+        self.assertEqual((int(KernelImageCreator.INITIAL_FILEBATCH_SIZE * 1.5), 1500), (fast.max_bytes, fast.max_files))
+        self.assertEqual((KernelImageCreator.INITIAL_FILEBATCH_SIZE // 2, 500), (slow.max_bytes, slow.max_files))
+        self.assertEqual((KernelImageCreator.MAX_FILEBATCH_SIZE, KernelImageCreator.MAX_FILEBATCH_FILES),
+            (capped.max_bytes, capped.max_files))
+
     def test_copy_onto_containers(self):
         # GIVEN
         files = ["folder1/file1", "folder2/file2", "folder3/file3"]
@@ -118,5 +348,107 @@ class TestKernelImageCreator(unittest.TestCase):
             tarstream.add.assert_any_call(f)
         self.assertEquals(len(files), tarstream.add.call_count)
 
+    def test_GIVEN_governor_WHEN_copy_onto_container_THEN_paced_after_each_file_and_the_upload(self):
+        # GIVEN
+        governor = MagicMock()
+        governor.pace.return_value = 0
+
+        # WHEN
+        with patch("tarfile.TarFile.__enter__", return_value=MagicMock()), \
+                patch("os.path.getsize", side_effect=[10, 20]):
+            KernelImageCreator._copy_onto_container(MagicMock(), ["file1", "file2"], governor)
+
+        # THEN
+        self.assertEqual([(10,), (20,), (0,)], [call.args for call in governor.pace.call_args_list])
+
+    def test_GIVEN_metrics_WHEN_copy_onto_container_THEN_throttling_timed_apart_from_archive_and_put(self):
+        # GIVEN
+        governor = MagicMock()
+        governor.pace.side_effect = [3, 4]
+        metrics = ContainerizationMetrics()
+
+        # WHEN
+        # archiving takes 10 seconds of which 3 are throttled, the put takes 2 seconds
+        with patch("tarfile.TarFile.__enter__", return_value=MagicMock()), \
+                patch("os.path.getsize", return_value=10), \
+                patch("time.monotonic", side_effect=[0, 10, 10, 12]):
+            copy_seconds = KernelImageCreator._copy_onto_container(MagicMock(), ["file1"], governor, metrics)
+
+        # THEN
+        self.assertEqual(9, copy_seconds)
+        self.assertEqual({ContainerizationMetrics.ARCHIVE_PHASE: {"seconds": 7},
+            ContainerizationMetrics.COPY_PHASE: {"seconds": 2},
+            ContainerizationMetrics.THROTTLE_PHASE: {"seconds": 7}}, metrics.as_dict())
+
+    def test_GIVEN_variables_WHEN_build_variable_index_THEN_run_script_with_kernel_python(self):
+        # WHEN
+        with patch("os.path.exists", return_value=False), \
+                patch.object(BuildGovernor, "get_helper_command_prefix", return_value=["ionice", "-c", "3"]):
+            with patch("subprocess.check_output") as check_output:
+                KernelImageCreator._build_variable_index("/envs/python3/bin/python", "/notebook.ipynb", ["a", "b"])
+
+        # THEN
+        expected_command = ["/envs/python3/bin/python", KernelImageCreator.NOTEBOOK_EXECUTION_FILEPATH,
+            "--build-variable-index", "/notebook.ipynb", KernelImageCreator.VARIABLE_INDEX_FILEPATH, "--variables", "a", "b"]
+        self.assertEqual(["ionice", "-c", "3"] + expected_command, check_output.call_args[0][0])
+
+    def test_GIVEN_unparseable_notebook_WHEN_build_variable_index_THEN_continue_without_index(self):
+        error = subprocess.CalledProcessError(1, "python", output=b"error")
+        with patch("os.path.exists", return_value=False):
+            with patch("subprocess.check_output", side_effect=error):
+                KernelImageCreator._build_variable_index("/envs/python3/bin/python", "/notebook.ipynb", ["a"])
+
+    def test_GIVEN_dataset_variables_WHEN_create_interim_container_THEN_dataset_variables_in_environment(self):
+        # GIVEN
+        original_container = MagicMock()
+        kernel_spec = MagicMock(env={"PATH": "/envs/python3/bin"})
+
+        # WHEN
+        with patch("iota_notebook_containers.kernel_image_creator.EnvironmentKernelSpecManager") as spec_manager, \
+                patch.object(KernelImageCreator, "_delete_interim_container"), \
+                patch.object(KernelImageCreator, "docker_client") as docker_client:
+            spec_manager.return_value.get_kernel_spec.return_value = kernel_spec
+            docker_client.api.create_container.return_value = {"Id": "id", "Warnings": None}
+            KernelImageCreator._create_interim_container(original_container, "python3", "/notebook.ipynb", ["a", "b"])
+
+        # THEN
+        expected_environment = {"PATH": "/envs/python3/bin", KernelImageCreator.NOTEBOOK_PATH_ENV_VAR: "/notebook.ipynb",
+            KernelImageCreator.DATASET_VARIABLES_ENV_VAR: "a,b"}
+        self.assertEqual(expected_environment, docker_client.api.create_container.call_args[1]["environment"])
+
+    def test_GIVEN_environment_WHEN_estimate_THEN_copy_set_measured_without_docker(self):
+        # GIVEN
+        with tempfile.TemporaryDirectory() as env_folder:
+            package_folder = os.path.join(env_folder, "package")
+            os.makedirs(os.path.join(package_folder, "sub"))
+            self._write_file(os.path.join(package_folder, "sub", "big"), 300)
+            self._write_file(os.path.join(package_folder, "compiled.pyc"), 1000)
+            self._write_file(os.path.join(env_folder, "small"), 10)
+            os.link(os.path.join(env_folder, "small"), os.path.join(env_folder, "small_link"))
+            execution_file_bytes = os.path.getsize(os.path.join(os.path.dirname(kernel_image_creator.__file__),
+                KernelImageCreator.NOTEBOOK_EXECUTION_FILE))
+
+            # WHEN
+            with patch.object(KernelImageCreator, "_get_env_python_executable", return_value="/env/bin/python"), \
+                    patch.object(KernelImageCreator, "_get_folders_to_copy", return_value=[env_folder]), \
+                    patch.object(KernelImageCreator, "docker_client") as docker_client:
+                docker_client.info.return_value = {"DockerRootDir": env_folder}
+                estimate = KernelImageCreator.estimate("containerized_python3")
+
+        # THEN
+        docker_client.containers.assert_not_called()
+        docker_client.api.create_container.assert_not_called()
+        self.assertEqual(4, estimate["file_count"])
+        self.assertEqual(execution_file_bytes + 320, estimate["total_bytes"])
+        self.assertEqual(execution_file_bytes + 310, estimate["unique_bytes"])
+        self.assertEqual([{"path": package_folder, "bytes": 300}, {"path": env_folder, "bytes": 20}],
+            estimate["largest_directories"])
+        self.assertGreater(estimate["required_space_bytes"], KernelImageCreator.SPACE_REQUIREMENT_FUDGE_BYTES)
+        self.assertEqual(round(4 * KernelImageCreator.ESTIMATED_COPY_SECONDS_PER_FILE, 1), estimate["build_seconds"])
+
+    def _write_file(self, filepath, size):
+        with open(filepath, "wb") as f:
+            f.write(b"x" * size)
+
 if __name__ == '__main__':
     unittest.main()
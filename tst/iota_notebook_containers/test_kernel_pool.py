@@ -0,0 +1,74 @@
+import json
+import os
+import socket
+import tempfile
+import unittest
+
+from unittest.mock import patch, MagicMock
+
+from iota_notebook_containers import warm_kernel
+from iota_notebook_containers.kernel_pool import KernelPool
+
+class TestKernelPool(unittest.TestCase):
+    KERNEL_ARGV = ["/envs/python3/bin/python", "-m", "ipykernel", "-f", "{connection_file}"]
+
+    def setUp(self):
+        self.pool_folder = tempfile.TemporaryDirectory()
+        self.container = MagicMock()
+        self.container.client.api.exec_create.return_value = {"Id": "exec_id"}
+        with patch.object(KernelPool, "POOL_FOLDER", self.pool_folder.name):
+            self.kernel_pool = KernelPool(self.container, "conda_python3", self.KERNEL_ARGV, 2, ["pandas"])
+        self.kernel_folder = os.path.join(self.pool_folder.name, "conda_python3")
+        os.makedirs(self.kernel_folder)
+
+    def tearDown(self):
+        self.pool_folder.cleanup()
+
+    def test_GIVEN_ipykernel_argv_WHEN_is_poolable_THEN_true(self):
+        self.assertTrue(KernelPool.is_poolable(self.KERNEL_ARGV))
+
+    def test_GIVEN_other_kernel_argv_WHEN_is_poolable_THEN_false(self):
+        self.assertFalse(KernelPool.is_poolable(["R", "--slave", "-e", "IRkernel::main()", "--args", "{connection_file}"]))
+
+    def test_GIVEN_idle_kernel_WHEN_claim_THEN_send_claim_and_remove_from_pool(self):
+        # GIVEN
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(os.path.join(self.kernel_folder, "idle" + warm_kernel.READY_EXT))
+        server.listen(1)
+
+        # WHEN
+        connection = self.kernel_pool.claim("/runtime/kernel-1.json", {"VAR": "value"}, "/notebooks")
+
+        # THEN
+        kernel_end, _ = server.accept()
+        claim = json.loads(kernel_end.makefile("rb").readline().decode("utf-8"))
+        self.assertEqual({"argv": ["-f", "/runtime/kernel-1.json"], "env": {"VAR": "value"}, "cwd": "/notebooks"}, claim)
+        self.assertEqual([], os.listdir(self.kernel_folder))
+        for s in (connection, kernel_end, server):
+            s.close()
+
+    def test_GIVEN_stale_kernel_socket_WHEN_claim_THEN_none(self):
+        # GIVEN
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(os.path.join(self.kernel_folder, "stale" + warm_kernel.READY_EXT))
+        server.close()
+
+        # WHEN/THEN
+        self.assertIsNone(self.kernel_pool.claim("/runtime/kernel-1.json", {}, "/notebooks"))
+        self.assertEqual([], os.listdir(self.kernel_folder))
+
+    def test_GIVEN_one_pending_kernel_WHEN_fill_THEN_start_one_more(self):
+        # GIVEN
+        open(os.path.join(self.kernel_folder, "warming" + warm_kernel.PENDING_EXT), "w").close()
+
+        # WHEN
+        self.kernel_pool.fill({"VAR": "value"})
+
+        # THEN
+        api = self.container.client.api
+        expected_command = [self.KERNEL_ARGV[0], KernelPool.WARM_KERNEL_FILEPATH, self.kernel_folder, "pandas"]
+        api.exec_create.assert_called_once_with(self.container.id, expected_command, environment={"VAR": "value"})
+        api.exec_start.assert_called_once_with("exec_id", detach=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from unittest.mock import patch, MagicMock
+
+from iota_notebook_containers.constants import KERNEL_NAME_LABEL, KERNEL_ID_LABEL
+from iota_notebook_containers.kernel_resource_usage import KernelResourceUsage
+
+class TestKernelResourceUsage(unittest.TestCase):
+    def test_GIVEN_no_kernel_containers_WHEN_get_kernel_resource_usage_THEN_empty(self):
+        docker_client = MagicMock()
+        docker_client.containers.list.return_value = []
+        with patch("docker.from_env", return_value=docker_client):
+            self.assertEqual([], KernelResourceUsage.get_kernel_resource_usage())
+        docker_client.containers.list.assert_called_once_with(filters={"label": KERNEL_ID_LABEL})
+
+    def test_GIVEN_kernel_container_WHEN_get_kernel_resource_usage_THEN_usage_per_kernel(self):
+        # GIVEN
+        kernel_container = MagicMock()
+        kernel_container.labels = {KERNEL_NAME_LABEL: "conda_python3", KERNEL_ID_LABEL: "kernel-1"}
+        kernel_container.stats.return_value = {
+            "cpu_stats": {"cpu_usage": {"total_usage": 300}, "system_cpu_usage": 2000, "online_cpus": 4},
+            "precpu_stats": {"cpu_usage": {"total_usage": 100}, "system_cpu_usage": 1000},
+            "memory_stats": {"usage": 1024, "limit": 4096}
+        }
+        docker_client = MagicMock()
+        docker_client.containers.list.return_value = [kernel_container]
+
+        # WHEN
+        with patch("docker.from_env", return_value=docker_client):
+            observed = KernelResourceUsage.get_kernel_resource_usage()
+
+        # THEN
+        expected = [{"kernel_name": "conda_python3", "kernel_id": "kernel-1", "cpu_percent": 80.0,
+            "memory_usage_bytes": 1024, "memory_limit_bytes": 4096}]
+        self.assertEqual(expected, observed)
+
+    def test_GIVEN_no_cpu_samples_WHEN_get_cpu_percent_THEN_zero(self):
+        self.assertEqual(0.0, KernelResourceUsage._get_cpu_percent({"cpu_stats": {}, "precpu_stats": {}}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import fractions
+import unittest
+
+from unittest.mock import MagicMock
+
+from iota_notebook_containers.static import list_variables
+
+class TestListVariables(unittest.TestCase):
+
+    def setUp(self):
+        self.shell = MagicMock()
+        self.shell.user_ns = {}
+        self.shell.user_ns_hidden = {}
+        self.shell.kernel.comm_manager.targets = {}
+
+    def test_GIVEN_namespace_WHEN_list_variables_THEN_only_public_string_and_number_variables(self):
+        # GIVEN
+        self.shell.user_ns_hidden = {"exit": "hidden"}
+        self.shell.user_ns.update({"b": 1.5, "a": "text", "c": None, "d": True, "e": [1], "_f": 1,
+            "g": fractions.Fraction(1, 2), "exit": "hidden"})
+
+        # WHEN
+        variables = list_variables.list_variables(self.shell)
+
+        # THEN
+        self.assertEqual([{"varName": "a", "varType": "string"}, {"varName": "b", "varType": "double"},
+            {"varName": "c", "varType": "string"}, {"varName": "g", "varType": "double"}], variables)
+
+    def test_GIVEN_open_comm_WHEN_namespace_changes_THEN_changed_variables_sent(self):
+        # GIVEN
+        lister = list_variables.VariableLister(self.shell)
+        comm = MagicMock()
+        self.shell.user_ns.update({"a": 1, "b": 2})
+        lister.open(comm, {})
+        self.shell.user_ns.update({"a": "now a string", "c": 3})
+        del self.shell.user_ns["b"]
+
+        # WHEN
+        lister.post_execute()
+        lister.post_execute()
+
+        # THEN
+        self.assertEqual([
+            ({"variables": [{"varName": "a", "varType": "double"}, {"varName": "b", "varType": "double"}]},),
+            ({"added": [{"varName": "a", "varType": "string"}, {"varName": "c", "varType": "double"}],
+                "removed": ["b"]},)],
+            [call.args for call in comm.send.call_args_list])
+
+    def test_GIVEN_closed_comm_WHEN_namespace_changes_THEN_namespace_not_listed(self):
+        # GIVEN
+        lister = list_variables.VariableLister(self.shell)
+        comm = MagicMock()
+        lister.open(comm, {})
+        on_close = comm.on_close.call_args.args[0]
+        on_close({})
+        self.shell.user_ns.update({"a": 1})
+
+        # WHEN
+        lister.post_execute()
+
+        # THEN
+        comm.send.assert_called_once_with({"variables": []})
+
+    def test_GIVEN_registered_target_WHEN_register_THEN_not_registered_again(self):
+        # GIVEN
+        comm_manager = self.shell.kernel.comm_manager
+        list_variables.register(self.shell)
+        comm_manager.targets[list_variables.COMM_TARGET] = comm_manager.register_target.call_args.args[1]
+
+        # WHEN
+        list_variables.register(self.shell)
+
+        # THEN
+        comm_manager.register_target.assert_called_once()
+        self.shell.events.register.assert_called_once()
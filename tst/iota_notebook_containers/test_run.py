@@ -0,0 +1,250 @@
+import docker
+import os
+import signal
+import socket
+import unittest
+
+from unittest.mock import patch, MagicMock
+
+from iota_notebook_containers.constants import KERNEL_NAME_LABEL, KERNEL_ID_LABEL
+from iota_notebook_containers.run import ContainerizedKernelRunner, _ExecKernelProcess, _PooledKernelProcess, \
+    _KernelContainerProcess, _KernelOutputLog
+
+class TestKernelOutputLog(unittest.TestCase):
+    def setUp(self):
+        self.kernel_output_log = _KernelOutputLog()
+
+    def test_GIVEN_lines_split_across_chunks_WHEN_write_THEN_log_whole_lines(self):
+        # WHEN
+        with patch("iota_notebook_containers.run.logger") as logger:
+            for chunk in (b"first li", b"ne\nsecond line\nthi", b"rd"):
+                self.kernel_output_log.write(chunk)
+            self.kernel_output_log.close()
+
+        # THEN
+        expected = ["Kernel output: first line", "Kernel output: second line", "Kernel output: third"]
+        self.assertEqual(expected, [c[0][0] for c in logger.info.call_args_list])
+        self.assertEqual(["first line", "second line", "third"], list(self.kernel_output_log.tail))
+
+    def test_GIVEN_long_line_WHEN_write_THEN_truncate_line(self):
+        # WHEN
+        with patch.object(_KernelOutputLog, "MAX_LINE_BYTES", 4):
+            self.kernel_output_log.write(b"abcdefgh")
+            self.kernel_output_log.write(b"ij\nk\n")
+
+        # THEN
+        self.assertEqual(["abcd [truncated 6 bytes]", "k"], list(self.kernel_output_log.tail))
+
+    def test_GIVEN_output_over_log_limit_WHEN_write_THEN_stop_logging_but_keep_tail(self):
+        # WHEN
+        with patch.object(_KernelOutputLog, "MAX_LOGGED_BYTES", 10):
+            with patch.object(_KernelOutputLog, "TAIL_LINES", 2):
+                self.kernel_output_log = _KernelOutputLog()
+                with patch("iota_notebook_containers.run.logger") as logger:
+                    self.kernel_output_log.write(b"0123456789\nline 2\nline 3\nline 4\n")
+                    logged_before_close = len(logger.info.call_args_list)
+                    self.kernel_output_log.close()
+
+        # THEN
+        self.assertEqual(2, logged_before_close)
+        self.assertEqual(["line 3", "line 4"], list(self.kernel_output_log.tail))
+        self.assertEqual("Last 2 lines of kernel output:\nline 3\nline 4", logger.info.call_args_list[-1][0][0])
+
+class TestExecKernelProcess(unittest.TestCase):
+    def setUp(self):
+        self.container = MagicMock()
+        self.api = self.container.client.api
+        self.api.exec_create.return_value = {"Id": "exec_id"}
+        self.api.exec_start.return_value = iter([b"kernel ", b"output"])
+        self.api.exec_inspect.return_value = {"Pid": 1234, "Running": True}
+        self.kernel_process = _ExecKernelProcess(self.container, "python -m ipykernel -f /kernel.json")
+        # pidfds are only used by the tests that ask for them
+        patcher = patch("os.pidfd_open", side_effect=OSError(), create=True)
+        self.pidfd_open = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_GIVEN_kernel_not_started_WHEN_send_signal_THEN_no_signal(self):
+        with patch("os.kill") as kill:
+            self.kernel_process.send_signal(signal.SIGINT)
+        kill.assert_not_called()
+        self.container.exec_run.assert_not_called()
+
+    def test_GIVEN_running_kernel_WHEN_send_signal_THEN_signal_pid_directly(self):
+        # GIVEN
+        self.kernel_process.start()
+
+        # WHEN
+        with patch("os.kill") as kill:
+            self.kernel_process.send_signal(signal.SIGINT)
+
+        # THEN
+        self.api.exec_create.assert_called_once()
+        self.assertEqual("python -m ipykernel -f /kernel.json", self.api.exec_create.call_args[0][1])
+        self.assertEqual("{}:{}".format(os.getuid(), os.getgid()), self.api.exec_create.call_args[1]["user"])
+        kill.assert_called_once_with(1234, signal.SIGINT)
+        self.container.exec_run.assert_not_called()
+
+    def test_GIVEN_pid_reported_late_WHEN_start_THEN_wait_for_pid(self):
+        # GIVEN
+        self.api.exec_inspect.side_effect = [{"Pid": 0, "Running": False}, {"Pid": 0, "Running": False},
+            {"Pid": 1234, "Running": True}]
+
+        # WHEN
+        with patch("time.sleep"):
+            self.kernel_process.start()
+
+        # THEN
+        self.assertEqual(1234, self.kernel_process._kernel_pid)
+
+    def test_GIVEN_pid_never_reported_WHEN_send_signal_THEN_no_signal(self):
+        # GIVEN
+        self.api.exec_inspect.return_value = {"Pid": 0, "Running": False}
+        with patch("time.sleep"), patch("time.monotonic", side_effect=[0, 0, 10]):
+            self.kernel_process.start()
+
+        # WHEN
+        with patch("os.kill") as kill:
+            self.kernel_process.send_signal(signal.SIGINT)
+
+        # THEN
+        kill.assert_not_called()
+        self.container.exec_run.assert_not_called()
+
+    def test_GIVEN_pidfd_WHEN_send_signal_THEN_signal_through_pidfd_without_inspecting_exec(self):
+        # GIVEN
+        self.pidfd_open.side_effect = None
+        self.pidfd_open.return_value = 99
+        self.kernel_process.start()
+        self.api.exec_inspect.reset_mock()
+
+        # WHEN
+        with patch("signal.pidfd_send_signal", create=True) as pidfd_send_signal, patch("os.kill") as kill, \
+                patch("os.close") as close:
+            self.kernel_process.send_signal(signal.SIGINT)
+            self.kernel_process.terminate()
+
+        # THEN
+        self.assertEqual([((99, signal.SIGINT),), ((99, signal.SIGTERM),)],
+            [(call.args,) for call in pidfd_send_signal.call_args_list])
+        kill.assert_not_called()
+        self.api.exec_inspect.assert_not_called()
+        close.assert_called_once_with(99)
+
+    def test_GIVEN_kernel_exited_WHEN_send_signal_THEN_not_logged_as_sent(self):
+        # GIVEN
+        self.kernel_process.start()
+
+        # WHEN
+        with patch("os.kill", side_effect=ProcessLookupError()), \
+                patch("iota_notebook_containers.run.logger") as logger:
+            self.kernel_process.send_signal(signal.SIGINT)
+
+        # THEN
+        self.assertEqual(1, logger.info.call_count)
+        self.assertIn("already exited", logger.info.call_args[0][0])
+
+    def test_GIVEN_exited_kernel_WHEN_send_signal_THEN_no_signal(self):
+        # GIVEN
+        self.kernel_process.start()
+        self.api.exec_inspect.return_value = {"Pid": 1234, "Running": False}
+
+        # WHEN
+        with patch("os.kill") as kill:
+            self.kernel_process.terminate()
+
+        # THEN
+        kill.assert_not_called()
+
+    def test_GIVEN_no_permission_WHEN_send_signal_THEN_signal_namespace_pid_in_container(self):
+        # GIVEN
+        self.kernel_process.start()
+        self.container.exec_run.return_value = (0, b"")
+
+        # WHEN
+        with patch("os.kill", side_effect=PermissionError()):
+            with patch.object(self.kernel_process, "_get_namespace_pid", return_value=27):
+                self.kernel_process.send_signal(signal.SIGINT)
+
+        # THEN
+        self.container.exec_run.assert_called_once_with(["sh", "-c", "kill -s {} 27".format(int(signal.SIGINT))])
+
+class TestPooledKernelProcess(unittest.TestCase):
+    def setUp(self):
+        self.runner_end, self.kernel_end = socket.socketpair()
+        self.kernel_process = _PooledKernelProcess(self.runner_end)
+
+    def tearDown(self):
+        self.runner_end.close()
+        self.kernel_end.close()
+
+    def test_GIVEN_pooled_kernel_WHEN_send_signal_THEN_signal_number_written_to_socket(self):
+        self.kernel_process.send_signal(signal.SIGINT)
+        self.assertEqual("{}\n".format(int(signal.SIGINT)).encode(), self.kernel_end.recv(16))
+
+    def test_GIVEN_pooled_kernel_output_WHEN_start_THEN_output_read_until_closed(self):
+        # GIVEN
+        self.kernel_end.sendall(b"kernel output")
+        self.kernel_end.close()
+
+        # WHEN
+        observed = b"".join(self.kernel_process.start())
+
+        # THEN
+        self.assertEqual(b"kernel output", observed)
+
+class TestKernelContainerProcess(unittest.TestCase):
+    def setUp(self):
+        self.docker_client = MagicMock()
+        self.kernel_container = self.docker_client.containers.run.return_value
+        self.kernel_process = _KernelContainerProcess(self.docker_client, "image_id", "conda_python3",
+            "python -m ipykernel -f /runtime/kernel-1.json", "/runtime/kernel-1.json", cpu_shares=512, mem_limit="2g")
+
+    def test_GIVEN_limits_WHEN_start_THEN_run_labeled_container_with_limits(self):
+        # WHEN
+        self.kernel_process.start()
+
+        # THEN
+        args, kwargs = self.docker_client.containers.run.call_args
+        self.assertEqual(("image_id", "python -m ipykernel -f /runtime/kernel-1.json"), args)
+        self.assertEqual("containerized_kernel_kernel-1", kwargs["name"])
+        self.assertEqual(512, kwargs["cpu_shares"])
+        self.assertEqual("2g", kwargs["mem_limit"])
+        self.assertTrue(kwargs["init"])
+        self.assertEqual({KERNEL_NAME_LABEL: "conda_python3", KERNEL_ID_LABEL: "kernel-1"}, kwargs["labels"])
+        self.kernel_container.logs.assert_called_once_with(stream=True, follow=True)
+
+    def test_GIVEN_running_kernel_WHEN_send_signal_THEN_kill_container_with_signal(self):
+        self.kernel_process.start()
+        self.kernel_process.send_signal(signal.SIGINT)
+        self.kernel_container.kill.assert_called_once_with(signal=int(signal.SIGINT))
+
+    def test_GIVEN_removed_container_WHEN_terminate_THEN_no_error(self):
+        self.kernel_process.start()
+        self.kernel_container.stop.side_effect = docker.errors.NotFound("gone")
+        self.kernel_process.terminate()
+        self.kernel_container.remove.assert_not_called()
+
+class TestContainerizedKernelRunner(unittest.TestCase):
+    def setUp(self):
+        self.kernel_spec_manager = MagicMock()
+        self.kernel_spec_manager.get_kernel_spec.return_value.argv = ["python", "-m", "ipykernel", "-f", "{connection_file}"]
+        with patch("iota_notebook_containers.run.EnvironmentKernelSpecManager", return_value=self.kernel_spec_manager):
+            with patch("docker.from_env", MagicMock()):
+                self.runner = ContainerizedKernelRunner("conda_python3", "/kernel.json")
+
+    def test_GIVEN_no_pool_size_WHEN_get_kernel_pool_THEN_none(self):
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertIsNone(self.runner._get_kernel_pool())
+
+    def test_GIVEN_idle_pooled_kernel_WHEN_create_kernel_process_THEN_pooled_kernel(self):
+        kernel_pool = MagicMock()
+        kernel_pool.claim.return_value = MagicMock()
+        self.assertIsInstance(self.runner._create_kernel_process(kernel_pool), _PooledKernelProcess)
+
+    def test_GIVEN_no_idle_pooled_kernel_WHEN_create_kernel_process_THEN_exec_kernel(self):
+        kernel_pool = MagicMock()
+        kernel_pool.claim.return_value = None
+        self.assertIsInstance(self.runner._create_kernel_process(kernel_pool), _ExecKernelProcess)
+
+if __name__ == '__main__':
+    unittest.main()